@@ -21,6 +21,10 @@ class task(Task):
             comp_var = '<'
 
         self.debug(f'{vbatt:.1f}V {comp_var} threshold: {self.cubesat.vlowbatt:.1f}V')
+        # the power monitor shares i2c1 with the imu: wait for the bus rather than block it
+        vsys,idraw = await self.cubesat.power_readings()
+        if vsys is not None:
+            self.debug(f'system {vsys:.2f}V, {idraw*1000:.0f}mA',2)
 
         ########### ADVANCED ###########
         # respond to a low power condition
@@ -2,6 +2,7 @@
 
 from Tasks.template_task import Task
 import cdh
+import downlink
 
 ANTENNA_ATTACHED = False
 
@@ -30,6 +31,8 @@ class task(Task):
         # set our radiohead node ID so we can get ACKs
         self.cubesat.radio1.node = 0xFA # our ID
         self.cubesat.radio1.destination = 0xAB # target's ID
+        # ACK packets sent to us, but only if an antenna is attached
+        self.cubesat.radio1_rx.ack = ANTENNA_ATTACHED
 
     async def main_task(self):
         """
@@ -39,7 +42,8 @@ class task(Task):
         """
         if ANTENNA_ATTACHED:
             self.debug("Sending beacon")
-            self.cubesat.radio1.send("Hello World!",destination=0xFF,keep_listening=True)
+            # other tasks keep running during the airtime
+            await self.cubesat.radio1_tx.send(downlink.BEACON,"Hello World!",destination=0xFF,owner=self.name)
         else:
             # Fake beacon since we don't know if an antenna is attached
             print() # blank line
@@ -47,40 +51,42 @@ class task(Task):
             self.debug("NOT sending beacon (unknown antenna state)",2)
             self.debug("If you've attached an antenna, edit '/Tasks/beacon_task.py' to actually beacon", 2)
             print() # blank line
-            self.cubesat.radio1.listen()
 
+        # the radio task keeps radio1 listening and queues what it hears
         self.debug("Listening 10s for response (non-blocking)")
-        heard_something = await self.cubesat.radio1.await_rx(timeout=10)
-
-        if heard_something:
-            # retrieve response but don't ACK back unless an antenna is attached
-            response = self.cubesat.radio1.receive(keep_listening=True,with_ack=ANTENNA_ATTACHED)
-            if response is not None:
-                self.debug("packet received")
-                self.debug(f'msg: {response}, RSSI: {self.cubesat.radio1.last_rssi-137}', 2)
-
-                self.cubesat.c_gs_resp+=1
+        rx = self.cubesat.radio1_rx
+        packet = await rx.queue.get_async(10)
+        if packet is None:
+            self.debug('no messages')
+        while packet is not None:
+            response = bytes(packet.data)
+            self.debug("packet received")
+            self.debug(f'msg: {response}, RSSI: {packet.rssi}, SNR: {packet.snr}', 2)
+            rx.queue.release(packet)
+            self.cubesat.c_gs_resp+=1
 
-                """
-                ########### ADVANCED ###########
-                Over-the-air commands
-                See beep-sat guide for more details
-                """
-                if len(response) >= 6:
-                    if not ANTENNA_ATTACHED:
-                        self.debug('Antenna not attached. Skipping over-the-air command handling')
-                    else:
-                        if response[:4]==self.super_secret_code:
-                            cmd=bytes(response[4:6]) # [pass-code(4 bytes)] [cmd 2 bytes] [args]
-                            cmd_args=None
-                            if len(response) > 6:
-                                self.debug('command with args',2)
-                                try:
-                                    cmd_args=response[6:] # arguments are everything after
-                                    self.debug(f'cmd args: {cmd_args}', 2)
-                                except Exception as e:
-                                    self.debug(f'arg decoding error: {e}', 2)
-                            if cmd in cdh.commands:
+            """
+            ########### ADVANCED ###########
+            Over-the-air commands
+            See beep-sat guide for more details
+            """
+            if len(response) >= 6:
+                if not ANTENNA_ATTACHED:
+                    self.debug('Antenna not attached. Skipping over-the-air command handling')
+                else:
+                    if response[:4]==self.super_secret_code:
+                        cmd=bytes(response[4:6]) # [pass-code(4 bytes)] [cmd 2 bytes] [args]
+                        cmd_args=None
+                        if len(response) > 6:
+                            self.debug('command with args',2)
+                            try:
+                                cmd_args=response[6:] # arguments are everything after
+                                self.debug(f'cmd args: {cmd_args}', 2)
+                            except Exception as e:
+                                self.debug(f'arg decoding error: {e}', 2)
+                        if cmd in cdh.commands:
+                            # commands may reply over the radio
+                            async with self.cubesat.radio1_lease:
                                 try:
                                     if cmd_args is None:
                                         self.debug(f'running {cdh.commands[cmd]} (no args)')
@@ -90,13 +96,11 @@ class task(Task):
                                         self.cmd_dispatch[cdh.commands[cmd]](self,cmd_args)
                                 except Exception as e:
                                     self.debug(f'something went wrong: {e}')
-                                    self.cubesat.radio1.send(str(e).encode())
-                            else:
-                                self.debug('invalid command!')
-                                self.cubesat.radio1.send(b'invalid cmd'+response[4:])
-        else:
-            self.debug('no messages')
-        self.cubesat.radio1.sleep()
+                                    self.cubesat.radio1_tx.put(downlink.RESPONSE,str(e),owner=self.name)
+                        else:
+                            self.debug('invalid command!')
+                            self.cubesat.radio1_tx.put(downlink.RESPONSE,b'invalid cmd'+response[4:],owner=self.name)
+            packet = rx.queue.get()
         self.debug('finished')
 
 
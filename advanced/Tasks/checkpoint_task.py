@@ -0,0 +1,17 @@
+# Periodically save the schedule phase of every task to the SD card
+# A reset between saves resumes from a phase up to 10s old; hreset and main.py's
+# fail-safe save it once more on the way down.
+
+from Tasks.template_task import Task
+from tasko import checkpoint
+
+class task(Task):
+    priority = 254
+    frequency = 1/10 # once every 10s
+    name='chkpt'
+    color = 'gray'
+
+    record = bytearray(checkpoint.RECORD_SIZE)
+
+    async def main_task(self):
+        self.cubesat.save_schedule(self.record)
@@ -0,0 +1,22 @@
+# Send what radio1's services have queued, apart from the RX task so it never waits on the airtime
+
+from Tasks.template_task import Task
+
+class task(Task):
+    priority = 3
+    frequency = 10
+    name='downlink'
+    color = 'blue'
+
+    async def main_task(self):
+        if not self.cubesat.hardware['Radio1']:
+            return
+        # adaptive data rate: negotiates profile changes with the ground, see lib/adr.py
+        await self.cubesat.radio1_rate.update()
+        # telemetry frames that have waited long enough, queued in the BULK class
+        await self.cubesat.radio1_telemetry.poll()
+        # store-and-forward messages for other ground nodes, replies queued the same way
+        if self.cubesat.radio1_mail is not None:
+            await self.cubesat.radio1_mail.poll()
+        # replies and anything else queued without waiting, see lib/downlink.py
+        await self.cubesat.radio1_tx.poll()
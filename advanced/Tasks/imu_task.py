@@ -2,8 +2,14 @@
 
 from Tasks.template_task import Task
 import msgpack
+import io
 import os
+import struct
 from os import stat
+import file_downlink
+import lzss
+import aggregate
+import downlink
 
 SEND_DATA = False # make sure you have an antenna attached!
 
@@ -13,6 +19,7 @@ class task(Task):
     name='imu'
     color = 'green'
     data_file = None
+    file_id = 0
 
     # we want to initialize the data file only once upon boot
     # so perform our task init and use that as a chance to init the data files
@@ -21,16 +28,21 @@ class task(Task):
         self.data_file=self.cubesat.new_file('/data/imu',binary=True)
 
     async def main_task(self):
-        # take IMU readings
+        # take IMU readings (one burst read that waits its turn on the i2c bus)
+        accel, mag, gyro = await self.cubesat.imu_readings()
         readings = {
-            'accel':self.cubesat.acceleration,
-            'mag':  self.cubesat.magnetic,
-            'gyro': self.cubesat.gyro,
+            'accel':accel,
+            'mag':  mag,
+            'gyro': gyro,
         }
 
         # store them in our cubesat data_cache object
         self.cubesat.data_cache.update({'imu':readings})
 
+        if SEND_DATA and self.cubesat.hardware['IMU']:
+            # 36 bytes: shares a telemetry frame with other messages rather than taking a packet
+            await self.cubesat.radio1_telemetry.put(aggregate.TELEMETRY,struct.pack('<9f',*accel,*mag,*gyro))
+
         # print the readings with some fancy formatting
         self.debug('IMU readings (x,y,z)')
         for imu_type in self.cubesat.data_cache['imu']:
@@ -38,21 +50,32 @@ class task(Task):
 
         # save data to the sd card, but only if we have a proper data file
         if self.data_file is not None:
-            # save our readings using msgpack
-            with open(self.data_file,'ab') as f:
-                msgpack.pack(readings,f)
+            # save our readings using msgpack (taking our turn on the shared spi bus)
+            record = io.BytesIO()
+            msgpack.pack(readings,record)
+            await self.cubesat.write_file(self.data_file,record.getvalue())
             # check if the file is getting bigger than we'd like
             if stat(self.data_file)[6] >= 256: # bytes
                 if SEND_DATA:
                     print(f'\nSend IMU data file: {self.data_file}')
-                    with open(self.data_file,'rb') as f:
-                        chunk = f.read(64) # each IMU readings is 64 bytes when encoded
-                        while chunk:
-                            # we could send bigger chunks, radio packet can take 252 bytes
-                            self.cubesat.radio1.send(chunk)
-                            print(chunk)
-                            chunk = f.read(64)
-                    print('finished\n')
+                    # full 248 byte fragments, the ground NACKs whatever it missed
+                    # bulk class: command replies and the beacon go between fragments
+                    link = file_downlink.RadioLink(self.cubesat.radio1_tx.sender(downlink.BULK),
+                        self.cubesat.radio1_rx.channel(file_downlink.CHANNEL))
+                    # the msgpack keys repeat in every record, so compress first
+                    packed = self.data_file[:-4]+'.lz'
+                    ratio = await lzss.compress_file(self.data_file,packed,lease=self.cubesat.sd_lease)
+                    print(ratio)
+                    with open(packed,'rb') as f:
+                        # sd reads and radio sends each take a turn on the spi bus
+                        sender = file_downlink.FileSender(link,f,ratio.bytes_out,self.file_id,
+                            lease=self.cubesat.sd_lease,encoding=file_downlink.LZSS)
+                        sent = await sender.send()
+                    # the data file stays, the compressed copy was only for the downlink
+                    async with self.cubesat.sd_lease:
+                        os.remove(packed)
+                    self.file_id = (self.file_id + 1) & 0xFF
+                    print('finished' if sent else 'incomplete', sender.stats, '\n')
                 else:
                     # print the unpacked data from the file
                     print(f'\nPrinting IMU data file: {self.data_file}')
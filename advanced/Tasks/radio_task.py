@@ -0,0 +1,15 @@
+# Keep radio1 listening and queue up whatever it hears
+
+from Tasks.template_task import Task
+
+class task(Task):
+    priority = 2
+    frequency = 10 # DIO0 is a pin read, so idle polls are cheap
+    name='radio'
+    color = 'orange'
+
+    async def main_task(self):
+        if not self.cubesat.hardware['Radio1']:
+            return
+        # never waits on a transmission: anything to send goes through Tasks/downlink_task.py
+        await self.cubesat.radio1_rx.poll()
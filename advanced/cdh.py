@@ -1,4 +1,5 @@
 import time
+import downlink
 
 commands = {
     b'\x8eb': 'no-op',
@@ -16,7 +17,14 @@ def noop(self):
 def hreset(self):
     self.debug('Resetting')
     try:
-        self.cubesat.radio1.send(data=b'resetting')
+        # jumps ahead of any bulk data, and goes out before the reset
+        self.cubesat.radio1_tx.put(downlink.RESPONSE, b'resetting')
+        self.cubesat.radio1_tx.flush()
+        # the checkpoint task's copy can be up to 10s old
+        try:
+            self.cubesat.save_schedule()
+        except OSError as e:
+            self.debug(f'schedule not saved: {e}')
         self.cubesat.micro.on_next_reset(self.cubesat.micro.RunMode.NORMAL)
         self.cubesat.micro.reset()
     except:
@@ -46,7 +54,7 @@ def shutdown(self,args):
 
 def query(self,args):
     self.debug(f'query: {args}')
-    self.cubesat.radio1.send(data=str(eval(args)), keep_listening=True)
+    self.cubesat.radio1_tx.put(downlink.RESPONSE, str(eval(args)))
 
 def exec_cmd(self,args):
     self.debug(f'exec: {args}')
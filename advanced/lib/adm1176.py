@@ -28,6 +28,8 @@ _BUFFER = bytearray(3)
 _STATUS = bytearray(1)
 
 class ADM1176:
+    # optional tasko.ManagedI2C device handle for async reads
+    i2c_handle = None
 
     def __init__(self, i2c_bus, addr=0x4A):
         self.i2c_device = I2CDevice(i2c_bus, addr, probe=False)
@@ -53,6 +55,16 @@ class ADM1176:
     def read(self):
         with self.i2c_device as i2c:
             i2c.readinto(_BUFFER)
+        return self._convert()
+
+    async def read_async(self):
+        # same as read() but waits for its turn on a tasko.ManagedI2C bus
+        if self.i2c_handle is None:
+            return self.read()
+        await self.i2c_handle.readinto(_BUFFER)
+        return self._convert()
+
+    def _convert(self):
         # [print(hex(i),end=',') for i in _BUFFER]
         raw_voltage = ((_BUFFER[0]<<8) | (_BUFFER[2]&DATA_V_MASK))>>4
         raw_current = (_BUFFER[1]<<4) | (_BUFFER[2]&DATA_I_MASK)
@@ -0,0 +1,262 @@
+"""
+Adaptive data rate for the UHF link.
+
+The satellite tracks the SNR of packets from the ground and moves along a ladder of modem
+profiles (see RFM9x.define_profile()), ordered from the most robust to the fastest: a higher
+SF and CR when the margin is poor, a lower SF and a wider bandwidth when there is margin to
+spare. A change is negotiated so both ends switch together. Frames travel as RadioHead
+payloads with RATE_CHANNEL in the low nibble of the header flags:
+
+    PROPOSE [0x01][sequence][ladder index]    sat -> ground, on the current profile
+    ACCEPT  [0x02][sequence][ladder index]    ground -> sat, on the current profile
+
+The satellite switches when the ACCEPT arrives, the ground right after sending it. If either
+end hears nothing from the other for fallback_timeout seconds on a non-default profile it
+falls back to the default one, so a switch to a rate the link can't carry only costs a
+timeout, and the ground can always find the satellite again on the default profile.
+
+Margin is the average SNR, corrected for the bandwidth of the candidate profile, minus the
+demodulator floor of its spreading factor. The link is assumed to be symmetric: the ground
+hears the satellite about as well as the satellite hears the ground.
+
+    rate = RateController(cubesat.radio1_rx, ('robust', 'slow', 'beacon', 'fast', 'downlink'), default=2)
+    cubesat.radio1_rx.monitor = rate.observe
+    # from a frequent task
+    await rate.update()
+"""
+import math
+import time
+
+RATE_CHANNEL = 0x02
+"""RadioHead flags (low nibble) marking rate negotiation frames"""
+
+PROPOSE = 0x01
+ACCEPT = 0x02
+
+# SNR (dB) the SX127x needs to demodulate each spreading factor (SX1276 datasheet table 13)
+SNR_FLOOR = {6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+
+# states
+IDLE = 0
+PROPOSED = 1
+
+
+def _noise_db(bandwidth):
+    # 10 * log10(bandwidth): the noise in the channel grows with its width
+    return 10 * math.log(bandwidth) / math.log(10)
+
+
+class RateStats:
+    def __init__(self):
+        self.samples = 0
+        self.proposals = 0
+        self.unanswered = 0
+        self.ups = 0
+        self.downs = 0
+        self.fallbacks = 0
+
+    def __repr__(self):
+        return "{{RateStats {} samples, {} proposals ({} unanswered), {} up, {} down, {} fallbacks}}".format(
+            self.samples, self.proposals, self.unanswered, self.ups, self.downs, self.fallbacks)
+
+    __str__ = __repr__
+
+
+class RateController:
+    """
+    Satellite side: picks a profile from the SNR of received packets and negotiates it.
+
+    :param service: radio_service.RadioService for the radio; its RATE_CHANNEL queue gets the replies
+    :param ladder: names of profiles defined on the radio, most robust first
+    :param default: ladder index of the profile the radio starts on and falls back to
+    :param up_margin: margin (dB) the next faster profile needs before stepping up
+    :param down_margin: step down when the current profile's margin drops below this (dB)
+    :param min_samples: packets to average after a change before deciding again
+    :param holdoff: seconds after a change (or an unanswered proposal) before the next one
+    :param fallback_timeout: seconds without hearing the ground before returning to default
+    :param reply_timeout: seconds to wait for an ACCEPT
+    """
+    def __init__(self, service, ladder, *, default=0, up_margin=8.0, down_margin=3.0, min_samples=4,
+                 holdoff=30.0, fallback_timeout=60.0, reply_timeout=5.0, destination=None):
+        self.service = service
+        self.radio = service.radio
+        self.queue = service.channel(RATE_CHANNEL)
+        self.ladder = tuple(ladder)
+        profiles = [self.radio.profiles[name] for name in self.ladder]
+        self._floor = [SNR_FLOOR[p.spreading_factor] for p in profiles]
+        self._noise = [_noise_db(p.signal_bandwidth) for p in profiles]
+        self.default = default
+        self.index = default
+        """ladder index of the profile in use"""
+        self.up_margin = up_margin
+        self.down_margin = down_margin
+        self.min_samples = min_samples
+        self.holdoff = holdoff
+        self.fallback_timeout = fallback_timeout
+        self.reply_timeout = reply_timeout
+        self.destination = destination
+        self.snr = 0.0
+        """average SNR (dB) of recent packets on the current profile"""
+        self.rssi = 0.0
+        self.stats = RateStats()
+        self.state = IDLE
+        self._samples = 0
+        self._sequence = 0
+        self._proposed = 0
+        self._deadline = 0.0
+        self._changed = time.monotonic()
+        self._heard = self._changed
+        self._frame = bytearray(3)
+
+    @property
+    def profile(self):
+        return self.ladder[self.index]
+
+    def observe(self, packet):
+        """Feed a received packet (a radio_service.RxPacket). Use as RadioService.monitor."""
+        self.observe_status(packet.rssi, packet.snr, packet.timestamp)
+
+    def observe_status(self, rssi, snr, now=None):
+        """Feed the (RSSI, SNR) of a received packet, e.g. RFM9x.packet_status"""
+        self._heard = time.monotonic() if now is None else now
+        self.stats.samples += 1
+        if self._samples == 0:
+            self.snr = snr
+            self.rssi = rssi
+        else:
+            # exponential average, weighting the last few packets
+            self.snr += (snr - self.snr) / 4
+            self.rssi += (rssi - self.rssi) / 4
+        self._samples += 1
+
+    def margin(self, index):
+        """predicted SNR margin (dB) on ladder[index] from the average on the current profile"""
+        return self.snr + self._noise[self.index] - self._noise[index] - self._floor[index]
+
+    def target(self):
+        """The ladder index the link conditions call for (hysteresis included)"""
+        current = self.index
+        if self.margin(current) < self.down_margin:
+            # fastest more robust profile with a comfortable margin, else the most robust
+            for index in range(current - 1, -1, -1):
+                if self.margin(index) >= self.up_margin:
+                    return index
+            return 0
+        # one step at a time on the way up
+        if current + 1 < len(self.ladder) and self.margin(current + 1) >= self.up_margin:
+            return current + 1
+        return current
+
+    async def update(self, now=None):
+        """Run the negotiation. Cheap when there is nothing to do; call from a frequent task."""
+        if now is None:
+            now = time.monotonic()
+        if self.index != self.default and now - self._heard > self.fallback_timeout:
+            self.stats.fallbacks += 1
+            await self._switch(self.default, now)
+            return
+        if self.state == PROPOSED:
+            await self._await_accept(now)
+            return
+        if self._samples < self.min_samples or now - self._changed < self.holdoff:
+            return
+        index = self.target()
+        if index != self.index:
+            await self._propose(index, now)
+
+    async def _propose(self, index, now):
+        self._sequence = (self._sequence + 1) & 0xFF
+        self._proposed = index
+        self._frame[0] = PROPOSE
+        self._frame[1] = self._sequence
+        self._frame[2] = index
+        self.stats.proposals += 1
+        self.state = PROPOSED
+        self._deadline = now + self.reply_timeout
+        await self.radio.send_async(self._frame, destination=self.destination, flags=RATE_CHANNEL,
+                                    keep_listening=True, lease=self.service.lease, owner='adr')
+
+    async def _await_accept(self, now):
+        packet = self.queue.get()
+        while packet is not None:
+            data = packet.data
+            accepted = len(data) >= 3 and data[0] == ACCEPT and data[1] == self._sequence \
+                and data[2] == self._proposed
+            self.queue.release(packet)
+            if accepted:
+                await self._switch(self._proposed, now)
+                return
+            packet = self.queue.get()
+        if now >= self._deadline:
+            self.stats.unanswered += 1
+            self.state = IDLE
+            self._changed = now
+
+    async def _switch(self, index, now):
+        if index > self.index:
+            self.stats.ups += 1
+        elif index < self.index:
+            self.stats.downs += 1
+        lease = self.service.lease
+        if lease is None:
+            self.radio.use_profile(self.ladder[index])
+        else:
+            async with lease:
+                self.radio.use_profile(self.ladder[index])
+        # apply_profile leaves the radio in standby: RadioService.poll() starts listening again
+        self.index = index
+        self.state = IDLE
+        self._samples = 0
+        self._changed = now
+        self._heard = now
+
+    def __repr__(self):
+        return "{{RateController {} ({}/{}), SNR {:.1f}dB, margin {:.1f}dB, {}}}".format(
+            self.profile, self.index, len(self.ladder), self.snr, self.margin(self.index), self.stats)
+
+    __str__ = __repr__
+
+
+class RateResponder:
+    """
+    Ground side of the negotiation. Feed it every packet from the satellite: handle() returns
+    an ACCEPT to send back (on the current profile) for a PROPOSE, then `index` changes.
+    Call check() now and then to fall back to the default profile when the satellite is gone.
+    """
+    def __init__(self, ladder, *, default=0, fallback_timeout=60.0):
+        self.ladder = tuple(ladder)
+        self.default = default
+        self.index = default
+        self.fallback_timeout = fallback_timeout
+        self.fallbacks = 0
+        self._heard = time.monotonic()
+        self._reply = bytearray(3)
+
+    @property
+    def profile(self):
+        return self.ladder[self.index]
+
+    def handle(self, frame, length=None, flags=RATE_CHANNEL, now=None):
+        """Process one packet payload. Returns the ACCEPT frame for a PROPOSE, otherwise None."""
+        self._heard = time.monotonic() if now is None else now
+        if length is None:
+            length = len(frame)
+        if flags & 0x0F != RATE_CHANNEL or length < 3 or frame[0] != PROPOSE or frame[2] >= len(self.ladder):
+            return None
+        self._reply[0] = ACCEPT
+        self._reply[1] = frame[1]
+        self._reply[2] = frame[2]
+        # the reply still goes out on the old profile
+        self.index = frame[2]
+        return self._reply
+
+    def check(self, now=None):
+        """Fall back to the default profile after fallback_timeout of silence. Returns True if it did."""
+        if now is None:
+            now = time.monotonic()
+        if self.index != self.default and now - self._heard > self.fallback_timeout:
+            self.index = self.default
+            self._heard = now
+            self.fallbacks += 1
+            return True
+        return False
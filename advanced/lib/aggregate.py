@@ -0,0 +1,199 @@
+"""
+Packing small messages into full radio packets.
+
+Every packet pays for its preamble, header and the turnaround around it, so a 12 byte
+beacon or a 36 byte IMU reading sent on its own spends most of its airtime on overhead.
+An Aggregator collects typed messages into one frame and sends it when the next message
+wouldn't fit or when the oldest message has waited `deadline` seconds. Frames travel as
+RadioHead payloads with CHANNEL in the low nibble of the header flags:
+
+    [sequence][type][length][data ...][type][length][data ...] ...
+
+Types are 1-255 (TELEMETRY, LOG and RESPONSE are predefined), a message is at most
+MAX_MESSAGE bytes. The sequence number lets the ground count lost frames. Unpacker is
+the ground side.
+
+    link = file_downlink.RadioLink(cubesat.radio1, None, lease=cubesat.radio1_lease,
+                                   owner='telemetry', channel=aggregate.CHANNEL)
+    telemetry = Aggregator(link, deadline=30)
+    await telemetry.put(aggregate.TELEMETRY, reading)
+    # from a frequent task
+    await telemetry.poll()
+
+The sender only needs a link with `async send(frame, length)` returning the time on air,
+like file_downlink.RadioLink. The link may hold on to the frame until it returns (a
+DownlinkScheduler sender waits for room before copying it), so one frame is in flight at a
+time and a second flush waits for it.
+"""
+import time
+import tasko
+
+CHANNEL = 0x03
+"""RadioHead flags (low nibble) marking aggregated frames"""
+
+TELEMETRY = 0x01
+LOG = 0x02
+RESPONSE = 0x03
+
+FRAME = 252
+_RECORD = 2
+MAX_MESSAGE = FRAME - 1 - _RECORD
+
+
+class AggregateStats:
+    """Sender counters. Airtime is what the link reports for the frames sent (seconds)."""
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        """message bytes, without the record headers"""
+        self.frames = 0
+        self.full = 0
+        """frames sent because the next message didn't fit"""
+        self.expired = 0
+        """frames sent because of the deadline"""
+        self.dropped = 0
+        """messages too long for a frame"""
+        self.airtime = 0.0
+
+    @property
+    def messages_per_frame(self):
+        return self.messages / self.frames if self.frames else 0.0
+
+    @property
+    def airtime_per_byte(self):
+        return self.airtime / self.bytes if self.bytes else 0.0
+
+    def __repr__(self):
+        return "{{AggregateStats {} messages ({}B) in {} frames ({} full, {} expired), {} dropped, " \
+               "airtime {:.2f}s}}".format(self.messages, self.bytes, self.frames, self.full,
+                                          self.expired, self.dropped, self.airtime)
+
+    __str__ = __repr__
+
+
+class Aggregator:
+    """
+    Collects messages into frames for a link.
+
+    :param link: see the module docstring
+    :param size: frame size in bytes, at most FRAME
+    :param deadline: seconds the first message of a frame may wait before the frame goes out
+    :param poll: seconds between checks while the previous frame is still with the link
+    """
+    def __init__(self, link, *, size=FRAME, deadline=10.0, poll=0.05):
+        self.link = link
+        self.size = min(size, FRAME)
+        self.deadline = deadline
+        self.poll_interval = poll
+        self.stats = AggregateStats()
+        # messages go into one frame while the other is on its way out
+        self._frames = (bytearray(self.size), bytearray(self.size))
+        self._frame = self._frames[0]
+        self._length = 1
+        self._sequence = 0
+        self._due = 0.0
+        self._sending = False
+
+    def __len__(self):
+        """bytes waiting in the current frame"""
+        return self._length - 1
+
+    def fits(self, length):
+        """True if a message of length bytes fits in the current frame"""
+        return self._length + _RECORD + length <= self.size
+
+    async def put(self, kind, data, *, now=None):
+        """
+        Queue a message of type kind (1-255). Sends the current frame first if data doesn't
+        fit. Returns False if data can never fit in a frame.
+        """
+        length = len(data)
+        if length > self.size - 1 - _RECORD:
+            self.stats.dropped += 1
+            return False
+        while not self.fits(length):
+            self.stats.full += 1
+            await self.flush()
+        if now is None:
+            now = time.monotonic()
+        if self._length == 1:
+            self._due = now + self.deadline
+        frame = self._frame
+        i = self._length
+        frame[i] = kind
+        frame[i + 1] = length
+        frame[i + 2:i + 2 + length] = data
+        self._length = i + 2 + length
+        self.stats.messages += 1
+        self.stats.bytes += length
+        return True
+
+    async def poll(self, now=None):
+        """Send the current frame if its deadline has passed. Call from a frequent task."""
+        if self._length == 1:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if now < self._due:
+            return False
+        self.stats.expired += 1
+        return await self.flush()
+
+    async def flush(self):
+        """Send whatever is in the current frame now. Returns False if it was empty."""
+        # the other buffer is still with the link until its send returns
+        while self._sending and self._length > 1:
+            await tasko.sleep(self.poll_interval)
+        if self._length == 1:
+            return False
+        frame = self._frame
+        frame[0] = self._sequence
+        self._sequence = (self._sequence + 1) & 0xFF
+        length = self._length
+        self._frame = self._frames[1] if frame is self._frames[0] else self._frames[0]
+        self._length = 1
+        self.stats.frames += 1
+        self._sending = True
+        try:
+            self.stats.airtime += await self.link.send(frame, length)
+        finally:
+            self._sending = False
+        return True
+
+
+class Unpacker:
+    """
+    Ground side: splits frames back into messages and counts lost frames from the
+    sequence numbers.
+    """
+    def __init__(self):
+        self.frames = 0
+        self.messages = 0
+        self.lost = 0
+        self.errors = 0
+        """frames with a truncated record"""
+        self._next = None
+
+    def unpack(self, frame, length=None):
+        """A list of (type, data) for the messages in frame[:length]"""
+        if length is None:
+            length = len(frame)
+        messages = []
+        if length < 1:
+            self.errors += 1
+            return messages
+        sequence = frame[0]
+        if self._next is not None:
+            self.lost += (sequence - self._next) & 0xFF
+        self._next = (sequence + 1) & 0xFF
+        self.frames += 1
+        i = 1
+        while i < length:
+            if i + _RECORD > length or i + _RECORD + frame[i + 1] > length:
+                self.errors += 1
+                break
+            end = i + _RECORD + frame[i + 1]
+            messages.append((frame[i], bytes(frame[i + _RECORD:end])))
+            i = end
+        self.messages += len(messages)
+        return messages
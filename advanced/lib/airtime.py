@@ -0,0 +1,96 @@
+"""
+Airtime budget for a radio: a token bucket of transmit seconds.
+
+The bucket holds up to `seconds` of airtime and refills at seconds/window per second, so over
+any window the radio transmits at most about `seconds` plus one full bucket. Senders draw the
+time on air of each packet (RFM9x.time_on_air()) before transmitting:
+
+    budget = AirtimeBudget(36, 3600)     # 1% duty cycle
+    cubesat.radio1.airtime_budget = budget
+    await cubesat.radio1.send_async(data, owner='beacon')   # waits for the budget if need be
+
+RFM9x.send() refuses a packet the budget can't cover right away; send_async() sleeps until it
+can, or refuses it when the wait would be longer than max_wait. Airtime is tallied per owner
+(usually the task name) for telemetry.
+"""
+import time
+import tasko
+
+
+class AirtimeBudget:
+    """
+    :param seconds: airtime allowed per window, also the bucket size
+    :param window: seconds over which the budget refills completely
+    :param max_wait: longest reserve() will sleep for a packet, None to wait as long as needed
+    """
+    def __init__(self, seconds, window, *, max_wait=None):
+        self.capacity = seconds
+        self.window = window
+        self.rate = seconds / window
+        self.max_wait = max_wait
+        self._tokens = float(seconds)
+        self._stamp = time.monotonic()
+        self.used = {}
+        """airtime (seconds) by owner"""
+        self.total = 0.0
+        self.packets = 0
+        self.delayed = 0
+        self.rejected = 0
+
+    def _refill(self, now):
+        if now is None:
+            now = time.monotonic()
+        if now > self._stamp:
+            self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+
+    def available(self, now=None):
+        """seconds of airtime that can be spent right now"""
+        self._refill(now)
+        return self._tokens
+
+    def wait_time(self, airtime, now=None):
+        """seconds until airtime can be spent, or None if it never fits in the bucket"""
+        if airtime > self.capacity:
+            return None
+        self._refill(now)
+        deficit = airtime - self._tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def spend(self, airtime, owner=None, now=None):
+        """Charge airtime whether or not it is available (the bucket can go into debt)"""
+        self._refill(now)
+        self._tokens -= airtime
+        self.total += airtime
+        self.packets += 1
+        self.used[owner] = self.used.get(owner, 0.0) + airtime
+
+    def try_spend(self, airtime, owner=None, now=None):
+        """Charge airtime if it is available now. Returns False (and counts a rejection) if not."""
+        self._refill(now)
+        if airtime > self._tokens:
+            self.rejected += 1
+            return False
+        self.spend(airtime, owner, now)
+        return True
+
+    async def reserve(self, airtime, owner=None):
+        """Sleep until airtime is available and charge it. Returns False if it was refused."""
+        wait = self.wait_time(airtime)
+        if wait is None or (self.max_wait is not None and wait > self.max_wait):
+            self.rejected += 1
+            return False
+        if wait:
+            self.delayed += 1
+            # another sender may get in first, so check again after each sleep
+            while wait:
+                await tasko.sleep(wait)
+                wait = self.wait_time(airtime)
+        self.spend(airtime, owner)
+        return True
+
+    def __repr__(self):
+        return "{{AirtimeBudget {:.1f}/{}s per {}s, {:.1f}s in {} packets, {} delayed, {} rejected}}".format(
+            self.available(), self.capacity, self.window, self.total, self.packets, self.delayed, self.rejected)
+
+    __str__ = __repr__
@@ -395,6 +395,22 @@ class BMX160:
     def temp(self):
         return self._temp[0]*self.TEMP_SCALAR+23
 
+    async def read_imu_async(self):
+        """
+        accel (m/s^2), mag (uT) and gyro (deg/s) from a single burst read.
+        Waits for its turn on the bus if a tasko.ManagedI2C device handle is attached.
+        """
+        buf = await self.read_bytes_async(BMX160_MAG_DATA_ADDR, 20, self._BUFFER)
+        mag = struct.unpack_from('<hhh', buf, 0)
+        gyro = struct.unpack_from('<hhh', buf, 8)
+        accel = struct.unpack_from('<hhh', buf, 14)
+        return (tuple(x * self.ACC_SCALAR for x in accel),
+                tuple(x * self.MAG_SCALAR for x in mag),
+                tuple(x * self.GYR_SCALAR for x in gyro))
+
+    async def read_bytes_async(self, address, count, buf):
+        return self.read_bytes(address, count, buf)
+
     @property
     def sensortime(self):
         tbuf = self.read_bytes(BMX160_SENSOR_TIME_ADDR, 3, self._smallbuf)
@@ -650,6 +666,9 @@ class BMX160:
 class BMX160_I2C(BMX160):
     """Driver for the BMX160 connect over I2C."""
 
+    # optional tasko.ManagedI2C device handle for async reads
+    i2c_handle = None
+
     def __init__(self, i2c):
 
         try:
@@ -671,6 +690,12 @@ class BMX160_I2C(BMX160):
             i2c.write_then_readinto(buf, buf, out_end=1, in_end=count)
         return buf
 
+    async def read_bytes_async(self, address, count, buf):
+        if self.i2c_handle is None:
+            return self.read_bytes(address, count, buf)
+        await self.i2c_handle.read_register_into(address, buf, end=count)
+        return buf
+
     def write_u8(self, address, val):
         with self.i2c_device as i2c:
             self._BUFFER[0] = address & 0xFF
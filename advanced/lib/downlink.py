@@ -0,0 +1,258 @@
+"""
+Downlink scheduler: one owner for a radio's transmit windows.
+
+Senders queue frames in a priority class instead of calling the radio themselves:
+
+    RESPONSE    command replies
+    BEACON      the health beacon
+    BULK        file fragments, aggregated telemetry
+
+The scheduler always sends the oldest frame of the highest class waiting, one frame at a
+time, so a command reply waits for at most one bulk fragment however long the file dump.
+Each class has a byte budget for its backlog: put() refuses (and counts) a frame that
+would go over it, send() waits for room.
+
+    tx = DownlinkScheduler(cubesat.radio1, lease=cubesat.radio1_lease)
+    tx.put(downlink.RESPONSE, b'invalid cmd')          # from synchronous code
+    await tx.send(downlink.BEACON, beacon, destination=0xFF)
+    link = file_downlink.RadioLink(tx.sender(downlink.BULK), queue)
+
+poll() sends whatever is queued; call it from a frequent task. A task waiting in send()
+runs poll() itself when nobody else is transmitting, so frames go out promptly. Tasks that
+must not wait on the downlink (e.g. the one draining RX) queue with put() or through
+sender(priority, wait=False).
+"""
+import time
+import tasko
+
+RESPONSE = 0
+BEACON = 1
+BULK = 2
+CLASSES = 3
+
+FRAME = 252
+
+
+class ClassStats:
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        """sends that timed out or the airtime budget refused"""
+        self.dropped = 0
+        """frames put() refused because the backlog was over the byte budget"""
+        self.bytes = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def wait_mean(self):
+        done = self.sent + self.failed
+        return self.wait_total / done if done else 0.0
+
+    def __repr__(self):
+        return "{{ClassStats {} queued, {} sent ({}B), {} failed, {} dropped, wait {:.2f}/{:.2f}s}}".format(
+            self.queued, self.sent, self.bytes, self.failed, self.dropped, self.wait_mean, self.wait_max)
+
+    __str__ = __repr__
+
+
+class _Frame:
+    def __init__(self):
+        self.buffer = bytearray(FRAME)
+        self.length = 0
+        self.destination = None
+        self.flags = None
+        self.keep_listening = True
+        self.owner = None
+        self.queued_at = 0.0
+        self.done = False
+        self.result = False
+        self.waited = False
+
+
+class _ClassQueue:
+    # FIFO of preallocated frames with a byte budget for the backlog
+    def __init__(self, count, budget):
+        self.budget = budget
+        self.free = [_Frame() for _ in range(count)]
+        self.ready = []
+        self.backlog = 0
+        self.stats = ClassStats()
+
+    def fits(self, length):
+        return bool(self.free) and self.backlog + length <= self.budget
+
+
+class DownlinkScheduler:
+    """
+    Priority queues in front of a radio's send_async().
+
+    :param radio: pycubed_rfm9x.RFM9x
+    :param lease: optional tasko bus handle, passed on to send_async()
+    :param budgets: backlog byte budget of each class, RESPONSE first
+    :param slots: frames preallocated for each class, RESPONSE first
+    """
+    def __init__(self, radio, *, lease=None, budgets=(1008, 504, 1008), slots=(4, 2, 4), poll=0.05):
+        self.radio = radio
+        self.lease = lease
+        self.poll_interval = poll
+        self.queues = [_ClassQueue(slots[i], budgets[i]) for i in range(CLASSES)]
+        self._busy = False
+
+    def stats(self, priority):
+        return self.queues[priority].stats
+
+    def __len__(self):
+        """frames waiting in all classes"""
+        return sum(len(q.ready) for q in self.queues)
+
+    def put(self, priority, data, *, destination=None, flags=None, keep_listening=True, owner=None):
+        """Queue a frame and return right away. Returns False if the class is over its budget."""
+        frame = self._enqueue(priority, data, destination, flags, keep_listening, owner)
+        return frame is not None
+
+    async def send(self, priority, data, *, destination=None, flags=None, keep_listening=True, owner=None):
+        """Queue a frame, waiting for room in the class, and wait until it is sent. Returns the send result."""
+        if isinstance(data, str):
+            data = data.encode()
+        queue = self.queues[priority]
+        if len(data) > queue.budget:
+            queue.stats.dropped += 1
+            return False
+        while not queue.fits(len(data)):
+            await tasko.sleep(self.poll_interval)
+        frame = self._enqueue(priority, data, destination, flags, keep_listening, owner)
+        frame.waited = True
+        while not frame.done:
+            if self._busy:
+                await tasko.sleep(self.poll_interval)
+            else:
+                await self.poll()
+        result = frame.result
+        frame.waited = False
+        queue.free.append(frame)
+        return result
+
+    def _enqueue(self, priority, data, destination, flags, keep_listening, owner):
+        if isinstance(data, str):
+            data = data.encode()
+        length = len(data)
+        assert 0 < length <= FRAME
+        queue = self.queues[priority]
+        if not queue.fits(length):
+            queue.stats.dropped += 1
+            return None
+        frame = queue.free.pop()
+        frame.buffer[:length] = data
+        frame.length = length
+        frame.destination = destination
+        frame.flags = flags
+        frame.keep_listening = keep_listening
+        frame.owner = owner
+        frame.queued_at = time.monotonic()
+        frame.done = False
+        queue.ready.append(frame)
+        queue.backlog += length
+        queue.stats.queued += 1
+        return frame
+
+    def _next(self):
+        for queue in self.queues:
+            if queue.ready:
+                return queue
+        return None
+
+    async def poll(self):
+        """Send every queued frame, highest class first. Returns the number sent."""
+        if self._busy:
+            return 0
+        self._busy = True
+        count = 0
+        try:
+            # pick again after every frame: a reply queued during a bulk fragment goes next
+            queue = self._next()
+            while queue is not None:
+                frame = self._pop(queue)
+                result = await self.radio.send_async(
+                    memoryview(frame.buffer)[:frame.length], keep_listening=frame.keep_listening,
+                    destination=frame.destination, flags=frame.flags, lease=self.lease, owner=frame.owner)
+                self._sent(queue, frame, result)
+                count += 1
+                queue = self._next()
+        finally:
+            self._busy = False
+        return count
+
+    def _pop(self, queue):
+        # the oldest frame of queue, counting how long it waited
+        frame = queue.ready.pop(0)
+        queue.backlog -= frame.length
+        stats = queue.stats
+        wait = time.monotonic() - frame.queued_at
+        stats.wait_total += wait
+        if wait > stats.wait_max:
+            stats.wait_max = wait
+        return frame
+
+    def _sent(self, queue, frame, result):
+        stats = queue.stats
+        if result:
+            stats.sent += 1
+            stats.bytes += frame.length
+        else:
+            stats.failed += 1
+        frame.result = result
+        frame.done = True
+        if not frame.waited:
+            queue.free.append(frame)
+
+    def flush(self, priority=RESPONSE):
+        """
+        Send the queued frames of priority and higher classes now, blocking. For synchronous
+        code that must get a reply out before it carries on, e.g. before a reset. While poll()
+        is sending, call it holding the scheduler's lease, as the beacon task's command handlers
+        do: poll() then can't start its next frame, the one it has on the air goes out first
+        and poll() records its result as usual.
+        """
+        assert not self._busy or self.lease is None or self.lease.active, \
+            'flush() during poll() needs the lease'
+        for queue in self.queues[:priority + 1]:
+            while queue.ready:
+                frame = self._pop(queue)
+                result = self.radio.send(memoryview(frame.buffer)[:frame.length],
+                                         keep_listening=frame.keep_listening, destination=frame.destination,
+                                         flags=frame.flags, owner=frame.owner)
+                self._sent(queue, frame, result)
+
+    def sender(self, priority, *, wait=True):
+        """
+        A stand-in for the radio that sends through this scheduler, e.g. for file_downlink.RadioLink.
+        With wait=False its send_async() only queues the frame with put() and returns whether it fit.
+        """
+        return ClassSender(self, priority, wait=wait)
+
+    def __repr__(self):
+        return "{{DownlinkScheduler response: {}, beacon: {}, bulk: {}}}".format(*(q.stats for q in self.queues))
+
+    __str__ = __repr__
+
+
+class ClassSender:
+    """send_async() and time_on_air() of a radio, sending in one class of a DownlinkScheduler"""
+    def __init__(self, scheduler, priority, *, wait=True):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.wait = wait
+
+    async def send_async(self, data, *, keep_listening=True, destination=None, flags=None, lease=None, owner=None,
+                         **kwargs):
+        # lease: the scheduler holds its own
+        if not self.wait:
+            return self.scheduler.put(self.priority, data, destination=destination, flags=flags,
+                                      keep_listening=keep_listening, owner=owner)
+        return await self.scheduler.send(self.priority, data, destination=destination, flags=flags,
+                                         keep_listening=keep_listening, owner=owner)
+
+    def time_on_air(self, length):
+        return self.scheduler.radio.time_on_air(length)
@@ -0,0 +1,256 @@
+"""
+Optional forward error correction for radio frames: Reed-Solomon over GF(2^8), byte interleaved.
+
+The SX127x CRC can only drop a damaged packet, which then costs a retransmission. With FEC the
+radio runs with enable_crc = False and damaged frames are repaired instead:
+
+    codec = FecCodec(parity=32)                 # 4 x RS(63,55), 32 check bytes per 252 byte frame
+    n = codec.encode_into(data, frame)          # len(data) <= codec.max_data
+    radio.send(memoryview(frame)[:n])
+    ...
+    n = codec.decode_into(packet, length, data) # None if the frame was beyond repair
+
+Each frame is split into `depth` interleaved codewords (frame byte i belongs to codeword
+i % depth), each with parity/depth check bytes, so a codeword corrects parity/depth/2 byte
+errors. Interleaving keeps the per-codeword work small and spreads a burst across codewords.
+
+The log/antilog tables and the generator polynomials are computed once, at import and in
+the constructor.
+"""
+
+# GF(2^8) with the usual x^8 + x^4 + x^3 + x^2 + 1 polynomial
+_EXP = bytearray(512)
+_LOG = bytearray(256)
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+for _i in range(255, 512):
+    _EXP[_i] = _EXP[_i - 255]
+
+
+def _mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def _div(a, b):
+    if a == 0:
+        return 0
+    return _EXP[(_LOG[a] + 255 - _LOG[b]) % 255]
+
+
+def _pow2(power):
+    # alpha ** power
+    return _EXP[power % 255]
+
+
+def _poly_scale(p, x):
+    return [_mul(c, x) for c in p]
+
+
+def _poly_add(p, q):
+    r = [0] * max(len(p), len(q))
+    for i in range(len(p)):
+        r[i + len(r) - len(p)] = p[i]
+    for i in range(len(q)):
+        r[i + len(r) - len(q)] ^= q[i]
+    return r
+
+
+def _poly_mul(p, q):
+    r = [0] * (len(p) + len(q) - 1)
+    for j in range(len(q)):
+        for i in range(len(p)):
+            r[i + j] ^= _mul(p[i], q[j])
+    return r
+
+
+def _poly_eval(p, x):
+    # Horner, highest degree first
+    y = p[0]
+    for i in range(1, len(p)):
+        y = _mul(y, x) ^ p[i]
+    return y
+
+
+class ReedSolomon:
+    """
+    Systematic RS code with `parity` check symbols, correcting up to parity // 2 byte errors
+    in a codeword of up to 255 bytes. Shortened codewords are just shorter messages.
+    """
+    def __init__(self, parity):
+        self.parity = parity
+        g = [1]
+        for i in range(parity):
+            g = _poly_mul(g, [1, _pow2(i)])
+        # logs of the generator coefficients after the leading 1 (all non-zero)
+        self._glog = bytearray(_LOG[c] for c in g[1:])
+        self._remainder = bytearray(parity)
+
+    def encode(self, codeword, length):
+        """codeword[:length - parity] is the message; fills in codeword[length - parity:length]"""
+        parity = self.parity
+        glog = self._glog
+        r = self._remainder
+        for j in range(parity):
+            r[j] = 0
+        for i in range(length - parity):
+            feedback = codeword[i] ^ r[0]
+            r[0:parity - 1] = r[1:parity]
+            r[parity - 1] = 0
+            if feedback:
+                lf = _LOG[feedback]
+                for j in range(parity):
+                    r[j] ^= _EXP[lf + glog[j]]
+        codeword[length - parity:length] = r
+
+    def _syndromes(self, codeword, length):
+        synd = [0] * self.parity
+        clean = True
+        for i in range(self.parity):
+            s = 0
+            for k in range(length):
+                s = (_EXP[_LOG[s] + i] if s else 0) ^ codeword[k]
+            synd[i] = s
+            if s:
+                clean = False
+        return None if clean else synd
+
+    def decode(self, codeword, length):
+        """
+        Correct codeword[:length] in place.
+        Returns the number of bytes corrected, or None if there were too many errors.
+        """
+        synd = self._syndromes(codeword, length)
+        if synd is None:
+            return 0
+        # Berlekamp-Massey error locator
+        err_loc = [1]
+        old_loc = [1]
+        for i in range(self.parity):
+            delta = synd[i]
+            for j in range(1, min(len(err_loc), i + 1)):
+                delta ^= _mul(err_loc[-(j + 1)], synd[i - j])
+            old_loc = old_loc + [0]
+            if delta:
+                if len(old_loc) > len(err_loc):
+                    new_loc = _poly_scale(old_loc, delta)
+                    old_loc = _poly_scale(err_loc, _div(1, delta))
+                    err_loc = new_loc
+                err_loc = _poly_add(err_loc, _poly_scale(old_loc, delta))
+        while err_loc and err_loc[0] == 0:
+            del err_loc[0]
+        errors = len(err_loc) - 1
+        if errors * 2 > self.parity:
+            return None
+        # Chien search
+        rev = err_loc[::-1]
+        positions = []
+        for i in range(length):
+            if _poly_eval(rev, _pow2(i)) == 0:
+                positions.append(length - 1 - i)
+        if len(positions) != errors:
+            return None
+        # Forney
+        coef_pos = [length - 1 - p for p in positions]
+        loc = [1]
+        for c in coef_pos:
+            loc = _poly_mul(loc, [_pow2(c), 1])
+        product = _poly_mul(synd[::-1] + [0], loc)
+        evaluator = product[len(product) - len(loc):]
+        X = [_pow2(c) for c in coef_pos]
+        for i in range(len(X)):
+            xi_inv = _div(1, X[i])
+            denominator = 1
+            for j in range(len(X)):
+                if j != i:
+                    denominator = _mul(denominator, 1 ^ _mul(xi_inv, X[j]))
+            if denominator == 0:
+                return None
+            y = _mul(X[i], _poly_eval(evaluator, xi_inv))
+            codeword[positions[i]] ^= _div(y, denominator)
+        if self._syndromes(codeword, length) is not None:
+            return None
+        return errors
+
+
+class FecCodec:
+    """
+    Frames of up to `frame` bytes carrying up to `frame - parity` data bytes.
+
+    :param frame: largest frame, 252 fills an RFM9x packet
+    :param parity: check bytes per frame, split evenly over the codewords
+    :param depth: interleaved codewords per frame (each at most 255 bytes). The default 4 repairs
+        a 16 byte burst with a quarter of the parity per codeword, so decoding is cheaper; scattered
+        errors are repaired up to parity/depth/2 per codeword. depth=1 repairs any parity/2 bytes.
+    """
+    def __init__(self, frame=252, parity=32, depth=4):
+        assert parity % depth == 0 and frame <= 255 * depth
+        self.frame = frame
+        self.parity = parity
+        self.depth = depth
+        self.max_data = frame - parity
+        self.rs = ReedSolomon(parity // depth)
+        self._codeword = bytearray((frame + depth - 1) // depth)
+        self.corrected = 0
+        self.failed = 0
+
+    def _gather(self, buf, data_length, j):
+        # codeword j: its interleaved data bytes, then its interleaved parity bytes
+        cw = self._codeword
+        n = 0
+        for i in range(j, data_length, self.depth):
+            cw[n] = buf[i]
+            n += 1
+        for i in range(data_length + j, data_length + self.parity, self.depth):
+            cw[n] = buf[i]
+            n += 1
+        return n
+
+    def _scatter(self, buf, data_length, j, n):
+        cw = self._codeword
+        k = 0
+        for i in range(j, data_length, self.depth):
+            buf[i] = cw[k]
+            k += 1
+        for i in range(data_length + j, data_length + self.parity, self.depth):
+            buf[i] = cw[k]
+            k += 1
+
+    def encode_into(self, data, frame):
+        """Write data and its check bytes to frame. Returns the frame length."""
+        length = len(data)
+        assert length <= self.max_data
+        frame[:length] = data
+        for j in range(self.depth):
+            n = self._gather(frame, length, j)
+            self.rs.encode(self._codeword, n)
+            self._scatter(frame, length, j, n)
+        return length + self.parity
+
+    def decode_into(self, frame, length, data):
+        """
+        Correct frame[:length] in place and copy the data part to data.
+        Returns the data length, or None if a codeword had too many errors.
+        """
+        data_length = length - self.parity
+        if data_length < 0:
+            return None
+        corrected = 0
+        for j in range(self.depth):
+            n = self._gather(frame, data_length, j)
+            fixed = self.rs.decode(self._codeword, n)
+            if fixed is None:
+                self.failed += 1
+                return None
+            if fixed:
+                self._scatter(frame, data_length, j, n)
+                corrected += fixed
+        self.corrected += corrected
+        data[:data_length] = frame[:data_length]
+        return data_length
@@ -0,0 +1,328 @@
+"""
+Fragmented file downlink with selective-repeat ARQ.
+
+A file is split into fragments that fill a whole radio packet (248 data bytes plus a
+4 byte fragment header, the 252 byte RFM9x limit). Frames travel as RadioHead payloads
+with CHANNEL in the low nibble of the header flags, so RadioService can route the
+ground's replies to the sender.
+
+    START  [0x01][file id][fragments (2)][size (4)][encoding][nonce (2)]   sat -> ground
+    DATA   [0x02][file id][sequence (2)][data]            sat -> ground (0x82: poll)
+    POLL   [0x04][file id]                                sat -> ground
+    STATUS [0x03][file id][base (2)][bitmap (WINDOW/8)]   ground -> sat
+
+The sender keeps up to WINDOW fragments past base, the first fragment the ground is
+missing. Each burst ends with a polling DATA frame and the ground answers with a STATUS:
+everything before base has arrived, and bit i of the bitmap set is a NACK for fragment
+base + i. Only NACKed fragments are sent again. START and POLL frames are answered with
+a STATUS too, so a lost reply costs one small POLL rather than a whole burst.
+
+File ids start over after a reset and wrap at 256, so each transfer also picks a random
+nonce. A START with the file id and nonce of the transfer in progress is a repeat; any
+other START begins a new file on the ground.
+
+FileReceiver is the ground side. The sender only needs a link with
+
+    async send(frame, length)     transmit frame[:length]
+    async recv(buf, timeout)      receive a frame into buf, returns its length or None
+
+RadioLink is that link over an RFM9x and a RadioService channel.
+"""
+import random
+import struct
+import time
+
+CHANNEL = 0x01
+"""RadioHead flags (low nibble) marking file transfer frames"""
+
+START = 0x01
+_START = 11
+DATA = 0x02
+STATUS = 0x03
+POLL = 0x04
+_POLL_FLAG = 0x80
+
+# START encodings
+RAW = 0
+LZSS = 1
+"""compressed with lzss.Encoder, see lzss.decompress()"""
+
+HEADER = 4
+FRAGMENT = 248
+FRAME = HEADER + FRAGMENT
+WINDOW = 32
+_BITMAP = WINDOW // 8
+
+
+class TransferStats:
+    """Counters for one file. Airtime is what the link reports for the frames we sent (seconds)."""
+    def __init__(self):
+        self.size = 0
+        self.fragments = 0
+        self.transmissions = 0
+        self.retransmissions = 0
+        self.polls = 0
+        self.timeouts = 0
+        self.bytes_on_air = 0
+        self.airtime = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def goodput(self):
+        """file bits per second of airtime"""
+        return self.size * 8 / self.airtime if self.airtime else 0.0
+
+    @property
+    def raw_rate(self):
+        """payload bits per second of airtime, overhead and repeats included"""
+        return self.bytes_on_air * 8 / self.airtime if self.airtime else 0.0
+
+    @property
+    def efficiency(self):
+        return self.goodput / self.raw_rate if self.bytes_on_air else 0.0
+
+    def __repr__(self):
+        return "{{TransferStats {}B in {} fragments, {} transmissions ({} repeats, {} polls, {} timeouts), " \
+               "airtime {:.2f}s, goodput {:.0f}bps / raw {:.0f}bps}}".format(
+                   self.size, self.fragments, self.transmissions, self.retransmissions, self.polls,
+                   self.timeouts, self.airtime, self.goodput, self.raw_rate)
+
+    __str__ = __repr__
+
+
+class FileSender:
+    """
+    Sends one file over a link.
+
+    :param link: see the module docstring
+    :param source: file-like object with seek() and readinto() (an open file, io.BytesIO)
+    :param size: number of bytes to send from source
+    :param file_id: 0-255, tells transfers apart on the ground
+    :param lease: optional tasko handle held while reading source (e.g. cubesat.sd_lease)
+    :param encoding: RAW or LZSS, tells the ground how to decode the file
+    :param nonce: 0-65535, random by default; sent in START so a reused file_id is still a new file
+    """
+    def __init__(self, link, source, size, file_id=0, *, lease=None, encoding=RAW, timeout=2.0, max_timeouts=5,
+                 nonce=None):
+        self.link = link
+        self.source = source
+        self.file_id = file_id & 0xFF
+        if nonce is None:
+            nonce = random.randint(0, 0xFFFF)
+        self.nonce = nonce & 0xFFFF
+        self.lease = lease
+        self.encoding = encoding
+        self.timeout = timeout
+        self.max_timeouts = max_timeouts
+        self.fragments = (size + FRAGMENT - 1) // FRAGMENT
+        self.stats = TransferStats()
+        self.stats.size = size
+        self.stats.fragments = self.fragments
+        self._size = size
+        self._frame = bytearray(FRAME)
+        self._reply = bytearray(FRAME)
+        self._view = memoryview(self._frame)
+        self._sent = bytearray((self.fragments + 7) // 8)
+        self._base = 0
+        self._missing = bytearray(_BITMAP)
+
+    async def send(self):
+        """Send the whole file. Returns True once the ground has every fragment."""
+        stats = self.stats
+        start = time.monotonic()
+        struct.pack_into('<BBHIBH', self._frame, 0, START, self.file_id, self.fragments, self._size, self.encoding,
+                         self.nonce)
+        if await self._exchange(_START):
+            while self._base < self.fragments:
+                if not await self._burst():
+                    break
+        stats.elapsed = time.monotonic() - start
+        return self._base >= self.fragments
+
+    async def _burst(self):
+        # send every NACKed fragment in the window, polling with the last one
+        last = None
+        for i in range(WINDOW):
+            seq = self._base + i
+            if seq >= self.fragments:
+                break
+            if self._missing[i >> 3] & (1 << (i & 7)):
+                if last is not None:
+                    await self._send_fragment(last, False)
+                last = seq
+        if last is None:
+            # nothing NACKed but not done either: ask again
+            self._frame[0] = POLL
+            self._frame[1] = self.file_id
+            return await self._exchange(2)
+        await self._send_fragment(last, True)
+        return await self._await_status()
+
+    def _read(self, seq):
+        self.source.seek(seq * FRAGMENT)
+        end = min(FRAGMENT, self._size - seq * FRAGMENT)
+        return self.source.readinto(self._view[HEADER:HEADER + end])
+
+    async def _send_fragment(self, seq, poll):
+        if self.lease is None:
+            n = self._read(seq)
+        else:
+            async with self.lease:
+                n = self._read(seq)
+        struct.pack_into('<BBH', self._frame, 0, DATA | (_POLL_FLAG if poll else 0), self.file_id, seq)
+        if self._sent[seq >> 3] & (1 << (seq & 7)):
+            self.stats.retransmissions += 1
+        self._sent[seq >> 3] |= 1 << (seq & 7)
+        await self._transmit(HEADER + n)
+
+    async def _transmit(self, length):
+        stats = self.stats
+        stats.transmissions += 1
+        stats.bytes_on_air += length
+        stats.airtime += await self.link.send(self._frame, length)
+
+    async def _exchange(self, length):
+        # send a START/POLL frame and wait for the STATUS, repeating the frame if need be
+        await self._transmit(length)
+        return await self._await_status(length)
+
+    async def _await_status(self, resend=None):
+        # resend: length of the frame to repeat on a timeout, otherwise send a POLL
+        stats = self.stats
+        for attempt in range(self.max_timeouts):
+            n = await self.link.recv(self._reply, self.timeout)
+            if n is not None and n >= HEADER + _BITMAP and self._reply[0] == STATUS \
+                    and self._reply[1] == self.file_id:
+                self._base = struct.unpack_from('<H', self._reply, 2)[0]
+                self._missing[:] = self._reply[HEADER:HEADER + _BITMAP]
+                return True
+            if n is None:
+                stats.timeouts += 1
+            if attempt == self.max_timeouts - 1:
+                break
+            # ask for the status again
+            stats.polls += 1
+            if resend is None:
+                self._frame[0] = POLL
+                self._frame[1] = self.file_id
+                resend = 2
+            await self._transmit(resend)
+        return False
+
+
+class FileReceiver:
+    """
+    Ground side of a transfer: collects fragments and answers with STATUS frames.
+
+    Feed every file transfer frame to handle(); send back whatever it returns.
+    """
+    def __init__(self):
+        self.file_id = None
+        self.nonce = None
+        self.fragments = 0
+        self.size = 0
+        self.encoding = RAW
+        self.data = None
+        self.received = None
+        self.duplicates = 0
+        self._status = bytearray(HEADER + _BITMAP)
+
+    @property
+    def complete(self):
+        return self.data is not None and self._first_missing() >= self.fragments
+
+    def _has(self, seq):
+        return self.received[seq >> 3] & (1 << (seq & 7))
+
+    def _first_missing(self):
+        for seq in range(self.fragments):
+            if not self._has(seq):
+                return seq
+        return self.fragments
+
+    def handle(self, frame, length=None):
+        """Process one frame. Returns the STATUS frame to send back, or None."""
+        if length is None:
+            length = len(frame)
+        if length < 2:
+            return None
+        kind = frame[0]
+        if kind == START and length >= _START:
+            _, file_id, fragments, size, encoding, nonce = struct.unpack_from('<BBHIBH', frame, 0)
+            if file_id != self.file_id or nonce != self.nonce:
+                # anything but a repeated START is a new file, whatever its id and size
+                self.file_id = file_id
+                self.nonce = nonce
+                self.encoding = encoding
+                self.fragments = fragments
+                self.size = size
+                self.data = bytearray(size)
+                self.received = bytearray((fragments + 7) // 8)
+            return self.status()
+        if frame[1] != self.file_id or self.data is None:
+            return None
+        if kind & ~_POLL_FLAG == DATA and length > HEADER:
+            seq = struct.unpack_from('<H', frame, 2)[0]
+            if seq < self.fragments:
+                if self._has(seq):
+                    self.duplicates += 1
+                else:
+                    offset = seq * FRAGMENT
+                    n = min(length - HEADER, self.size - offset)
+                    self.data[offset:offset + n] = frame[HEADER:HEADER + n]
+                    self.received[seq >> 3] |= 1 << (seq & 7)
+            if kind & _POLL_FLAG:
+                return self.status()
+            return None
+        if kind == POLL:
+            return self.status()
+        return None
+
+    def contents(self):
+        """the file as it was before encoding"""
+        if self.encoding == LZSS:
+            import lzss
+            return lzss.decompress(self.data)
+        return bytes(self.data)
+
+    def status(self):
+        """STATUS frame: the first missing fragment and a NACK bitmap for the window after it"""
+        base = self._first_missing()
+        struct.pack_into('<BBH', self._status, 0, STATUS, self.file_id, base)
+        for i in range(_BITMAP):
+            self._status[HEADER + i] = 0
+        for i in range(WINDOW):
+            seq = base + i
+            if seq < self.fragments and not self._has(seq):
+                self._status[HEADER + (i >> 3)] |= 1 << (i & 7)
+        return self._status
+
+
+class RadioLink:
+    """
+    File transfer link over an RFM9x. Frames go out with send_async() and replies come from
+    a RadioService channel (radio_service.channel(CHANNEL)). Other protocols can use it
+    with their own channel flags, and queue=None if they never receive.
+    """
+    def __init__(self, radio, queue, *, lease=None, destination=None, owner='downlink', channel=CHANNEL):
+        self.radio = radio
+        self.queue = queue
+        self.lease = lease
+        self.destination = destination
+        self.owner = owner
+        self.channel = channel
+
+    async def send(self, frame, length):
+        """Transmit frame[:length]. Returns its time on air in seconds."""
+        await self.radio.send_async(memoryview(frame)[:length], destination=self.destination,
+                                    flags=self.channel, keep_listening=True, lease=self.lease, owner=self.owner)
+        return self.radio.time_on_air(length + 4)
+
+    async def recv(self, buf, timeout):
+        packet = await self.queue.get_async(timeout)
+        if packet is None:
+            return None
+        n = min(packet.length - 4, len(buf))
+        buf[:n] = packet.data[:n]
+        self.queue.release(packet)
+        return n
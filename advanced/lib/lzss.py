@@ -0,0 +1,222 @@
+"""
+Small streaming LZSS compressor (heatshrink style) for downlinked files.
+
+The output is a bit stream of tokens after a one byte header (window_bits << 4 | lookahead_bits):
+
+    1 [literal (8)]                             one byte
+    0 [offset - 1 (window_bits)] [length - 2 (lookahead_bits)]   copy from the last 2^window_bits bytes
+
+The encoder keeps 2 * 2^window_bits bytes of history and lookahead, so window_bits=8 needs
+512 bytes of RAM. Longer windows find more repeats (msgpack dict keys in every record) but
+cost RAM and search time. The decoder needs the same window; decompress() reads it from the
+header and runs on the host.
+"""
+import time
+import tasko
+
+MIN_MATCH = 2
+
+
+class Encoder:
+    """
+    Compresses everything written to it into out (anything with a write() method).
+
+    :param window_bits: 4-12, back references reach 2^window_bits bytes
+    :param lookahead_bits: 2 to window_bits - 1, matches are up to 2^lookahead_bits + 1 bytes
+    """
+    def __init__(self, out, window_bits=8, lookahead_bits=4):
+        # a back reference must be longer than the up to 7 bits of padding at the end
+        assert 4 <= window_bits <= 12 and 2 <= lookahead_bits < window_bits and window_bits + lookahead_bits >= 7
+        self._out = out
+        self.window_bits = window_bits
+        self.lookahead_bits = lookahead_bits
+        self._window = 1 << window_bits
+        self._max_match = (1 << lookahead_bits) + MIN_MATCH - 1
+        self._buf = bytearray(2 * self._window)
+        self._pos = 0
+        self._end = 0
+        self._bits = 0
+        self._nbits = 0
+        self._outbuf = bytearray(64)
+        self._outlen = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._emit_byte((window_bits << 4) | lookahead_bits)
+
+    def write(self, data):
+        """Compress data. Output is written as whole bytes fill up."""
+        n = len(data)
+        i = 0
+        while i < n:
+            if self._end == len(self._buf):
+                self._shift()
+            count = min(n - i, len(self._buf) - self._end)
+            self._buf[self._end:self._end + count] = data[i:i + count]
+            self._end += count
+            i += count
+            self._encode(False)
+        self.bytes_in += n
+        return n
+
+    def flush(self):
+        """Encode the rest of the input and pad the last byte. Call once at the end."""
+        self._encode(True)
+        if self._nbits:
+            self._emit_bits(0, 8 - self._nbits)
+        self._flush_out()
+
+    def _shift(self):
+        # keep one window of history before the next byte to encode
+        keep = self._pos - self._window
+        if keep > 0:
+            self._buf[:self._end - keep] = self._buf[keep:self._end]
+            self._pos -= keep
+            self._end -= keep
+
+    def _encode(self, final):
+        buf = self._buf
+        max_match = self._max_match
+        while self._pos < self._end:
+            pos = self._pos
+            available = self._end - pos
+            if available < max_match and not final:
+                # wait for more lookahead, making room if the buffer is full
+                if self._end == len(buf) and pos > self._window:
+                    self._shift()
+                    continue
+                return
+            limit = min(max_match, available)
+            best_len = 0
+            best_offset = 0
+            j = pos - 1
+            start = max(0, pos - self._window)
+            first = buf[pos]
+            while j >= start:
+                if buf[j] == first:
+                    n = 1
+                    while n < limit and buf[j + n] == buf[pos + n]:
+                        n += 1
+                    if n > best_len:
+                        best_len = n
+                        best_offset = pos - j
+                        if n == limit:
+                            break
+                j -= 1
+            if best_len >= MIN_MATCH:
+                self._emit_bits(0, 1)
+                self._emit_bits(best_offset - 1, self.window_bits)
+                self._emit_bits(best_len - MIN_MATCH, self.lookahead_bits)
+                self._pos += best_len
+            else:
+                self._emit_bits(0x100 | first, 9)
+                self._pos += 1
+            if self._pos >= len(buf) - max_match:
+                self._shift()
+
+    def _emit_bits(self, value, count):
+        self._bits = (self._bits << count) | value
+        self._nbits += count
+        while self._nbits >= 8:
+            self._nbits -= 8
+            self._emit_byte((self._bits >> self._nbits) & 0xFF)
+        self._bits &= (1 << self._nbits) - 1
+
+    def _emit_byte(self, b):
+        self._outbuf[self._outlen] = b
+        self._outlen += 1
+        if self._outlen == len(self._outbuf):
+            self._flush_out()
+
+    def _flush_out(self):
+        if self._outlen:
+            self._out.write(memoryview(self._outbuf)[:self._outlen])
+            self.bytes_out += self._outlen
+            self._outlen = 0
+
+
+def decompress(data):
+    """Decode an Encoder stream (host side). Returns bytes."""
+    window_bits = data[0] >> 4
+    lookahead_bits = data[0] & 0x0F
+    out = bytearray()
+    total = (len(data) - 1) * 8
+    bit = 8
+
+    def read(count):
+        nonlocal bit
+        value = 0
+        for _ in range(count):
+            value = (value << 1) | ((data[bit >> 3] >> (7 - (bit & 7))) & 1)
+            bit += 1
+        return value
+
+    # the shortest token is 8 bits, and the padding at the end is at most 7
+    while total + 8 - bit >= 8:
+        if read(1):
+            if total + 8 - bit < 8:
+                break
+            out.append(read(8))
+        else:
+            if total + 8 - bit < window_bits + lookahead_bits:
+                break
+            offset = read(window_bits) + 1
+            length = read(lookahead_bits) + MIN_MATCH
+            for _ in range(length):
+                out.append(out[-offset])
+    return bytes(out)
+
+
+class CompressionStats:
+    def __init__(self, bytes_in, bytes_out, seconds):
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.seconds = seconds
+
+    @property
+    def ratio(self):
+        """compressed size / original size"""
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    @property
+    def ms_per_kb(self):
+        return self.seconds * 1000 * 1024 / self.bytes_in if self.bytes_in else 0.0
+
+    def __repr__(self):
+        return "{{CompressionStats {} -> {}B, ratio {:.2f}, {:.0f}ms/KB}}".format(
+            self.bytes_in, self.bytes_out, self.ratio, self.ms_per_kb)
+
+    __str__ = __repr__
+
+
+async def compress_file(src, dst, window_bits=8, lookahead_bits=4, chunk=256, lease=None):
+    """
+    Compress the file at path src into a new file at path dst, one chunk at a time with a
+    loop turn in between. lease (e.g. cubesat.sd_lease) is held around each file access.
+    Returns CompressionStats; seconds is the time spent compressing, not waiting.
+    """
+    seconds = 0.0
+    buf = bytearray(chunk)
+    view = memoryview(buf)
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        encoder = Encoder(fout, window_bits, lookahead_bits)
+        while True:
+            start = time.monotonic()
+            if lease is None:
+                n = fin.readinto(buf)
+                if n:
+                    encoder.write(view[:n])
+            else:
+                async with lease:
+                    n = fin.readinto(buf)
+                    if n:
+                        encoder.write(view[:n])
+            seconds += time.monotonic() - start
+            if not n:
+                break
+            await tasko.sleep(0)
+        if lease is None:
+            encoder.flush()
+        else:
+            async with lease:
+                encoder.flush()
+    return CompressionStats(encoder.bytes_in, encoder.bytes_out, seconds)
@@ -0,0 +1,314 @@
+"""
+Store-and-forward mailbox for messages between ground nodes.
+
+A ground node uplinks a message addressed to another node; the satellite keeps it on the
+SD card until that node asks for its mail, possibly passes later and from another ground
+station. Frames travel as RadioHead payloads with CHANNEL in the low nibble of the header
+flags, the sender of a frame is the node byte of its header:
+
+    STORE   [0x01][destination][ttl: u16 minutes][data ...]        ground -> sat
+    STORED  [0x81][status][id: u16]                                sat -> ground
+    FETCH   [0x02][count][id: u16] * count                         ground -> sat
+    DELIVER [0x83][id: u16][source][age: u16 minutes][data ...]    sat -> ground
+
+A FETCH lists the messages the node got from the previous DELIVERs; they are deleted and
+the next batch goes out. Anything delivered but not confirmed is delivered again, so a
+ground station's beacon is simply a FETCH with no ids. A ttl of 0 means the mailbox's
+longest.
+
+Messages live in fixed size slots of one file, so storage is bounded and a message is one
+seek and one write. The index (destination -> slots, oldest first) is in RAM and rebuilt
+from the slot headers at boot. A full mailbox first drops expired messages, then the
+oldest one; a destination holding per_destination messages loses its own oldest.
+
+    box = Mailbox('/sd/mailbox.bin')
+    mail = Postmaster(box, cubesat.radio1_rx.channel(mailbox.CHANNEL), cubesat.radio1_tx,
+                      lease=cubesat.sd_lease)
+    # from a frequent task
+    await mail.poll()
+
+Times are time.time() seconds, which survive a reset if the RTC is set.
+"""
+import os
+import struct
+import time
+from array import array
+
+import downlink
+
+CHANNEL = 0x04
+"""RadioHead flags (low nibble) marking mailbox frames"""
+
+STORE = 0x01
+FETCH = 0x02
+STORED = 0x81
+DELIVER = 0x83
+
+# STORED status
+OK = 0
+TOO_LONG = 1
+
+SLOT = 256
+_HEADER = '<BBBBIIIH'  # used, destination, source, -, sequence, stored, expires, length
+_HEADER_SIZE = struct.calcsize(_HEADER)
+MAX_MESSAGE = SLOT - _HEADER_SIZE
+_DELIVER_HEADER = 6
+
+
+class MailboxStats:
+    def __init__(self):
+        self.stored = 0
+        self.rejected = 0
+        """messages too long for a slot"""
+        self.delivered = 0
+        """DELIVER frames sent, repeats included"""
+        self.confirmed = 0
+        self.expired = 0
+        self.evicted = 0
+        """messages dropped to make room before they expired"""
+
+    def __repr__(self):
+        return "{{MailboxStats {} stored, {} rejected, {} delivered, {} confirmed, {} expired, {} evicted}}".format(
+            self.stored, self.rejected, self.delivered, self.confirmed, self.expired, self.evicted)
+
+    __str__ = __repr__
+
+
+class Mailbox:
+    """
+    Messages in a file of fixed size slots, indexed by destination.
+
+    :param path: the mailbox file, created (zeroed) if missing
+    :param slots: number of messages kept at most
+    :param per_destination: messages kept at most for one destination
+    :param max_ttl: seconds a message is kept at most
+    """
+    def __init__(self, path, *, slots=64, per_destination=16, max_ttl=7 * 86400):
+        self.path = path
+        self.slots = slots
+        self.per_destination = per_destination
+        self.max_ttl = max_ttl
+        self.stats = MailboxStats()
+        self._buffer = bytearray(SLOT)
+        self._view = memoryview(self._buffer)
+        # per slot: sequence number (0 when free), destination and expiry
+        self._sequence = array('I', [0] * slots)
+        self._destination = bytearray(slots)
+        self._expires = array('I', [0] * slots)
+        self._index = {}
+        self._next = 1
+        self._open()
+
+    def _open(self):
+        try:
+            size = os.stat(self.path)[6]
+        except OSError:
+            size = 0
+        if size < self.slots * SLOT:
+            with open(self.path, 'ab') as f:
+                zeros = bytes(SLOT)
+                for _ in range(size // SLOT, self.slots):
+                    f.write(zeros)
+        found = []
+        with open(self.path, 'rb') as f:
+            header = self._view[:_HEADER_SIZE]
+            for slot in range(self.slots):
+                f.seek(slot * SLOT)
+                f.readinto(header)
+                used, destination, _, _, sequence, _, expires, _ = struct.unpack_from(_HEADER, self._buffer)
+                if used and sequence:
+                    self._sequence[slot] = sequence
+                    self._destination[slot] = destination
+                    self._expires[slot] = expires
+                    found.append((sequence, slot))
+                    self._next = max(self._next, sequence + 1)
+        for _, slot in sorted(found):
+            self._index.setdefault(self._destination[slot], []).append(slot)
+
+    def __len__(self):
+        return sum(len(slots) for slots in self._index.values())
+
+    def count(self, destination):
+        """messages waiting for destination"""
+        return len(self._index.get(destination, ()))
+
+    def destinations(self):
+        return [d for d, slots in self._index.items() if slots]
+
+    def store(self, source, destination, data, ttl=0, now=None):
+        """
+        Keep data for destination for ttl seconds (0: max_ttl). Makes room if needed.
+        Returns the message id (16 bits), or None if data doesn't fit in a slot.
+        """
+        length = len(data)
+        if length > MAX_MESSAGE:
+            self.stats.rejected += 1
+            return None
+        if now is None:
+            now = time.time()
+        if not ttl or ttl > self.max_ttl:
+            ttl = self.max_ttl
+        mine = self._index.get(destination, ())
+        if len(mine) >= self.per_destination:
+            self._evict(mine[0])
+        slot = self._free()
+        if slot is None:
+            self.expire(now)
+            slot = self._free()
+        if slot is None:
+            oldest = None
+            for i in range(self.slots):
+                if oldest is None or self._sequence[i] < self._sequence[oldest]:
+                    oldest = i
+            self._evict(oldest)
+            slot = oldest
+        sequence = self._next
+        self._next += 1
+        expires = int(now + ttl)
+        struct.pack_into(_HEADER, self._buffer, 0, 1, destination, source, 0, sequence, int(now), expires, length)
+        self._buffer[_HEADER_SIZE:_HEADER_SIZE + length] = data
+        with open(self.path, 'r+b') as f:
+            f.seek(slot * SLOT)
+            f.write(self._view[:_HEADER_SIZE + length])
+        self._sequence[slot] = sequence
+        self._destination[slot] = destination
+        self._expires[slot] = expires
+        self._index.setdefault(destination, []).append(slot)
+        self.stats.stored += 1
+        return sequence & 0xFFFF
+
+    def pending(self, destination, now=None):
+        """Slots of the unexpired messages for destination, oldest first (a copy)"""
+        self.expire(now)
+        return list(self._index.get(destination, ()))
+
+    def read(self, slot, buffer):
+        """
+        Read the message in slot into buffer. Returns (id, source, stored, length), the
+        length cut to len(buffer).
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(slot * SLOT)
+            f.readinto(self._view[:_HEADER_SIZE])
+            _, _, source, _, sequence, stored, _, length = struct.unpack_from(_HEADER, self._buffer)
+            length = min(length, len(buffer))
+            f.readinto(memoryview(buffer)[:length])
+        return sequence & 0xFFFF, source, stored, length
+
+    def remove(self, destination, identifier):
+        """Delete a delivered message. Returns False if destination has no such message."""
+        for slot in self._index.get(destination, ()):
+            if self._sequence[slot] & 0xFFFF == identifier:
+                self._free_slot(slot)
+                self.stats.confirmed += 1
+                return True
+        return False
+
+    def expire(self, now=None):
+        """Delete expired messages. Returns how many."""
+        if now is None:
+            now = time.time()
+        count = 0
+        for slot in range(self.slots):
+            if self._sequence[slot] and self._expires[slot] <= now:
+                self._free_slot(slot)
+                count += 1
+        self.stats.expired += count
+        return count
+
+    def _free(self):
+        for slot in range(self.slots):
+            if not self._sequence[slot]:
+                return slot
+        return None
+
+    def _evict(self, slot):
+        self._free_slot(slot)
+        self.stats.evicted += 1
+
+    def _free_slot(self, slot):
+        # clearing the used byte is enough, the rest is overwritten by the next message
+        with open(self.path, 'r+b') as f:
+            f.seek(slot * SLOT)
+            f.write(b'\x00')
+        self._index[self._destination[slot]].remove(slot)
+        self._sequence[slot] = 0
+
+
+class Postmaster:
+    """
+    Serves a Mailbox over the radio: stores STOREs, answers FETCHes.
+
+    :param mailbox: a Mailbox
+    :param queue: radio_service PacketQueue for CHANNEL frames
+    :param tx: downlink.DownlinkScheduler; STORED replies are responses, DELIVERs bulk. Both
+        are queued with put(), poll() never waits on the downlink
+    :param lease: optional tasko handle held around SD access (e.g. cubesat.sd_lease)
+    :param batch: messages delivered per FETCH
+    """
+    def __init__(self, mailbox, queue, tx, *, lease=None, batch=4, owner='mailbox'):
+        self.mailbox = mailbox
+        self.queue = queue
+        self.tx = tx
+        self.lease = lease
+        self.batch = batch
+        self.owner = owner
+        self._frame = bytearray(_DELIVER_HEADER + MAX_MESSAGE)
+        self._view = memoryview(self._frame)
+
+    async def poll(self):
+        """Handle the frames waiting in the queue"""
+        packet = self.queue.get()
+        while packet is not None:
+            try:
+                data = packet.data
+                if len(data) >= 4 and data[0] == STORE:
+                    await self._store(packet.source, data)
+                elif len(data) >= 2 and data[0] == FETCH:
+                    await self._fetch(packet.source, data)
+            finally:
+                self.queue.release(packet)
+            packet = self.queue.get()
+
+    async def _store(self, source, data):
+        destination = data[1]
+        ttl = (data[2] | data[3] << 8) * 60
+        if self.lease is None:
+            identifier = self.mailbox.store(source, destination, data[4:], ttl)
+        else:
+            async with self.lease:
+                identifier = self.mailbox.store(source, destination, data[4:], ttl)
+        if identifier is None:
+            reply = struct.pack('<BBH', STORED, TOO_LONG, 0)
+        else:
+            reply = struct.pack('<BBH', STORED, OK, identifier)
+        self.tx.put(downlink.RESPONSE, reply, destination=source, flags=CHANNEL, owner=self.owner)
+
+    async def _fetch(self, node, data):
+        box = self.mailbox
+        count = min(data[1], (len(data) - 2) // 2)
+        if self.lease is None:
+            slots = self._confirm(node, data, count)
+        else:
+            async with self.lease:
+                slots = self._confirm(node, data, count)
+        now = time.time()
+        frame = self._frame
+        for slot in slots[:self.batch]:
+            if self.lease is None:
+                identifier, source, stored, length = box.read(slot, self._view[_DELIVER_HEADER:])
+            else:
+                async with self.lease:
+                    identifier, source, stored, length = box.read(slot, self._view[_DELIVER_HEADER:])
+            age = min(max(0, int(now - stored) // 60), 0xFFFF)
+            struct.pack_into('<BHBH', frame, 0, DELIVER, identifier, source, age)
+            # no room for the rest: they stay in the mailbox until the node's next FETCH
+            if not self.tx.put(downlink.BULK, self._view[:_DELIVER_HEADER + length], destination=node,
+                               flags=CHANNEL, owner=self.owner):
+                break
+            box.stats.delivered += 1
+
+    def _confirm(self, node, data, count):
+        for i in range(count):
+            self.mailbox.remove(node, data[2 + 2 * i] | data[3 + 2 * i] << 8)
+        return self.mailbox.pending(node)
@@ -12,9 +12,18 @@ import busio, time, sys
 from storage import mount,umount,VfsFat
 from analogio import AnalogIn
 import digitalio, sdcardio, pwmio, tasko
+from tasko import checkpoint
 
 # Hardware Specific Libs
 import pycubed_rfm9x # Radio
+from radio_service import RadioService
+from adr import RateController
+from airtime import AirtimeBudget
+from file_downlink import RadioLink
+import aggregate
+import downlink
+from downlink import DownlinkScheduler
+import mailbox
 import bmx160 # IMU
 import neopixel # RGB LED
 import bq25883 # USB Charger
@@ -89,8 +98,15 @@ class Satellite:
 
         # Define SPI,I2C,UART
         self.i2c1  = busio.I2C(board.SCL,board.SDA)
+        # async drivers share i2c1 through tasko (per device bus-wait & transaction counters)
+        self.i2c1_managed = tasko.ManagedI2C(self.i2c1)
         self.spi   = board.SPI()
         self.uart  = busio.UART(board.TX,board.RX)
+        # SD card & radio share self.spi. Both drivers drive their own chip selects,
+        # so tasks take a lease on the bus while they use them and yield between chunks
+        self.spi_managed = tasko.ManagedSpi(self.spi)
+        self.sd_lease = self.spi_managed.device_handle()
+        self.radio1_lease = self.spi_managed.device_handle()
 
         # Define GPS
         self.en_gps = digitalio.DigitalInOut(board.EN_GPS)
@@ -98,6 +114,7 @@ class Satellite:
 
         # Define filesystem stuff
         self.logfile="/log.txt"
+        self.schedfile=None
 
         # Define radio
         _rf_cs1 = digitalio.DigitalInOut(board.RF1_CS)
@@ -120,6 +137,7 @@ class Satellite:
             sys.path.append("/sd")
             self.hardware['SDcard'] = True
             self.logfile="/sd/log.txt"
+            self.schedfile="/sd/schedule.bin"
         except Exception as e:
             if self.debug: print('[ERROR][SD Card]',e)
 
@@ -147,6 +165,7 @@ class Satellite:
         try:
             self.pwr = adm1176.ADM1176(self.i2c1)
             self.pwr.sense_resistor = 1
+            self.pwr.i2c_handle = self.i2c1_managed.device(self.pwr.i2c_addr)
             self.hardware['PWR'] = True
         except Exception as e:
             if self.debug: print('[ERROR][Power Monitor]',e)
@@ -154,6 +173,7 @@ class Satellite:
         # Initialize IMU
         try:
             self.IMU = bmx160.BMX160_I2C(self.i2c1)
+            self.IMU.i2c_handle = self.i2c1_managed.device(self.IMU.i2c_device.device_address)
             self.hardware['IMU'] = True
         except Exception as e:
             if self.debug: print('[ERROR][IMU]',e)
@@ -175,6 +195,36 @@ class Satellite:
             self.radio1.dio0=self.radio1_DIO0
             self.radio1.enable_crc=True
             self.radio1.ack_delay=0.2
+            # Modem profiles: switch with self.radio1.use_profile(name)
+            self.radio1.define_profile('beacon',433.0,coding_rate=8,enable_crc=True)
+            self.radio1.define_profile('downlink',433.0,signal_bandwidth=500000,coding_rate=5,enable_crc=True)
+            # adaptive data rate ladder, most robust first ('beacon' matches the settings above)
+            self.radio1.define_profile('robust',433.0,spreading_factor=11,coding_rate=8,enable_crc=True)
+            self.radio1.define_profile('slow',433.0,spreading_factor=9,coding_rate=8,enable_crc=True)
+            self.radio1.define_profile('fast',433.0,signal_bandwidth=250000,coding_rate=5,enable_crc=True)
+            # background reception, see Tasks/radio_task.py (transmissions are Tasks/downlink_task.py)
+            self.radio1_rx = RadioService(self.radio1,lease=self.radio1_lease)
+            # to save power, self.radio1_rx.sniff(1.0) replaces continuous RX with a CAD every
+            # second; the ground must then send self.radio1.wake_preamble(1.2) symbol preambles
+            self.radio1_rate = RateController(self.radio1_rx,('robust','slow','beacon','fast','downlink'),default=2)
+            self.radio1_rx.monitor = self.radio1_rate.observe
+            # transmit duty cycle limit, airtime used per task is in radio1_airtime.used
+            self.radio1_airtime = AirtimeBudget(360,3600)
+            self.radio1.airtime_budget = self.radio1_airtime
+            # every downlink frame goes through one queue: command replies, then the beacon, then bulk
+            self.radio1_tx = DownlinkScheduler(self.radio1,lease=self.radio1_lease)
+            # small telemetry messages share frames, see lib/aggregate.py; flushes only queue the
+            # frame so the tasks putting telemetry don't wait on the airtime
+            self.radio1_telemetry = aggregate.Aggregator(RadioLink(self.radio1_tx.sender(downlink.BULK,wait=False),None,
+                owner='telemetry',channel=aggregate.CHANNEL),deadline=30)
+            # messages between ground nodes, kept on the SD card until asked for, see lib/mailbox.py
+            self.radio1_mail = None
+            if self.hardware['SDcard']:
+                try:
+                    self.radio1_mail = mailbox.Postmaster(mailbox.Mailbox('/sd/mailbox.bin'),
+                        self.radio1_rx.channel(mailbox.CHANNEL),self.radio1_tx,lease=self.sd_lease)
+                except Exception as e:
+                    if self.debug: print('[ERROR][Mailbox]',e)
             self.radio1.sleep()
             self.hardware['Radio1'] = True
         except Exception as e:
@@ -211,6 +261,24 @@ class Satellite:
         if self.hardware['IMU']:
             return self.IMU.gyro # deg/s
 
+    async def power_readings(self):
+        """
+        system voltage (V) and current draw (A) from one power monitor read.
+        Waits its turn on i2c1 without blocking other tasks.
+        """
+        if self.hardware['PWR']:
+            return await self.pwr.read_async()
+        return (None,None)
+
+    async def imu_readings(self):
+        """
+        accel (m/s^2), mag (uT) and gyro (deg/s) from one IMU burst read.
+        Waits its turn on i2c1 without blocking other tasks.
+        """
+        if self.hardware['IMU']:
+            return await self.IMU.read_imu_async()
+        return (None,None,None)
+
     @property
     def temperature(self):
         if self.hardware['IMU']:
@@ -302,12 +370,46 @@ class Satellite:
         self._resetReg.drive_mode=digitalio.DriveMode.PUSH_PULL
         self._resetReg.value=1
 
+    def bus_stats(self):
+        """
+        Bus sharing stats (tasko HandleStats: wait/hold time, queue depth) for each device on the shared buses
+        """
+        stats = {'sd':self.sd_lease.stats, 'radio1':self.radio1_lease.stats}
+        for name,dev in (('imu','IMU'),('pwr','pwr')):
+            if hasattr(self,dev) and getattr(self,dev).i2c_handle is not None:
+                stats[name]=getattr(self,dev).i2c_handle.stats
+        return stats
+
+    async def write_file(self, filedir, data, mode='ab', chunk=512):
+        """
+        Write data to a file on the SD card one chunk (512 bytes by default) per bus lease,
+        yielding between chunks so radio polling and other tasks keep running during big writes.
+        """
+        data = memoryview(data)
+        with open(filedir, mode) as f:
+            for i in range(0, len(data), chunk):
+                async with self.sd_lease:
+                    f.write(data[i:i+chunk])
+                await tasko.sleep(0)
+
     def log(self, msg):
         if self.hardware['SDcard']:
             with open(self.logfile, "a+") as f:
                 t=int(time.monotonic())
                 f.write(f'{t}, {msg}\n')
 
+    def save_schedule(self,record=None):
+        """
+        Write the schedule phase of every task to schedfile (see tasko.checkpoint), blocking.
+        The checkpoint task calls it every 10s and the reset paths call it on the way down.
+        Returns False if there is nowhere to save it. Raises OSError if the SD card write fails.
+        """
+        if self.schedfile is None or not hasattr(self,'scheduled_tasks'):
+            return False
+        with open(self.schedfile,'wb') as f:
+            f.write(checkpoint.save(self.scheduled_tasks,record))
+        return True
+
     def print_file(self,filedir=None,binary=False):
         if filedir==None:
             return
@@ -340,6 +442,7 @@ class Satellite:
             self.RGB = (0,0,0)
             self.neopixel.brightness=0
             if self.hardware['Radio1']:
+                self.radio1_rx.enabled = False
                 self.radio1.sleep()
             if self.hardware['Radio2']:
                 self.radio2.sleep()
@@ -362,6 +465,8 @@ class Satellite:
                 self.pwr.config('V_CONT,I_CONT')
             if self.hardware['GPS']:
                 self.en_gps.value = True
+            if self.hardware['Radio1']:
+                self.radio1_rx.enabled = True
             self.power_mode = 'normal'
             # don't forget to reconfigure radios, gps, etc...
 
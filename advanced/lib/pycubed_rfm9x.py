@@ -11,10 +11,14 @@ Library Repo: https://github.com/pycubed/library_pycubed.py
 * Edits by: Max Holliday
 """
 import time
+import struct
+import array
 from random import random
 import digitalio
 from micropython import const
 import adafruit_bus_device.spi_device as spidev
+import tasko
+from tasko.managed_spi import RegisterBatch
 
 # pylint: disable=bad-whitespace
 # Internal constants:
@@ -73,6 +77,14 @@ _RH_RF95_DETECTION_THRESHOLD = const(0x37)
 _RH_RF95_PA_DAC_DISABLE = const(0x04)
 _RH_RF95_PA_DAC_ENABLE = const(0x07)
 
+# LoRa configuration registers that only change when we write them. These are kept in
+# a write-through shadow so reads and read-modify-writes don't need an SPI read.
+# (OP_MODE, LNA gain and the status registers are changed by the chip itself.)
+_SHADOWABLE = bytearray(128)
+for _reg in (0x06, 0x07, 0x08, 0x09, 0x0A, 0x0B, 0x0E, 0x0F, 0x1D, 0x1E, 0x1F, 0x20, 0x21,
+             0x24, 0x26, 0x2F, 0x30, 0x31, 0x36, 0x37, 0x3A, 0x40, 0x4D):
+    _SHADOWABLE[_reg] = 1
+
 # The Frequency Synthesizer step = RH_RF95_FXOSC / 2^^19
 _RH_RF95_FSTEP = 32000000 / 524288
 
@@ -84,6 +96,12 @@ _RH_BROADCAST_ADDRESS = const(0xFF)
 # for application layer use.
 _RH_FLAGS_ACK = const(0x80)
 _RH_FLAGS_RETRY = const(0x40)
+# A deviation from the rule above: the first payload byte is the packet length (header
+# included), so receive_all() can split packets that arrived back to back. RadioHead
+# defines no 0x20 flag and ignores it, so a stock RadioHead peer takes the length byte
+# for the first byte of the payload: send_burst() is only for peers running this driver.
+# The lower nibble stays free for the application (radio_service channels use all of it).
+_RH_FLAGS_LENGTH = const(0x20)
 
 # User facing constants:
 SLEEP_MODE  = const(0)#0b000
@@ -92,6 +110,7 @@ FS_TX_MODE  = const(2)#0b010
 TX_MODE     = const(3)#0b011
 FS_RX_MODE  = const(4)#0b100
 RX_MODE     = const(5)#0b101
+CAD_MODE    = const(7)#0b111
 # pylint: enable=bad-whitespace
 
 # gap =bytes([0xFF])
@@ -112,8 +131,349 @@ VR3X=b'\xff\x00\xff\x00\xff\x00\xff\x00\x00\x00\xff\xff\xff\x00\xff\x00\x00\x00\
 # the warning to work around the error.
 # pylint: disable=too-many-instance-attributes
 
+class AckStats:
+    """Reliable datagram counters kept by RFM9x.send_with_ack_async().
+    Round trip times are in seconds, from the start of the acked transmission to its ACK."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sends = 0
+        self.acked = 0
+        self.failed = 0
+        self.transmissions = 0
+        self.retries = 0
+        self.refused = 0
+        """sends given up because the airtime budget refused a transmission"""
+        self.rtt_total = 0.0
+        self.rtt_min = None
+        self.rtt_max = 0.0
+        self.last_rtt = None
+
+    def _ack(self, rtt):
+        self.acked += 1
+        self.last_rtt = rtt
+        self.rtt_total += rtt
+        if self.rtt_min is None or rtt < self.rtt_min:
+            self.rtt_min = rtt
+        if rtt > self.rtt_max:
+            self.rtt_max = rtt
+
+    @property
+    def rtt_mean(self):
+        return self.rtt_total / self.acked if self.acked else None
+
+    def __repr__(self):
+        return "{{AckStats sends: {}, acked: {}, failed: {} ({} refused), transmissions: {}, retries: {}, " \
+               "rtt: {}/{}/{}s}}".format(self.sends, self.acked, self.failed, self.refused, self.transmissions,
+                                         self.retries, self.rtt_min, self.rtt_mean, self.rtt_max)
+
+    __str__ = __repr__
+
+class LinkStats:
+    """Radio link counters kept by the RFM9x send and receive paths.
+
+    Updates only add to existing ints (and one float for the airtime), so
+    they don't allocate. RSSI and SNR of accepted packets go into 8 bin
+    histograms: RSSI in 10dB steps from below -120 to -60dBm and above,
+    SNR in 5dB steps from below -20 to 10dB and above.
+
+    encode_into() packs everything into SIZE bytes for a beacon, counters
+    wrapping at 16 (bytes and airtime at 32) bits and histogram bins
+    saturating at 255; decode() unpacks that on the ground."""
+    FORMAT = '<HHIIIHHHHHHH8s8s'
+    SIZE = struct.calcsize(FORMAT)
+    BINS = 8
+
+    def __init__(self):
+        self.rssi_hist = [0] * self.BINS
+        self.snr_hist = [0] * self.BINS
+        self._bins = bytearray(2 * self.BINS)
+        self.reset()
+
+    def reset(self):
+        self.tx_packets = 0
+        self.rx_packets = 0
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.tx_time = 0.0
+        """seconds on air"""
+        self.ack_retries = 0
+        self.ack_failures = 0
+        self.tx_timeouts = 0
+        self.rx_timeouts = 0
+        self.crc_errors = 0
+        self.header_rejects = 0
+        """packets addressed to another node"""
+        self.short_packets = 0
+        """packets too short for a RadioHead header"""
+        for i in range(self.BINS):
+            self.rssi_hist[i] = 0
+            self.snr_hist[i] = 0
+
+    def _rx(self, length, rssi, snr_raw):
+        # rssi in dBm, snr_raw in quarter dB (the PKT_SNR_VALUE register, signed)
+        self.rx_packets += 1
+        self.rx_bytes += length
+        i = (rssi + 130) // 10
+        self.rssi_hist[0 if i < 0 else (7 if i > 7 else i)] += 1
+        i = (snr_raw + 100) // 20
+        self.snr_hist[0 if i < 0 else (7 if i > 7 else i)] += 1
+
+    def encode_into(self, buf, offset=0):
+        """Pack the counters into buf[offset:offset + SIZE]. Returns SIZE."""
+        bins = self._bins
+        for i in range(self.BINS):
+            bins[i] = min(self.rssi_hist[i], 255)
+            bins[self.BINS + i] = min(self.snr_hist[i], 255)
+        struct.pack_into(self.FORMAT, buf, offset,
+            self.tx_packets & 0xFFFF, self.rx_packets & 0xFFFF,
+            self.tx_bytes & 0xFFFFFFFF, self.rx_bytes & 0xFFFFFFFF, int(self.tx_time * 1000) & 0xFFFFFFFF,
+            self.ack_retries & 0xFFFF, self.ack_failures & 0xFFFF, self.tx_timeouts & 0xFFFF,
+            self.rx_timeouts & 0xFFFF, self.crc_errors & 0xFFFF, self.header_rejects & 0xFFFF,
+            self.short_packets & 0xFFFF, bins[:self.BINS], bins[self.BINS:])
+        return self.SIZE
+
+    @classmethod
+    def decode(cls, buf, offset=0):
+        """A LinkStats from encode_into() output"""
+        stats = cls()
+        (stats.tx_packets, stats.rx_packets, stats.tx_bytes, stats.rx_bytes, tx_ms,
+         stats.ack_retries, stats.ack_failures, stats.tx_timeouts, stats.rx_timeouts,
+         stats.crc_errors, stats.header_rejects, stats.short_packets,
+         rssi, snr) = struct.unpack_from(cls.FORMAT, buf, offset)
+        stats.tx_time = tx_ms / 1000
+        stats.rssi_hist = list(rssi)
+        stats.snr_hist = list(snr)
+        return stats
+
+    def __repr__(self):
+        return "{{LinkStats tx: {} ({}B, {:.1f}s), rx: {} ({}B), ack retries: {}, ack failures: {}, " \
+               "timeouts tx/rx: {}/{}, crc: {}, rejects: {}, short: {}, rssi: {}, snr: {}}}".format(
+                   self.tx_packets, self.tx_bytes, self.tx_time, self.rx_packets, self.rx_bytes,
+                   self.ack_retries, self.ack_failures, self.tx_timeouts, self.rx_timeouts,
+                   self.crc_errors, self.header_rejects, self.short_packets, self.rssi_hist, self.snr_hist)
+
+    __str__ = __repr__
+
+class DuplicateFilter:
+    """Drops RadioHead retransmissions of packets already received.
+
+    For each source it keeps the highest identifier seen and a WINDOW bit map
+    of the identifiers before it (bit n stands for highest - n). Only packets
+    flagged as retries can be duplicates: a first transmission always gets
+    through, and restarts the window if its identifier was already seen
+    (the sender rebooted, or uses plain send() with a fixed identifier)."""
+    WINDOW = 32
+
+    def __init__(self):
+        self._top = bytearray(256)
+        self._seen = array.array('I', [0] * 256)
+        self.dropped = 0
+        """duplicates rejected"""
+
+    def reset(self):
+        for i in range(256):
+            self._seen[i] = 0
+        self.dropped = 0
+
+    def check(self, source, identifier, flags):
+        """Record a received packet. Returns False if it is a duplicate."""
+        seen = self._seen[source]
+        top = self._top[source]
+        ahead = (identifier - top) & 0xFF
+        if seen and 0 < ahead < 128:
+            # newer: slide the window up
+            self._top[source] = identifier
+            self._seen[source] = (((seen << ahead) & 0xFFFFFFFF) | 1) if ahead < self.WINDOW else 1
+            return True
+        back = (top - identifier) & 0xFF
+        if seen and back < self.WINDOW:
+            bit = 1 << back
+            if not seen & bit:
+                # late, but not seen before
+                self._seen[source] = seen | bit
+                return True
+            if flags & _RH_FLAGS_RETRY:
+                self.dropped += 1
+                return False
+        self._top[source] = identifier
+        self._seen[source] = 1
+        return True
+
+    def __repr__(self):
+        return "{{DuplicateFilter dropped: {}}}".format(self.dropped)
+
+    __str__ = __repr__
+
 _bigbuffer=bytearray(256)
 bw_bins = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000)
+
+def time_on_air(length, spreading_factor, signal_bandwidth, coding_rate, preamble_length=8,
+                enable_crc=True, low_datarate_optimize=False, implicit_header=False):
+    """Seconds a LoRa packet with a length byte FIFO payload (RadioHead header
+    included) occupies the channel, from the SX1276 datasheet (section 4.1.1.7).
+    coding_rate is the denominator of 4/N."""
+    symbol = (1 << spreading_factor) / signal_bandwidth
+    de = 2 if low_datarate_optimize else 0
+    bits = 8 * length - 4 * spreading_factor + 28 + (16 if enable_crc else 0) - (20 if implicit_header else 0)
+    step = 4 * (spreading_factor - de)
+    # ceil(bits / step) without floats, and never negative
+    blocks = (bits + step - 1) // step if bits > 0 else 0
+    return (preamble_length + 4.25 + 8 + blocks * coding_rate) * symbol
+
+class ModemProfile:
+    """A LoRa modem configuration precomputed into its raw register image.
+
+    The image covers the contiguous register ranges in RANGES (frequency, PA,
+    modem config, preamble, LDRO/AGC, errata and PA DAC registers) and is
+    applied with one RegisterBatch: a single bus lock and one burst write per
+    range, instead of the separate read-modify-writes the property setters do.
+
+    Build one with RFM9x.define_profile() or capture the current settings with
+    RFM9x.snapshot().
+    """
+    # (first register, count) of each contiguous range in the image
+    RANGES = ((0x06, 6), (0x1D, 5), (0x26, 1), (0x2F, 3), (0x36, 2), (0x3A, 1), (0x4D, 1))
+    SIZE = 19
+
+    def __init__(self):
+        self.image = bytearray(self.SIZE)
+        self.batch = RegisterBatch(max_ops=self.SIZE)
+
+    def _set(self, address, val):
+        offset = 0
+        for start, count in self.RANGES:
+            if start <= address < start + count:
+                self.image[offset + address - start] = val & 0xFF
+                return
+            offset += count
+        raise ValueError('register {} is not in a modem profile'.format(hex(address)))
+
+    def encode(self, frequency, *, spreading_factor=7, signal_bandwidth=125000, coding_rate=5,
+               preamble_length=8, enable_crc=False, tx_power=13, low_datarate_optimize=None,
+               auto_agc=True, high_power=True, max_output=False):
+        """Fill the image from modem settings, using the same rules as the RFM9x setters.
+        low_datarate_optimize=None turns LDRO on when a symbol lasts longer than 16ms."""
+        if frequency < 240 or frequency > 960:
+            raise RuntimeError("frequency_mhz must be between 240 and 960")
+        frf = int((frequency * 1000000.0) / _RH_RF95_FSTEP) & 0xFFFFFF
+        self._set(_RH_RF95_REG_06_FRF_MSB, frf >> 16)
+        self._set(_RH_RF95_REG_07_FRF_MID, frf >> 8)
+        self._set(_RH_RF95_REG_08_FRF_LSB, frf)
+
+        # PA_CONFIG, OCP and PA_DAC (see the tx_power setter)
+        tx_power = int(tx_power)
+        ocp = 0x2B # reset default, 100mA
+        pa_dac = _RH_RF95_PA_DAC_DISABLE
+        if max_output:
+            ocp = 0x3F
+            pa_dac = _RH_RF95_PA_DAC_ENABLE
+            pa_config = 0xFF
+        elif high_power:
+            if tx_power < 5 or tx_power > 23:
+                raise RuntimeError("tx_power must be between 5 and 23")
+            if tx_power > 20:
+                pa_dac = _RH_RF95_PA_DAC_ENABLE
+                tx_power -= 3
+            pa_config = 0xC0 | ((tx_power - 5) & 0x0F)
+        else:
+            assert -1 <= tx_power <= 14
+            pa_config = 0x70 | ((tx_power + 1) & 0x0F)
+        self._set(_RH_RF95_REG_09_PA_CONFIG, pa_config)
+        self._set(_RH_RF95_REG_0A_PA_RAMP, 0x00)
+        self._set(_RH_RF95_REG_0B_OCP, ocp)
+        self._set(_RH_RF95_REG_4D_PA_DAC, 0x80 | pa_dac)
+
+        for bw_id, cutoff in enumerate(bw_bins):
+            if signal_bandwidth <= cutoff:
+                break
+        else:
+            bw_id = 9
+        cr_id = min(max(coding_rate, 5), 8) - 4
+        sf = min(max(spreading_factor, 6), 12)
+        self._set(_RH_RF95_REG_1D_MODEM_CONFIG1, (bw_id << 4) | (cr_id << 1))
+        self._set(_RH_RF95_REG_1E_MODEM_CONFIG2, (sf << 4) | (0x04 if enable_crc else 0))
+        self._set(0x1F, 0x64) # RX symbol timeout, reset default
+        assert 0 <= preamble_length <= 65535
+        self._set(_RH_RF95_REG_20_PREAMBLE_MSB, preamble_length >> 8)
+        self._set(_RH_RF95_REG_21_PREAMBLE_LSB, preamble_length)
+
+        if low_datarate_optimize is None:
+            bandwidth = 500000 if bw_id >= len(bw_bins) else bw_bins[bw_id]
+            low_datarate_optimize = (1 << sf) * 1000 > 16 * bandwidth
+        self._set(_RH_RF95_REG_26_MODEM_CONFIG3,
+                  (0x08 if low_datarate_optimize else 0) | (0x04 if auto_agc else 0))
+
+        # errata registers, as written by the signal_bandwidth and spreading_factor setters
+        if bw_id >= len(bw_bins):
+            # see Semtech SX1276 errata note 2.1
+            self._set(0x2F, 0x20)
+            self._set(0x36, 0x02)
+            self._set(0x3A, 0x64)
+        else:
+            if bw_id == 0:
+                self._set(0x2F, 0x48)
+            elif bw_id >= 6:
+                # see Semtech SX1276 errata note 2.3
+                self._set(0x2F, 0x40)
+            else:
+                self._set(0x2F, 0x44)
+            self._set(0x36, 0x03)
+            self._set(0x3A, 0x65)
+        self._set(0x30, 0x00)
+        self._set(_RH_RF95_DETECTION_OPTIMIZE, 0x45 if sf == 6 else 0x43)
+        self._set(_RH_RF95_DETECTION_THRESHOLD, 0x0C if sf == 6 else 0x0A)
+        self.compile()
+        return self
+
+    # image offsets of MODEM_CONFIG1/2, PREAMBLE_MSB/LSB and MODEM_CONFIG3
+    _CONFIG1 = 6
+    _CONFIG2 = 7
+    _PREAMBLE = 9
+    _CONFIG3 = 11
+
+    @property
+    def spreading_factor(self):
+        return self.image[self._CONFIG2] >> 4
+
+    @property
+    def signal_bandwidth(self):
+        bw_id = self.image[self._CONFIG1] >> 4
+        return 500000 if bw_id >= len(bw_bins) else bw_bins[bw_id]
+
+    @property
+    def coding_rate(self):
+        """denominator of the 4/N coding rate"""
+        return ((self.image[self._CONFIG1] >> 1) & 0x07) + 4
+
+    @property
+    def preamble_length(self):
+        return (self.image[self._PREAMBLE] << 8) | self.image[self._PREAMBLE + 1]
+
+    @property
+    def enable_crc(self):
+        return bool(self.image[self._CONFIG2] & 0x04)
+
+    @property
+    def low_datarate_optimize(self):
+        return bool(self.image[self._CONFIG3] & 0x08)
+
+    def time_on_air(self, length):
+        """seconds on air for a length byte packet (RadioHead header included) with this profile"""
+        return time_on_air(length, self.spreading_factor, self.signal_bandwidth, self.coding_rate,
+                           self.preamble_length, self.enable_crc, self.low_datarate_optimize)
+
+    def compile(self):
+        """Rebuild the register batch from the image. Call after changing the image by hand."""
+        batch = self.batch
+        batch.clear()
+        offset = 0
+        for start, count in self.RANGES:
+            for i in range(count):
+                batch.write(start + i, self.image[offset + i])
+            offset += count
+
 class RFM9x:
     """Interface to a RFM95/6/7/8 LoRa radio module.  Allows sending and
     receivng bytes of data in long range LoRa mode at a support board frequency
@@ -150,7 +510,6 @@ class RFM9x:
     # Global buffer for SPI commands
     _BUFFER = bytearray(4)
     DEBUG_HEADER=False
-    valid_ids  = (58,59,60,255)
     class _RegisterBits:
         # Class to simplify access to the many configuration bits avaialable
         # on the chip's registers.  This is a subclass here instead of using
@@ -188,10 +547,7 @@ class RFM9x:
             return (reg_value & self._mask) >> self._offset
 
         def __set__(self, obj, val):
-            reg_value = obj._read_u8(self._address)
-            reg_value &= ~self._mask
-            reg_value |= (val & 0xFF) << self._offset
-            obj._write_u8(self._address, reg_value)
+            obj._update_u8(self._address, self._mask, (val & 0xFF) << self._offset)
 
     operation_mode = _RegisterBits(_RH_RF95_REG_01_OP_MODE, bits=3)
 
@@ -245,6 +601,24 @@ class RFM9x:
         # Device support SPI mode 0 (polarity & phase = 0) up to a max of 10mhz.
         # Set Default Baudrate to 5MHz to avoid problems
         self._device = spidev.SPIDevice(spi, cs, baudrate=baudrate, polarity=0, phase=0)
+        # register ops that run back to back under a single bus lock
+        self._batch = RegisterBatch()
+        # write-through copy of the configuration registers (see _SHADOWABLE)
+        self._shadow = bytearray(128)
+        self._shadow_valid = bytearray(128)
+        self.shadow_debug = False
+        """Set True to check every shadowed register read against the chip."""
+        self.requested_mode = None
+        """The mode last set with idle(), sleep(), listen(), transmit() or cad(), kept so checking it costs
+        no SPI read. The chip itself goes back to standby when a transmission or a CAD is done."""
+        self.rx_claims = 0
+        """Tasks waiting for a packet in receive_async() or for an ACK in send_with_ack_async().
+        Background receivers (radio_service.RadioService) leave the radio to them meanwhile."""
+        # result of a send_async() transmission that a blocking send() waited out, until its task sees it
+        self._tx_finished = None
+        self.shadow_mismatches = 0
+        self.shadow_mismatch = None
+        """Address of the last register found to differ from its shadow (shadow_debug, verify_shadow())."""
         # Setup reset as a digital input (default state for reset line according
         # to the datasheet).  This line is pulled low as an output quickly to
         # trigger a reset.  Note that reset MUST be done like this and set as
@@ -304,6 +678,8 @@ class RFM9x:
            This instantaneous RSSI value may not be accurate once the
            operating mode has been changed.
         """
+        self.last_snr = 0.0
+        """The SNR (dB) of the last received packet, stored with last_rssi."""
         # initialize timeouts and delays delays
         self.ack_wait = 0.5
         """The delay time before attempting a retry after not receiving an ACK"""
@@ -315,6 +691,22 @@ class RFM9x:
         """The amount of time to wait for the HW to transmit the packet.
            This is mainly used to prevent a hang due to a HW issue
         """
+        self.tx_poll = 0.01
+        """How often the async send/receive calls check the radio while other tasks run."""
+        self.ack_stats = AckStats()
+        """Counters and round trip times from send_with_ack_async()"""
+        self.link_stats = LinkStats()
+        """Packet, byte, airtime, error and signal counters for this radio"""
+        self.airtime_budget = None
+        """Optional airtime.AirtimeBudget every send draws its time on air from.
+           ACKs are charged but never refused."""
+        self.listen_before_talk = False
+        """If True, send_async() checks the channel with CAD first and backs off
+           while another transmission's preamble is on the air."""
+        self.lbt_attempts = 5
+        """CAD checks before send_async() transmits anyway"""
+        self.lbt_deferrals = 0
+        """Times listen before talk found the channel busy"""
         self.ack_retries = 5
         """The number of ACK retries before reporting a failure."""
         self.ack_delay = None
@@ -323,8 +715,18 @@ class RFM9x:
         """
         # initialize sequence number counter for reliabe datagram mode
         self.sequence_number = 0
-        # create seen Ids list
-        self.seen_ids = bytearray(256)
+        self.duplicates = DuplicateFilter()
+        """Window of recently received identifiers per source; retries of packets
+           already received are ACKed again but not returned. None disables it."""
+        self.unacked_duplicate = None
+        """Header of a retry the last receive dropped as a duplicate without ACKing it
+           (with_ack off, receive_all()). Callers that ACK by hand ACK it again with
+           ack_duplicate_async(): the sender retried because our first ACK was lost."""
+        self.burst_errors = 0
+        """Times receive_all() couldn't delimit the packets before the latest one"""
+        self._rx_tail = None
+        self._burst_rx = None
+        self._burst_tx = None
         # initialize packet header
         # node address - default is broadcast
         self.node = _RH_BROADCAST_ADDRESS
@@ -349,26 +751,79 @@ class RFM9x:
            Lower 4 bits may be used to pass information.
            Fourth byte of the RadioHead header.
         """
-        self.crc_error_count = 0
 
         self.auto_agc=True
         self.pa_ramp=0   # mode agnostic
         self.lna_boost=3 # mode agnostic
 
+        self.profiles = {}
+        """Named ModemProfiles, see define_profile()"""
+        self._cw_cache = ModemProfile()
+
+    @property
+    def crc_error_count(self):
+        return self.link_stats.crc_errors
+
+    def define_profile(self, name, frequency, **settings):
+        """Precompute a named modem profile for this radio. settings are the
+        keyword arguments of ModemProfile.encode(): spreading_factor,
+        signal_bandwidth, coding_rate, preamble_length, enable_crc, tx_power,
+        low_datarate_optimize and auto_agc. Switch to it with use_profile(name).
+        """
+        profile = ModemProfile().encode(frequency, high_power=self.high_power,
+                                        max_output=self.max_output, **settings)
+        self.profiles[name] = profile
+        return profile
+
+    def use_profile(self, name):
+        """Apply a profile made with define_profile()"""
+        self.apply_profile(self.profiles[name])
+
+    def snapshot(self, profile=None):
+        """Capture the current LoRa modem settings in a ModemProfile
+        (reusing profile if given) for apply_profile() to restore later."""
+        if profile is None:
+            profile = ModemProfile()
+        image = memoryview(profile.image)
+        offset = 0
+        for start, count in ModemProfile.RANGES:
+            for i in range(count):
+                if not self._shadow_valid[start + i]:
+                    # one burst read fills the shadow for the whole range
+                    self._read_into(start, image[offset:offset + count])
+                    for j in range(count):
+                        self._shadow_write(start + j, image[offset + j])
+                    break
+            else:
+                for i in range(count):
+                    image[offset + i] = self._read_u8(start + i)
+            offset += count
+        profile.compile()
+        return profile
+
+    def apply_profile(self, profile):
+        """Switch the modem to profile under one bus lock, one burst write per register range.
+        The radio is left in standby."""
+        self.idle()
+        self._run_batch(profile.batch)
+        offset = 0
+        for start, count in ModemProfile.RANGES:
+            for i in range(count):
+                self._shadow_write(start + i, profile.image[offset + i])
+            offset += count
+
     def cw(self,msg=None):
         success=False
         if msg is None:
             msg = VR3X
 
-        cache=[]
+        cache=None
         if self.long_range_mode:
             # cache LoRa params
-            cache = [self.spreading_factor,
-                    self.signal_bandwidth,
-                    self.coding_rate,
-                    self.preamble_length,
-                    self.enable_crc]
+            cache = self.snapshot(self._cw_cache)
 
+        # FSK/OOK mode reuses the LoRa register addresses for other things
+        self.invalidate_shadow()
         self.operation_mode = SLEEP_MODE
         time.sleep(0.01)
         self.long_range_mode=False # FSK/OOK Mode
@@ -402,17 +857,14 @@ class RFM9x:
             self.operation_mode = SLEEP_MODE
             time.sleep(0.01)
             self.long_range_mode = True
+            self.invalidate_shadow()
             self._write_u8(_RH_RF95_REG_0E_FIFO_TX_BASE_ADDR, 0x00)
             self._write_u8(_RH_RF95_REG_0F_FIFO_RX_BASE_ADDR, 0x00)
             self._write_u8(_RH_RF95_REG_24_HOP_PERIOD, 0x00)
             self.idle()
-            self.spreading_factor = cache[0]
-            self.signal_bandwidth = cache[1]
-            self.coding_rate      = cache[2]
-            self.preamble_length  = cache[3]
-            self.enable_crc       = cache[4]
-            self.auto_agc = True
-            self.low_datarate_optimize = True
+            self.apply_profile(cache)
+        else:
+            self.invalidate_shadow()
         return success
 
     # pylint: disable=no-member
@@ -431,9 +883,48 @@ class RFM9x:
 
     def _read_u8(self, address):
         # Read a single byte from the provided address and return it.
+        # Configuration registers come from the shadow once we have a copy.
+        if self._shadow_valid[address]:
+            if self.shadow_debug:
+                return self._check_shadow(address)
+            return self._shadow[address]
         self._read_into(address, self._BUFFER, length=1)
+        if _SHADOWABLE[address]:
+            self._shadow[address] = self._BUFFER[0]
+            self._shadow_valid[address] = 1
         return self._BUFFER[0]
 
+    def _check_shadow(self, address):
+        # shadow_debug: compare the shadow with the chip, trust the chip
+        self._read_into(address, self._BUFFER, length=1)
+        if self._BUFFER[0] != self._shadow[address]:
+            self.shadow_mismatches += 1
+            self.shadow_mismatch = address
+            self._shadow[address] = self._BUFFER[0]
+        return self._BUFFER[0]
+
+    def _shadow_write(self, address, val):
+        if _SHADOWABLE[address]:
+            self._shadow[address] = val & 0xFF
+            self._shadow_valid[address] = 1
+
+    def invalidate_shadow(self):
+        """Forget the register shadow. The next access re-reads each register from the chip."""
+        for i in range(len(self._shadow_valid)):
+            self._shadow_valid[i] = 0
+
+    def verify_shadow(self):
+        """Read every shadowed register back from the chip. Returns the number of mismatches found."""
+        debug, self.shadow_debug = self.shadow_debug, True
+        start = self.shadow_mismatches
+        try:
+            for address in range(len(self._shadow_valid)):
+                if self._shadow_valid[address]:
+                    self._read_u8(address)
+        finally:
+            self.shadow_debug = debug
+        return self.shadow_mismatches - start
+
     def _write_from(self, address, buf, length=None):
         # Write a number of bytes to the provided address and taken from the
         # provided buffer.  If no length is specified (the default) the entire
@@ -445,6 +936,10 @@ class RFM9x:
             # indicate a write.
             device.write(self._BUFFER, end=1)
             device.write(buf, end=length)
+        if address != _RH_RF95_REG_00_FIFO:
+            # burst register write (the FIFO address doesn't auto-increment)
+            for i in range(length):
+                self._shadow_write(address + i, buf[i])
 
     def _write_u8(self, address, val):
         # Write a byte register to the chip.  Specify the 7-bit address and the
@@ -454,10 +949,46 @@ class RFM9x:
             # indicate a write.
             self._BUFFER[1] = val & 0xFF
             device.write(self._BUFFER, end=2)
+        self._shadow_write(address, val)
+
+    def _run_batch(self, batch):
+        # Run a RegisterBatch with one bus lock. Chip select is still pulsed between
+        # (non-burst) register accesses as the SX127x requires.
+        try:
+            with self._device as device:
+                batch.run(device, self._device.chip_select)
+        except Exception:
+            # writes queued with _queue_write may not have made it to the chip
+            self.invalidate_shadow()
+            raise
+        return batch.results
+
+    def _queue_write(self, address, val):
+        # queue a register write on self._batch, keeping the shadow up to date
+        self._shadow_write(address, val)
+        self._batch.write(address, val)
+
+    def _queue_update(self, address, mask, val):
+        # queue a read-modify-write on self._batch: reg = (reg & ~mask) | val
+        # With a shadow copy this is a single write instead of a read then a write.
+        if self._shadow_valid[address] and not self.shadow_debug:
+            self._queue_write(address, (self._shadow[address] & ~mask & 0xFF) | val)
+        else:
+            self._queue_write(address, (self._read_u8(address) & ~mask & 0xFF) | val)
+
+    def _update_u8(self, address, mask, val):
+        # Read-modify-write a register: reg = (reg & ~mask) | val
+        if _SHADOWABLE[address]:
+            self._write_u8(address, (self._read_u8(address) & ~mask & 0xFF) | val)
+            return
+        self._batch.clear()
+        self._batch.update(address, mask, val)
+        self._run_batch(self._batch)
 
     def reset(self):
         """Perform a reset of the chip."""
         # See section 7.2.2 of the datasheet for reset description.
+        self.invalidate_shadow()
         self._reset.switch_to_output(value=False)
         time.sleep(0.0001)  # 100 us
         self._reset.switch_to_input(pull=digitalio.Pull.UP)
@@ -466,16 +997,21 @@ class RFM9x:
     def idle(self):
         """Enter idle standby mode."""
         self.operation_mode = STANDBY_MODE
+        self.requested_mode = STANDBY_MODE
+        self._rx_tail = None
 
     def sleep(self):
         """Enter sleep mode."""
         self.operation_mode = SLEEP_MODE
+        self.requested_mode = SLEEP_MODE
+        self._rx_tail = None
 
     def listen(self):
         """Listen for packets to be received by the chip.  Use :py:func:`receive`
         to listen, wait and retrieve packets as they're available.
         """
         self.operation_mode = RX_MODE
+        self.requested_mode = RX_MODE
         self.dio0_mapping = 0b00  # Interrupt on rx done.
 
     def transmit(self):
@@ -484,6 +1020,7 @@ class RFM9x:
         transmitting a packet of data use :py:func:`send` instead.
         """
         self.operation_mode = TX_MODE
+        self.requested_mode = TX_MODE
         self.dio0_mapping = 0b01  # Interrupt on tx done.
 
     @property
@@ -576,7 +1113,9 @@ class RFM9x:
     # ADDED FOR PYCUBED
     @property
     def packet_status(self):
-        return (self.rssi,self._read_u8(_RH_RF95_REG_19_PKT_SNR_VALUE)/4)
+        """(RSSI in dBm, SNR in dB) of the last received packet"""
+        snr = self._read_u8(_RH_RF95_REG_19_PKT_SNR_VALUE)
+        return (self.rssi(),(snr - 256 if snr > 127 else snr)/4)
 
     @property
     def pll_timeout(self):
@@ -611,22 +1150,22 @@ class RFM9x:
                 break
         else:
             bw_id = 9
-        self._write_u8(
-            _RH_RF95_REG_1D_MODEM_CONFIG1,
-            (self._read_u8(_RH_RF95_REG_1D_MODEM_CONFIG1) & 0x0F) | (bw_id << 4))
+        self._batch.clear()
+        self._queue_update(_RH_RF95_REG_1D_MODEM_CONFIG1, 0xF0, bw_id << 4)
         if val >= 500000:
             # see Semtech SX1276 errata note 2.1
-            self._write_u8(0x36,0x02)
-            self._write_u8(0x3a,0x64)
+            self._queue_write(0x36,0x02)
+            self._queue_write(0x3a,0x64)
         else:
             if val == 7800:
-                self._write_u8(0x2F,0x48)
+                self._queue_write(0x2F,0x48)
             elif val >= 62500:
                 # see Semtech SX1276 errata note 2.3
-                self._write_u8(0x2F,0x40)
+                self._queue_write(0x2F,0x40)
             else:
-                self._write_u8(0x2F,0x44)
-            self._write_u8(0x30,0)
+                self._queue_write(0x2F,0x44)
+            self._queue_write(0x30,0)
+        self._run_batch(self._batch)
 
 
     @property
@@ -644,10 +1183,7 @@ class RFM9x:
         # Set coding rate (set to 5 to match RadioHead Cr45).
         denominator = min(max(val, 5), 8)
         cr_id = denominator - 4
-        self._write_u8(
-            _RH_RF95_REG_1D_MODEM_CONFIG1,
-            (self._read_u8(_RH_RF95_REG_1D_MODEM_CONFIG1) & 0xF1) | (cr_id << 1),
-        )
+        self._update_u8(_RH_RF95_REG_1D_MODEM_CONFIG1, 0x0E, cr_id << 1)
 
     @property
     def spreading_factor(self):
@@ -662,22 +1198,18 @@ class RFM9x:
     def spreading_factor(self, val):
         # Set spreading factor (set to 7 to match RadioHead Sf128).
         val = min(max(val, 6), 12)
-        self._write_u8(_RH_RF95_DETECTION_OPTIMIZE, 0xC5 if val == 6 else 0xC3)
-
-        if self.signal_bandwidth >= 5000000:
-            self._write_u8(_RH_RF95_DETECTION_OPTIMIZE, 0xC5 if val == 6 else 0xC3)
+        # signal_bandwidth comes from the shadow, so check it before starting the batch
+        wide = self.signal_bandwidth >= 5000000
+        self._batch.clear()
+        if wide:
+            self._queue_write(_RH_RF95_DETECTION_OPTIMIZE, 0xC5 if val == 6 else 0xC3)
         else:
             # see Semtech SX1276 errata note 2.3
-            self._write_u8(_RH_RF95_DETECTION_OPTIMIZE, 0x45 if val == 6 else 0x43)
-
-        self._write_u8(_RH_RF95_DETECTION_THRESHOLD, 0x0C if val == 6 else 0x0A)
-        self._write_u8(
-            _RH_RF95_REG_1E_MODEM_CONFIG2,
-            (
-                (self._read_u8(_RH_RF95_REG_1E_MODEM_CONFIG2) & 0x0F)
-                | ((val << 4) & 0xF0)
-            ),
-        )
+            self._queue_write(_RH_RF95_DETECTION_OPTIMIZE, 0x45 if val == 6 else 0x43)
+
+        self._queue_write(_RH_RF95_DETECTION_THRESHOLD, 0x0C if val == 6 else 0x0A)
+        self._queue_update(_RH_RF95_REG_1E_MODEM_CONFIG2, 0xF0, (val << 4) & 0xF0)
+        self._run_batch(self._batch)
 
 
     @property
@@ -690,16 +1222,7 @@ class RFM9x:
     @enable_crc.setter
     def enable_crc(self, val):
         # Optionally enable CRC checking on incoming packets.
-        if val:
-            self._write_u8(
-                _RH_RF95_REG_1E_MODEM_CONFIG2,
-                self._read_u8(_RH_RF95_REG_1E_MODEM_CONFIG2) | 0x04,
-            )
-        else:
-            self._write_u8(
-                _RH_RF95_REG_1E_MODEM_CONFIG2,
-                self._read_u8(_RH_RF95_REG_1E_MODEM_CONFIG2) & 0xFB,
-            )
+        self._update_u8(_RH_RF95_REG_1E_MODEM_CONFIG2, 0x04, 0x04 if val else 0)
 
     def tx_done(self):
         """Transmit status"""
@@ -721,7 +1244,7 @@ class RFM9x:
         _t=time.monotonic()+timeout
         while not self.rx_done():
             if time.monotonic() < _t:
-                yield
+                await tasko.sleep(0)
             else:
                 # Timed out
                 return False
@@ -732,6 +1255,78 @@ class RFM9x:
         """crc status"""
         return (self._read_u8(_RH_RF95_REG_12_IRQ_FLAGS) & 0x20) >> 5
 
+    def cad(self):
+        """Start channel activity detection: the chip looks for a LoRa preamble
+           for about two symbols, then returns to standby with CadDone set."""
+        self.operation_mode = CAD_MODE
+        self.requested_mode = CAD_MODE
+        self.dio0_mapping = 0b10  # Interrupt on CAD done.
+
+    def cad_done(self):
+        """CAD status"""
+        if self.dio0:
+            return self.dio0.value
+        return (self._read_u8(_RH_RF95_REG_12_IRQ_FLAGS) & 0x4) >> 2
+
+    def cad_detected(self):
+        """Read and clear the result of the last CAD: True if it saw a preamble"""
+        detected = self._read_u8(_RH_RF95_REG_12_IRQ_FLAGS) & 0x01
+        self._write_u8(_RH_RF95_REG_12_IRQ_FLAGS, 0x05)
+        return bool(detected)
+
+    async def channel_clear(self, *, lease=None):
+        """Run a CAD, letting other tasks run meanwhile. Returns True if no
+           preamble was heard. Leaves the radio in standby."""
+        if lease is None:
+            self.cad()
+        else:
+            async with lease:
+                self.cad()
+        # a CAD takes two symbols: a few ms, up to 66ms at SF12/BW125
+        if await self._await_irq(self.cad_done, 0.5, lease):
+            self.idle()
+            return True
+        if lease is None:
+            return not self.cad_detected()
+        async with lease:
+            return not self.cad_detected()
+
+    def signal_detected(self):
+        """True while the modem hears a LoRa signal (a preamble or a packet) in RX"""
+        return bool(self._read_u8(_RH_RF95_REG_18_MODEM_STAT) & 0x01)
+
+    def symbol_time(self):
+        """Seconds per LoRa symbol with the current settings (from the register shadow)"""
+        bw_id = self._read_u8(_RH_RF95_REG_1D_MODEM_CONFIG1) >> 4
+        bandwidth = 500000 if bw_id >= len(bw_bins) else bw_bins[bw_id]
+        return (1 << (self._read_u8(_RH_RF95_REG_1E_MODEM_CONFIG2) >> 4)) / bandwidth
+
+    def wake_preamble(self, interval):
+        """The preamble_length a sender needs so that a receiver running a CAD at
+           least every interval seconds wakes up in time to receive the packet: the
+           preamble spans a whole interval, the CAD and the switch to RX. For
+           radio_service.RadioService.sniff() add two of its poll periods to the
+           sniff interval."""
+        return min(0xFFFF, int(interval / self.symbol_time()) + 8)
+
+    def time_on_air(self, length):
+        """Seconds on air for a length byte packet (RadioHead header included)
+           with the current settings. Reads the register shadow, so no SPI traffic
+           once the modem config has been read or written."""
+        config1 = self._read_u8(_RH_RF95_REG_1D_MODEM_CONFIG1)
+        config2 = self._read_u8(_RH_RF95_REG_1E_MODEM_CONFIG2)
+        bw_id = config1 >> 4
+        return time_on_air(
+            length,
+            config2 >> 4,
+            500000 if bw_id >= len(bw_bins) else bw_bins[bw_id],
+            ((config1 >> 1) & 0x07) + 4,
+            (self._read_u8(_RH_RF95_REG_20_PREAMBLE_MSB) << 8) | self._read_u8(_RH_RF95_REG_21_PREAMBLE_LSB),
+            bool(config2 & 0x04),
+            bool(self._read_u8(_RH_RF95_REG_26_MODEM_CONFIG3) & 0x08),
+            bool(config1 & 0x01),
+        )
+
     def send(
         self,
         data,
@@ -740,7 +1335,8 @@ class RFM9x:
         destination=None,
         node=None,
         identifier=None,
-        flags=None
+        flags=None,
+        owner=None
     ):
         """Send a string of data using the transmitter.
            You can only send 252 bytes at a time
@@ -752,9 +1348,120 @@ class RFM9x:
            Values passed via kwargs do not alter the attribute settings.
            The keep_listening argument should be set to True if you want to start listening
            automatically after the packet is sent. The default setting is False.
+           owner names the sender in the airtime budget's per-task accounting.
+           A send_async() packet still on the air goes out first.
 
-           Returns: True if success or False if the send timed out.
+           Returns: True if success or False if the send timed out
+           or the airtime budget is spent.
         """
+        budget = self.airtime_budget
+        if budget is not None:
+            airtime = self.time_on_air(len(data) + 4)
+            if owner == 'ack':
+                budget.spend(airtime, owner)
+            elif not budget.try_spend(airtime, owner):
+                return False
+        if self.requested_mode == TX_MODE:
+            # a send_async() sleeping through its airtime: wait it out, and leave it the result
+            start = time.monotonic()
+            while not self.tx_done():
+                if (time.monotonic() - start) >= self.xmit_timeout:
+                    break
+            self._tx_finished = self.tx_done()
+            self._write_u8(_RH_RF95_REG_12_IRQ_FLAGS, 0xFF)
+        self._start_tx(data, destination, node, identifier, flags)
+        # Wait for tx done interrupt with explicit polling (not ideal but
+        # best that can be done right now without interrupts).
+        start = time.monotonic()
+        timed_out = False
+        while not timed_out and not self.tx_done():
+            if (time.monotonic() - start) >= self.xmit_timeout:
+                timed_out = True
+        return self._end_tx(keep_listening, timed_out)
+
+    async def send_async(
+        self,
+        data,
+        *,
+        keep_listening=False,
+        destination=None,
+        node=None,
+        identifier=None,
+        flags=None,
+        lease=None,
+        owner=None
+    ):
+        """Non-blocking version of send(): starts the transmission, then sleeps
+           the calling task until DIO0 (or the TxDone IRQ flag when dio0 isn't wired)
+           shows the packet is out, so the rest of the loop runs during the airtime.
+
+           lease is an optional tasko bus handle (e.g. cubesat.radio1_lease) to hold
+           while talking to the chip. It is released during the airtime.
+           When the airtime budget is spent the task sleeps until it refills
+           (see AirtimeBudget.reserve).
+
+           With listen_before_talk set, a CAD checks the channel first.
+
+           Returns: True if success or False if the send timed out
+           or the airtime budget refused it.
+        """
+        budget = self.airtime_budget
+        if budget is not None:
+            if not await budget.reserve(self.time_on_air(len(data) + 4), owner):
+                return False
+        if self.listen_before_talk:
+            for _ in range(self.lbt_attempts):
+                if await self.channel_clear(lease=lease):
+                    break
+                # a CAD only sees preambles: wait long enough for the longest
+                # packet behind the one we heard to end, and look again
+                self.lbt_deferrals += 1
+                await tasko.sleep(self.time_on_air(255) * (1 + random()))
+        if lease is None:
+            self._start_tx(data, destination, node, identifier, flags)
+        else:
+            async with lease:
+                self._start_tx(data, destination, node, identifier, flags)
+        self._tx_finished = None
+        timed_out = await self._await_irq(self._tx_irq, self.xmit_timeout, lease)
+        finished = self._tx_finished
+        if finished is not None:
+            # a blocking send() took the radio over once this packet was out (or timed out)
+            self._tx_finished = None
+            if not finished:
+                self.link_stats.tx_timeouts += 1
+            return finished
+        if lease is None:
+            return self._end_tx(keep_listening, timed_out)
+        async with lease:
+            return self._end_tx(keep_listening, timed_out)
+
+    def _tx_irq(self):
+        if self._tx_finished is not None:
+            return True
+        if self.dio0:
+            # DIO0 is mapped to TxDone by transmit(), no SPI needed. tx_done() keeps reading
+            # the IRQ register: its callers can't be sure of the mapping, we just set it.
+            return self.dio0.value
+        return self.tx_done()
+
+    async def _await_irq(self, done, timeout, lease):
+        # Sleep the task until done() or timeout (seconds). Returns True on timeout.
+        start = time.monotonic()
+        while True:
+            if self.dio0 or lease is None:
+                if done():
+                    return False
+            else:
+                async with lease:
+                    if done():
+                        return False
+            if (time.monotonic() - start) >= timeout:
+                return True
+            await tasko.sleep(self.tx_poll)
+
+    def _start_tx(self, data, destination, node, identifier, flags):
+        # Fill the FIFO with header + data and start transmitting.
         # Disable pylint warning to not use length as a check for zero.
         # This is a puzzling warning as the below code is clearly the most
         # efficient and proper way to ensure a precondition that the provided
@@ -770,6 +1477,10 @@ class RFM9x:
         # pylint: enable=len-as-condition
         self.idle()  # Stop receiving to clear FIFO and keep it clear.
         l+=4
+        stats = self.link_stats
+        stats.tx_packets += 1
+        stats.tx_bytes += l
+        stats.tx_time += self.time_on_air(l)
         # Fill the FIFO with a packet to send.
         self._write_u8(_RH_RF95_REG_0D_FIFO_ADDR_PTR, 0x00)  # FIFO starts at 0.
 
@@ -812,14 +1523,10 @@ class RFM9x:
         self._write_u8(_RH_RF95_REG_22_PAYLOAD_LENGTH, l)
         # Turn on transmit mode to send out the packet.
         self.transmit()
-        # Wait for tx done interrupt with explicit polling (not ideal but
-        # best that can be done right now without interrupts).
-        start = time.monotonic()
-        timed_out = False
-        while not timed_out and not self.tx_done():
-            if (time.monotonic() - start) >= self.xmit_timeout:
-                timed_out = True
 
+    def _end_tx(self, keep_listening, timed_out):
+        if timed_out:
+            self.link_stats.tx_timeouts += 1
         if hasattr(self,'txrx'): # RX
             self.txrx[0].value=False
             self.txrx[1].value=True
@@ -866,6 +1573,7 @@ class RFM9x:
             # pause before next retry -- random delay
             if not got_ack:
                 self.retry_counter+=1 # ADDED FOR PYCUBED
+                self.link_stats.ack_retries += 1
                 print('no uhf ack, sending again...')
                 # delay by random amount before next try
                 time.sleep(self.ack_wait + self.ack_wait * random())
@@ -873,6 +1581,72 @@ class RFM9x:
             # set retry flag in packet header
             self.flags |= _RH_FLAGS_RETRY
         self.flags = 0  # clear flags
+        if not got_ack:
+            self.link_stats.ack_failures += 1
+        return got_ack
+
+    async def send_with_ack_async(self, data, *, lease=None, owner=None):
+        """Non-blocking Reliable Datagram mode: like send_with_ack(), but the
+           airtime, the ACK window and the random backoff between retries are
+           all loop sleeps, so other tasks run in between. lease is passed on to
+           send_async() and receive_async(), owner to send_async().
+           Results are counted in self.ack_stats.
+        """
+        # keep background receivers from draining the ACK, from the first transmission on
+        self.rx_claims += 1
+        try:
+            return await self._send_with_ack_async(data, lease, owner)
+        finally:
+            self.rx_claims -= 1
+
+    async def _send_with_ack_async(self, data, lease, owner):
+        if self.ack_retries:
+            retries_remaining = self.ack_retries
+        else:
+            retries_remaining = 1
+        got_ack = False
+        stats = self.ack_stats
+        stats.sends += 1
+        self.retry_counter=0 # ADDED FOR PYCUBED
+        self.sequence_number = (self.sequence_number + 1) & 0xFF
+        while not got_ack and retries_remaining:
+            self.identifier = self.sequence_number
+            sent_at = time.monotonic()
+            timeouts = self.link_stats.tx_timeouts
+            if not await self.send_async(data, keep_listening=True, lease=lease, owner=owner):
+                if self.link_stats.tx_timeouts == timeouts:
+                    # the airtime budget refused it: a retry would be refused too
+                    stats.refused += 1
+                    break
+                # TX timed out: nothing went out, so there is no ACK to wait for
+            elif self.destination == _RH_BROADCAST_ADDRESS:
+                # Don't look for ACK from Broadcast message
+                stats.transmissions += 1
+                got_ack = True
+            else:
+                stats.transmissions += 1
+                # wait for a packet from our destination
+                ack_packet = await self.receive_async(timeout=self.ack_wait, with_header=True, lease=lease)
+                if ack_packet is not None:
+                    if ack_packet[3] & _RH_FLAGS_ACK:
+                        # check the ID
+                        if ack_packet[2] == self.identifier:
+                            got_ack = True
+                            stats._ack(time.monotonic() - sent_at)
+                            break
+            # pause before next retry -- random delay
+            if not got_ack:
+                self.retry_counter+=1 # ADDED FOR PYCUBED
+                stats.retries += 1
+                self.link_stats.ack_retries += 1
+                await tasko.sleep(self.ack_wait + self.ack_wait * random())
+            retries_remaining = retries_remaining - 1
+            # set retry flag in packet header
+            self.flags |= _RH_FLAGS_RETRY
+        self.flags = 0  # clear flags
+        if not got_ack:
+            stats.failed += 1
+            self.link_stats.ack_failures += 1
         return got_ack
 
     # pylint: disable=too-many-branches
@@ -892,6 +1666,21 @@ class RFM9x:
            The payload then begins at packet[4].
            If with_ack is True, send an ACK after receipt (Reliable Datagram mode)
         """
+        timed_out = self._wait_rx(timeout)
+        return self._end_rx(timed_out, keep_listening, with_header, with_ack, debug, view)
+
+    def receive_into(self, buf, *, keep_listening=True, with_ack=False, timeout=None, debug=False):
+        """Like receive(with_header=True), but the packet is read from the FIFO
+           straight into buf instead of the shared buffer, so nothing is allocated
+           and the packet stays put while the next one is received.
+           buf should hold 256 bytes; longer packets are truncated to len(buf).
+           Returns: the packet length (including the 4 byte header) or None.
+        """
+        timed_out = self._wait_rx(timeout)
+        return self._end_rx(timed_out, keep_listening, True, with_ack, debug, True, buf)
+
+    def _wait_rx(self, timeout):
+        # Returns True if no packet arrived within timeout (seconds, default receive_timeout)
         if hasattr(self,'txrx'): # RX
             self.txrx[0].value=False
             self.txrx[1].value=True
@@ -911,18 +1700,81 @@ class RFM9x:
             while not timed_out and not self.rx_done():
                 if (time.monotonic() - start) >= timeout:
                     timed_out = True
+        return timed_out
+
+    async def receive_async(
+        self, *, keep_listening=True, with_header=False, with_ack=False, timeout=None, debug=False, view=False,
+        lease=None):
+        """Non-blocking version of receive(): the task sleeps while waiting for
+           a packet. lease is an optional tasko bus handle to hold while talking
+           to the chip (see send_async). A retry of a packet already received is
+           ACKed again (see ack_duplicate_async) and the wait goes on."""
+        if timeout is None:
+            timeout = self.receive_timeout
+        self.rx_claims += 1
+        try:
+            return await self._receive_async(keep_listening, with_header, with_ack, timeout, debug, view, lease)
+        finally:
+            self.rx_claims -= 1
+
+    async def _receive_async(self, keep_listening, with_header, with_ack, timeout, debug, view, lease):
+        end = time.monotonic() + timeout
+        while True:
+            if lease is None:
+                self._start_rx()
+            else:
+                async with lease:
+                    self._start_rx()
+            timed_out = await self._await_irq(self.rx_done, end - time.monotonic(), lease)
+            if lease is None:
+                packet = self._end_rx(timed_out, keep_listening, with_header, with_ack, debug, view)
+            else:
+                async with lease:
+                    packet = self._end_rx(timed_out, keep_listening, with_header, with_ack, debug, view)
+            if packet is not None or self.unacked_duplicate is None:
+                return packet
+            await self.ack_duplicate_async(lease=lease)
+
+    async def ack_duplicate_async(self, *, lease=None):
+        """ACK the retry in unacked_duplicate again, and keep listening.
+           Returns True if an ACK went out."""
+        header = self.unacked_duplicate
+        if header is None:
+            return False
+        self.unacked_duplicate = None
+        # as in _end_rx: give the sender a chance to get back into RX
+        if self.ack_delay is not None:
+            await tasko.sleep(self.ack_delay)
+        return await self.send_async(b'!', keep_listening=True, destination=header[1], node=header[0],
+                                     identifier=header[2], flags=header[3] | _RH_FLAGS_ACK, lease=lease,
+                                     owner='ack')
+
+    def _start_rx(self):
+        if hasattr(self,'txrx'): # RX
+            self.txrx[0].value=False
+            self.txrx[1].value=True
+        self.listen()
+
+    def _end_rx(self, timed_out, keep_listening, with_header, with_ack, debug, view, into=None):
         # Payload ready is set, a packet is in the FIFO.
         packet = None
+        stats = self.link_stats
+        self.unacked_duplicate = None
         # save last RSSI reading
         self.last_rssi = self.rssi(raw=True)
+        if timed_out:
+            stats.rx_timeouts += 1
+        else:
+            snr = self._read_u8(_RH_RF95_REG_19_PKT_SNR_VALUE)
+            if snr > 127:
+                snr -= 256
+            self.last_snr = snr / 4
         # Enter idle mode to stop receiving other packets.
         self.idle()
         if not timed_out:
             if self.enable_crc and self.crc_error():
-                self.crc_error_count += 1
+                stats.crc_errors += 1
                 print('crc error')
-                if hasattr(self,'crc_errs'):
-                    self.crc_errs+=1
             else:
                 # Read the data from the FIFO.
                 # Read the length of the FIFO.
@@ -932,14 +1784,21 @@ class RFM9x:
                 if fifo_length > 0:  # read and clear the FIFO if anything in it
                     current_addr = self._read_u8(_RH_RF95_REG_10_FIFO_RX_CURRENT_ADDR)
                     self._write_u8(_RH_RF95_REG_0D_FIFO_ADDR_PTR, current_addr)
-                    # packet = bytearray(fifo_length)
-                    packet = self.buffview[:fifo_length]
-                    # Read the packet.
-                    self._read_into(_RH_RF95_REG_00_FIFO, packet)
+                    if into is None:
+                        # packet = bytearray(fifo_length)
+                        packet = self.buffview[:fifo_length]
+                        # Read the packet.
+                        self._read_into(_RH_RF95_REG_00_FIFO, packet)
+                    else:
+                        # receive_into: no slicing, the caller's buffer is the packet
+                        fifo_length = min(fifo_length, len(into))
+                        packet = into
+                        self._read_into(_RH_RF95_REG_00_FIFO, packet, length=fifo_length)
                 # Clear interrupt.
                 self._write_u8(_RH_RF95_REG_12_IRQ_FLAGS, 0xFF)
                 if fifo_length < 5:
                     print('missing pckt header')
+                    stats.short_packets += 1
                     packet = None
                 else:
                     if (
@@ -947,6 +1806,7 @@ class RFM9x:
                         and packet[0] != _RH_BROADCAST_ADDRESS
                         and packet[0] != self.node
                     ):
+                        stats.header_rejects += 1
                         packet = None
                     # send ACK unless this was an ACK or a broadcast
                     elif (
@@ -965,18 +1825,23 @@ class RFM9x:
                             node=packet[0],
                             identifier=packet[2],
                             flags=(packet[3] | _RH_FLAGS_ACK),
+                            owner='ack',
                         )
                         if debug: print('Sent Ack to {}'.format(packet[1]))
                         if debug: print('\t{}'.format(packet))
-
-                        # # reject Retries if we have seen this idetifier from this source before
-                        # if (self.seen_ids[packet[1]] == packet[2]) and (
-                        #     packet[3] & _RH_FLAGS_RETRY
-                        # ):
-                        #     print('duplicate identifier from this source. rejecting...')
-                        #     packet = None
-                        # else:  # save the packet identifier for this source
-                        self.seen_ids[packet[1]] = packet[2]
+                    # reject retries of packets we already have (after ACKing them again)
+                    if (
+                        packet is not None
+                        and self.duplicates is not None
+                        and (packet[3] & _RH_FLAGS_ACK) == 0
+                        and not self.duplicates.check(packet[1], packet[2], packet[3])
+                    ):
+                        if debug: print('duplicate {} from {}'.format(packet[2], packet[1]))
+                        if not with_ack and packet[0] != _RH_BROADCAST_ADDRESS:
+                            self.unacked_duplicate = bytes(packet[:4])
+                        packet = None
+                    if packet is not None:
+                        stats._rx(fifo_length, self.last_rssi - 137, snr)
                     if (
                         not with_header and packet is not None
                     ):  # skip the header if not wanted
@@ -994,70 +1859,123 @@ class RFM9x:
             self.idle()
         # Clear interrupt.
         self._write_u8(_RH_RF95_REG_12_IRQ_FLAGS, 0xFF)
+        if into is not None:
+            return None if packet is None else fifo_length
         if view:
             return packet
         elif packet is not None:
             return bytes(packet)
         return packet
 
-    def receive_all(self, only_for_me=True,debug=False):
-        # msg=[]
-        l=0
-        fifo_length=0
+    def send_burst(self, data, *, keep_listening=False, destination=None, node=None, identifier=None, flags=0):
+        """Send data (at most 251 bytes) with the LENGTH flag and the packet length
+           in front of it, so a receiver can take packets that arrive back to back
+           apart with receive_all(). Other receive calls return the length byte as
+           the first byte of the payload."""
+        n = len(data) + 1
+        assert n <= 252
+        if self._burst_tx is None:
+            self._burst_tx = bytearray(252)
+        frame = self._burst_tx
+        frame[0] = n + 4
+        frame[1:n] = data
+        return self.send(memoryview(frame)[:n], keep_listening=keep_listening, destination=destination,
+                         node=node, identifier=identifier, flags=flags | _RH_FLAGS_LENGTH)
+
+    def listen_burst(self):
+        """Start listening for a burst of packets to drain with receive_all().
+           The radio stays in RX and the chip writes each packet right after the
+           previous one in its 256 byte FIFO."""
         self.idle()
-        if self.enable_crc and self.crc_error():
-            self.crc_error_count += 1
-            print('crc error')
-            if hasattr(self,'crc_errs'):
-                self.crc_errs+=1
-        else:
-            fifo_length = self._read_u8(_RH_RF95_REG_13_RX_NB_BYTES)
-
-        if fifo_length > 0:
-            current_addr = self._read_u8(_RH_RF95_REG_10_FIFO_RX_CURRENT_ADDR)
-            self._write_u8(_RH_RF95_REG_0D_FIFO_ADDR_PTR, _RH_RF95_REG_00_FIFO)
-            self._read_into(_RH_RF95_REG_00_FIFO,_bigbuffer)
-            for i in range(4):
-                self._write_from(_RH_RF95_REG_00_FIFO, bytes(64))
-            self._write_u8(_RH_RF95_REG_0D_FIFO_ADDR_PTR,_RH_RF95_REG_00_FIFO)
-            self.listen()
-            # Clear interrupt.
-            self._write_u8(_RH_RF95_REG_12_IRQ_FLAGS, 0xFF)
-            packetindex=[]
-            i=0
-            while i < 253: # 256-4 = 252
-                # check first
-                if self.buffview[i] in self.valid_ids:
-                    # check second
-                    if self.buffview[i+1] in self.valid_ids:
-                        # make sure not the same
-                        if self.buffview[i]!=self.buffview[i+1]:
-                            # append first
-                            packetindex.append(i)
-                            i=i+4
-                            l+=1
-                            continue
-                i+=1
-            for i in range(l-1):
-                # assume packets are back-to-back (read till index of next one)
-                # if (packetindex[i+1]-packetindex[i]) <= 10:
-                    # msg.append(bytes(self.buffview[packetindex[i]:packetindex[i+1]]))
-                yield self.buffview[packetindex[i]:packetindex[i+1]]
-            # last packet so read until the end of our fifo_length
-            if packetindex:
-                # if (packetindex[-1]-(current_addr+fifo_length)) <= 10:
-                    # print('{},{},{}'.format(packetindex[-1],current_addr,fifo_length))
-                    # msg.append(bytes(self.buffview[packetindex[-1]:current_addr+fifo_length]))
-                yield self.buffview[packetindex[-1]:current_addr+fifo_length]
-        else:
-            self.listen()
-            # Clear interrupt.
-            self._write_u8(_RH_RF95_REG_12_IRQ_FLAGS, 0xFF)
+        self.listen()
+        self._rx_tail = self._read_u8(_RH_RF95_REG_0F_FIFO_RX_BASE_ADDR)
 
-        # if only_for_me:
-        #     return [i for i in msg if msg[0] is self.node]
-        # else:
-        #     return msg
+    def receive_all(self, only_for_me=True,debug=False):
+        """Drain every packet received since listen_burst() (or the last call) and
+           yield each one, RadioHead header included, as a memoryview into a buffer
+           the radio reuses on the next call. The radio keeps listening.
+
+           The chip only records where the latest packet starts and how long it is.
+           The packets before it are walked with the length byte of the LENGTH flag
+           (see send_burst()). A packet without one ends the walk: the bytes up to
+           the latest packet are dropped and counted in burst_errors rather than
+           guessed at. Call again before 256 bytes pile up, or the chip overwrites
+           the oldest. The CRC flag, RSSI and SNR only describe the latest packet.
+           Retries of packets already received are dropped: ACK the last one again
+           with ack_duplicate_async().
+        """
+        stats = self.link_stats
+        self.unacked_duplicate = None
+        irq = self._read_u8(_RH_RF95_REG_12_IRQ_FLAGS)
+        if not irq & 0x40:
+            return
+        # clear RxDone before reading the pointers: a packet landing meanwhile raises it again
+        self._write_u8(_RH_RF95_REG_12_IRQ_FLAGS, 0xFF)
+        current = self._read_u8(_RH_RF95_REG_10_FIFO_RX_CURRENT_ADDR)
+        last_length = self._read_u8(_RH_RF95_REG_13_RX_NB_BYTES)
+        self.last_rssi = self.rssi(raw=True)
+        snr = self._read_u8(_RH_RF95_REG_19_PKT_SNR_VALUE)
+        if snr > 127:
+            snr -= 256
+        self.last_snr = snr / 4
+        tail = self._rx_tail
+        end = (current + last_length) & 0xFF
+        self._rx_tail = end
+        if tail is None:
+            # not listening since listen_burst(): only the latest packet is known
+            tail = current
+        elif (end - tail) & 0xFF < last_length:
+            # the chip wrapped past our tail
+            self.burst_errors += 1
+            tail = current
+        length = (end - tail) & 0xFF
+        # allocated on first use: only burst receivers need it
+        if self._burst_rx is None:
+            self._burst_rx = bytearray(256)
+        buf = self._burst_rx
+        if length:
+            self._write_u8(_RH_RF95_REG_0D_FIFO_ADDR_PTR, tail)
+            self._read_into(_RH_RF95_REG_00_FIFO, buf, length=length)
+        view = memoryview(buf)
+        last = length - last_length
+        i = 0
+        while i < last:
+            n = buf[i + 4] if last - i >= 5 and buf[i + 3] & _RH_FLAGS_LENGTH else 0
+            if n < 5 or n > last - i:
+                if debug: print('burst framing lost at {} of {}'.format(i, last))
+                self.burst_errors += 1
+                break
+            packet = self._burst_accept(view, i, n, only_for_me)
+            if packet is not None:
+                stats.rx_packets += 1
+                stats.rx_bytes += n
+                yield packet
+            i += n
+        if self.enable_crc and irq & 0x20:
+            stats.crc_errors += 1
+            if debug: print('crc error')
+            return
+        if last_length < 5:
+            stats.short_packets += 1
+            return
+        packet = self._burst_accept(view, last, last_length, only_for_me)
+        if packet is not None:
+            stats._rx(last_length, self.last_rssi - 137, snr)
+            yield packet
+
+    def _burst_accept(self, view, start, length, only_for_me):
+        # the packet at view[start:start+length], or None if it isn't for us or is a duplicate
+        dest, source, identifier, flags = view[start], view[start + 1], view[start + 2], view[start + 3]
+        if only_for_me and self.node != _RH_BROADCAST_ADDRESS and dest != _RH_BROADCAST_ADDRESS \
+                and dest != self.node:
+            self.link_stats.header_rejects += 1
+            return None
+        if self.duplicates is not None and not flags & _RH_FLAGS_ACK \
+                and not self.duplicates.check(source, identifier, flags):
+            if dest != _RH_BROADCAST_ADDRESS and (dest == self.node or self.node == _RH_BROADCAST_ADDRESS):
+                self.unacked_duplicate = bytes(view[start:start + 4])
+            return None
+        return view[start:start + length]
 
     def send_fast(self,data,l):
         self.idle()
@@ -0,0 +1,380 @@
+"""
+Background receive service for a pycubed_rfm9x radio.
+
+One long-lived task owns reception: it keeps the radio listening whenever it isn't
+transmitting, drains each packet as soon as DIO0 shows RxDone, and queues it with its
+link metadata. Command handling and file transfers consume from the queue instead of
+holding the radio in RX themselves.
+
+    rx = RadioService(cubesat.radio1, lease=cubesat.radio1_lease)
+    # from a frequent task
+    await rx.poll()
+    # from a consumer
+    packet = rx.queue.get()
+    if packet is not None:
+        handle(packet.data)
+        rx.queue.release(packet)
+
+Packets live in a PacketPool of buffers allocated once when the queue is created, and
+RFM9x.receive_into() reads each one straight from the FIFO into its buffer. A consumer
+holds its packet until it calls release(), while newer packets keep arriving in other
+buffers, so steady state reception doesn't allocate.
+
+Continuous RX is the largest power draw of an idle radio. sniff(interval) duty cycles
+it instead: the radio sleeps and wakes every interval seconds for a channel activity
+detection (CAD) of a couple of symbols, and only enters RX when the CAD hears a
+preamble. Senders must use a preamble that spans a whole interval (see
+RFM9x.wake_preamble()). After any transmission the radio stays in RX for a window,
+for the reply.
+"""
+import time
+import tasko
+
+_STANDBY_MODE = 1
+_TX_MODE = 3
+
+# sniff states
+_SLEEPING = 0
+_CAD = 1
+_LISTENING = 2
+
+
+class RxPacket:
+    """A received packet (RadioHead header included) and its link metadata"""
+    def __init__(self, size=256):
+        self.buffer = bytearray(size)
+        self.length = 0
+        self.rssi = 0
+        """dBm"""
+        self.snr = 0.0
+        """dB"""
+        self.timestamp = 0.0
+        """time.monotonic() when the packet was drained"""
+        self.in_use = False
+
+    @property
+    def data(self):
+        """the packet payload after the 4 byte header"""
+        return memoryview(self.buffer)[4:self.length]
+
+    @property
+    def source(self):
+        return self.buffer[1]
+
+    @property
+    def destination(self):
+        return self.buffer[0]
+
+    @property
+    def identifier(self):
+        return self.buffer[2]
+
+    @property
+    def flags(self):
+        return self.buffer[3]
+
+
+class PacketPool:
+    """
+    A fixed set of RxPackets. acquire() hands one out, release() takes it back.
+    Nothing is allocated after construction.
+    """
+    def __init__(self, count=8, size=256):
+        self.count = count
+        self._free = [RxPacket(size) for _ in range(count)]
+
+    @property
+    def available(self):
+        return len(self._free)
+
+    def acquire(self):
+        """a free packet, or None if they are all in use"""
+        if not self._free:
+            return None
+        packet = self._free.pop()
+        packet.in_use = True
+        return packet
+
+    def release(self, packet):
+        if not packet.in_use:
+            raise ValueError('packet released twice')
+        packet.in_use = False
+        self._free.append(packet)
+
+
+class PacketQueue:
+    """
+    Bounded FIFO of received packets backed by a PacketPool.
+
+    The producer takes a free packet with acquire() and queues it with put(). Consumers
+    get() the oldest one and must release() it when done. When the pool is empty new
+    packets are dropped and counted rather than allocated.
+    """
+    def __init__(self, count=8, size=256, pool=None):
+        self.pool = PacketPool(count, size) if pool is None else pool
+        self._ready = [None] * count
+        self._head = 0
+        self._len = 0
+        self.queued = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def capacity(self):
+        """how many packets the queue holds"""
+        return len(self._ready)
+
+    def full(self):
+        return self._len >= len(self._ready)
+
+    def acquire(self):
+        """a free packet to fill, or None (counted as dropped) if they are all in use"""
+        packet = self.pool.acquire()
+        if packet is None:
+            self.dropped += 1
+        return packet
+
+    def put(self, packet):
+        capacity = len(self._ready)
+        self._ready[(self._head + self._len) % capacity] = packet
+        self._len += 1
+        self.queued += 1
+        if self._len > self.high_water:
+            self.high_water = self._len
+
+    def get(self):
+        """the oldest queued packet, or None"""
+        if not self._len:
+            return None
+        packet = self._ready[self._head]
+        self._ready[self._head] = None
+        self._head = (self._head + 1) % len(self._ready)
+        self._len -= 1
+        return packet
+
+    def release(self, packet):
+        """hand a packet from get() (or an unused one from acquire()) back to the pool"""
+        self.pool.release(packet)
+
+    async def get_async(self, timeout, poll=0.1):
+        """wait up to timeout seconds for a packet"""
+        end = time.monotonic() + timeout
+        while True:
+            packet = self.get()
+            if packet is not None or time.monotonic() >= end:
+                return packet
+            await tasko.sleep(poll)
+
+
+class SniffStats:
+    """Duty cycle counters for RadioService.sniff()"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self, now=None):
+        self.started = time.monotonic() if now is None else now
+        self.cads = 0
+        self.detections = 0
+        self.false_wakes = 0
+        """CAD wake ups that ended without a packet"""
+        self.rx_time = 0.0
+        """seconds in RX, finished windows only"""
+
+    def rx_fraction(self, now=None):
+        """share of the time since reset() spent in RX"""
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self.started
+        return self.rx_time / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return "{{SniffStats {} CADs, {} detections ({} false), {:.1f}s in RX ({:.1%})}}".format(
+            self.cads, self.detections, self.false_wakes, self.rx_time, self.rx_fraction())
+
+    __str__ = __repr__
+
+
+class RadioService:
+    """
+    Keeps a radio in RX and drains it into a PacketQueue. Call poll() from a frequent task.
+
+    :param radio: pycubed_rfm9x.RFM9x, ideally with dio0 wired so an idle poll costs no SPI traffic
+    :param lease: optional tasko bus handle held while talking to the radio
+    :param queue: PacketQueue to fill, a new 8 packet queue by default
+    """
+    def __init__(self, radio, lease=None, queue=None):
+        self.radio = radio
+        self.lease = lease
+        self.queue = PacketQueue() if queue is None else queue
+        self.enabled = True
+        """Set False to leave the radio alone, e.g. in low power mode"""
+        self.ack = False
+        """Send RadioHead ACKs for packets addressed to us"""
+        self.monitor = None
+        """Optional function called with every accepted RxPacket, e.g. adr.RateController.observe"""
+        self.channels = {}
+        self.received = 0
+        self.rejected = 0
+        self.sniff_interval = None
+        """seconds between CADs in sniff mode, None for continuous RX (see sniff())"""
+        self.sniff_window = 1.0
+        self.sniff_stats = SniffStats()
+        self._state = _SLEEPING
+        self._next = 0.0
+        self._until = 0.0
+        self._since = 0.0
+        self._woken = False
+        self._tx_seen = 0
+
+    def sniff(self, interval, window=1.0):
+        """
+        Duty cycle the receiver: a CAD every interval seconds, and RX only for window
+        seconds after a CAD hears a preamble, a packet arrives or we transmit. window
+        should cover the wait for a reply (e.g. RFM9x.ack_wait). interval=None goes back
+        to continuous RX.
+        """
+        now = time.monotonic()
+        self.sniff_interval = interval
+        self.sniff_window = window
+        self.sniff_stats.reset(now)
+        self._state = _SLEEPING
+        self._next = now
+        self._tx_seen = self.radio.link_stats.tx_packets
+
+    def channel(self, flag, count=4):
+        """
+        A PacketQueue for packets whose RadioHead flags have `flag` (1-15) in the low nibble,
+        e.g. file transfer replies. Channel queues share the main queue's packet pool.
+        """
+        queue = self.channels.get(flag)
+        if queue is None:
+            queue = self.channels[flag] = PacketQueue(count, pool=self.queue.pool)
+        return queue
+
+    async def poll(self):
+        """Drain a waiting packet and make sure the radio is listening"""
+        if not self.enabled:
+            return
+        if self.lease is None:
+            self._poll()
+        else:
+            async with self.lease:
+                self._poll()
+        radio = self.radio
+        if radio.unacked_duplicate is not None and not radio.rx_claims:
+            # a retry of a packet we queued: the sender missed the first ACK
+            await radio.ack_duplicate_async(lease=self.lease)
+
+    def _poll(self):
+        radio = self.radio
+        if radio.rx_claims:
+            # a receive_async() or an ACK wait owns the receiver, and the packet is theirs
+            return
+        if self.sniff_interval is not None:
+            self._sniff(time.monotonic())
+            return
+        # dio0_mapping comes from the register shadow and requested_mode is a plain attribute,
+        # so an idle poll costs one DIO0 pin read and no SPI traffic
+        if radio.dio0_mapping != 0:
+            # DIO0 means TxDone (or CadDone): a send is in progress until its sender ends it.
+            # After that, pick up where a send without keep_listening left off.
+            # (sleep is left alone: that's a deliberate power saving choice)
+            if radio.requested_mode == _STANDBY_MODE:
+                radio.listen()
+            return
+        if radio.rx_done():
+            self._drain()
+        elif radio.requested_mode == _STANDBY_MODE:
+            radio.listen()
+
+    def _sniff(self, now):
+        radio = self.radio
+        stats = self.sniff_stats
+        if radio.requested_mode == _TX_MODE:
+            # a send is in progress, on the air or done, until its sender ends it
+            return
+        sent = radio.link_stats.tx_packets
+        if sent != self._tx_seen:
+            # somebody transmitted: listen for the reply
+            self._tx_seen = sent
+            self._listen(now, False)
+            return
+        state = self._state
+        if state == _CAD:
+            if not radio.cad_done():
+                if now - self._since > 0.5:
+                    # never finished: the radio was busy with something else
+                    self._doze(now)
+                return
+            if radio.cad_detected():
+                stats.detections += 1
+                self._listen(now, True)
+            else:
+                self._doze(now)
+        elif state == _LISTENING:
+            if radio.rx_done():
+                self._drain()
+                self._woken = False
+                self._until = now + self.sniff_window
+                self._tx_seen = radio.link_stats.tx_packets  # our own ACK
+            elif now >= self._until:
+                if radio.signal_detected():
+                    # a packet (or a long wake up preamble) is still coming in
+                    self._until = now + self.sniff_window
+                    return
+                if self._woken:
+                    stats.false_wakes += 1
+                self._doze(now)
+            elif radio.requested_mode == _STANDBY_MODE:
+                radio.listen()
+        elif now >= self._next:
+            radio.cad()
+            self._state = _CAD
+            self._since = now
+            stats.cads += 1
+
+    def _listen(self, now, woken):
+        if self._state != _LISTENING:
+            self._since = now
+        self._state = _LISTENING
+        self._woken = woken
+        self._until = now + self.sniff_window
+        self.radio.listen()
+
+    def _doze(self, now):
+        if self._state == _LISTENING:
+            self.sniff_stats.rx_time += now - self._since
+        self._state = _SLEEPING
+        self._next = now + self.sniff_interval
+        self.radio.sleep()
+
+    def _drain(self):
+        radio = self.radio
+        packet = self.queue.acquire()
+        if packet is None:
+            # no free buffer: empty the FIFO anyway so the radio can take the next packet
+            radio.receive(keep_listening=True, with_header=True, with_ack=self.ack, timeout=0, view=True)
+            return
+        length = radio.receive_into(packet.buffer, keep_listening=True, with_ack=self.ack, timeout=0)
+        if length is None:
+            # crc error, not for us, or missing header
+            self.queue.release(packet)
+            self.rejected += 1
+            return
+        self.received += 1
+        packet.length = length
+        packet.rssi = radio.last_rssi - 137
+        packet.snr = radio.last_snr
+        packet.timestamp = time.monotonic()
+        if self.monitor is not None:
+            self.monitor(packet)
+        queue = self.channels.get(packet.flags & 0x0F, self.queue)
+        if queue.full():
+            # channel backlog is full
+            queue.dropped += 1
+            queue.release(packet)
+            return
+        queue.put(packet)
@@ -33,3 +33,6 @@ sleep = get_loop().sleep
 suspend = get_loop().suspend
 
 run = get_loop().run
+
+from .managed_spi import ManagedSpi
+from .managed_i2c import ManagedI2C
@@ -0,0 +1,91 @@
+"""
+Save and restore the phase of named ScheduledTasks across resets.
+
+A checkpoint is a small fixed-size binary record that can live in NVM or in a file on the SD card:
+
+    [magic] [count] count * ([name id (2)] [ms since period start (4)] [flags (1)]) [checksum]
+
+On boot, pass the same {name: ScheduledTask} dict to restore() before the loop runs and each task resumes
+part way through its period instead of starting over. Repeated resets therefore can't starve slow tasks.
+"""
+import struct
+
+_MAGIC = 0x7A
+_ENTRY = '<HIB'
+_ENTRY_SIZE = 7
+_FLAG_OVERRUN = 0x01
+
+MAX_TASKS = 16
+RECORD_SIZE = 2 + MAX_TASKS * _ENTRY_SIZE + 1
+
+
+def name_id(name):
+    """16-bit FNV-1a hash of a task name"""
+    h = 0x811C
+    for c in name:
+        h = ((h ^ ord(c)) * 0x0193) & 0xFFFF
+    return h
+
+
+def _checksum(record, end):
+    s = 0
+    for i in range(end):
+        s = (s + record[i]) & 0xFF
+    return s ^ 0xFF
+
+
+def save(named_tasks, record=None):
+    """
+    Pack the phase of each task into a checkpoint record.
+
+    :param named_tasks: dict of {name: ScheduledTask}
+    :param record: optional bytearray(RECORD_SIZE) to reuse
+    :returns the record
+    """
+    if record is None:
+        record = bytearray(RECORD_SIZE)
+    count = 0
+    for name in named_tasks:
+        if count >= MAX_TASKS:
+            break
+        elapsed_nanos, overrun = named_tasks[name].phase()
+        elapsed_ms = min(max(int(elapsed_nanos // 1000000), 0), 0xFFFFFFFF)
+        struct.pack_into(_ENTRY, record, 2 + count * _ENTRY_SIZE,
+                         name_id(name), elapsed_ms, _FLAG_OVERRUN if overrun else 0)
+        count += 1
+    record[0] = _MAGIC
+    record[1] = count
+    end = 2 + count * _ENTRY_SIZE
+    for i in range(end, RECORD_SIZE):
+        record[i] = 0
+    record[RECORD_SIZE - 1] = _checksum(record, RECORD_SIZE - 1)
+    return record
+
+
+def restore(named_tasks, record):
+    """
+    Resume each named task from a checkpoint record. Call before the loop runs.
+
+    Unknown names, empty and corrupt records are ignored.
+
+    :param named_tasks: dict of {name: ScheduledTask}
+    :param record: the bytes written by save()
+    :returns the number of tasks resumed
+    """
+    if record is None or len(record) < RECORD_SIZE or record[0] != _MAGIC:
+        return 0
+    if record[RECORD_SIZE - 1] != _checksum(record, RECORD_SIZE - 1):
+        return 0
+    count = min(record[1], MAX_TASKS)
+    by_id = {}
+    for name in named_tasks:
+        by_id[name_id(name)] = named_tasks[name]
+    resumed = 0
+    for i in range(count):
+        nid, elapsed_ms, flags = struct.unpack_from(_ENTRY, record, 2 + i * _ENTRY_SIZE)
+        task = by_id.get(nid)
+        if task is None:
+            continue
+        task.resume_phase(elapsed_ms * 1000000, overrun=bool(flags & _FLAG_OVERRUN))
+        resumed += 1
+    return resumed
@@ -78,6 +78,20 @@ class ScheduledTask:
             # print("Added task to loop._task")
             self._loop.add_task(self._run_at_fixed_rate(), self._priority)
 
+    def phase(self):
+        ### Nanoseconds since the start of the current period, and whether the task is falling behind ###
+        if self._target_run_nanos is None:
+            return 0, self._overrun
+        return _monotonic_ns() - self._target_run_nanos, self._overrun
+
+    def resume_phase(self, elapsed_nanos, overrun=False):
+        ### Pick the schedule back up part way through a period (e.g. after a reset) ###
+        # Only affects the next time the task is started; an overrun task runs right away.
+        if overrun:
+            elapsed_nanos = self._nanoseconds_per_invocation
+        elapsed_nanos = min(max(elapsed_nanos, 0), self._nanoseconds_per_invocation)
+        self._next_run_nanos = _monotonic_ns() + int(self._nanoseconds_per_invocation - elapsed_nanos)
+
     def __init__(
         self, loop, hz, forward_async_fn, priority, forward_args, forward_kwargs
     ):
@@ -90,11 +104,21 @@ class ScheduledTask:
         self._running = False
         self._scheduled_to_run = False
         self._priority = priority
+        # Phase bookkeeping so a schedule can be checkpointed and resumed
+        self._next_run_nanos = None
+        self._target_run_nanos = None
+        self._overrun = False
 
     async def _run_at_fixed_rate(self):
         self._scheduled_to_run = True
         try:
             target_run_nanos = _monotonic_ns()
+            if self._next_run_nanos is not None:
+                # Deferred first run (schedule_later or a restored phase). Only used once.
+                target_run_nanos, self._next_run_nanos = self._next_run_nanos, None
+                self._target_run_nanos = target_run_nanos - self._nanoseconds_per_invocation
+                if target_run_nanos > _monotonic_ns():
+                    await self._loop._sleep_until_nanos(target_run_nanos)
             while True:
                 if self._stop:
                     return  # Check before running
@@ -104,6 +128,7 @@ class ScheduledTask:
                 )
                 self._loop._debug("  iteration ", iteration)
 
+                self._target_run_nanos = target_run_nanos
                 self._running = True
                 try:
                     await iteration
@@ -121,8 +146,10 @@ class ScheduledTask:
                 now_nanos = _monotonic_ns()
                 if now_nanos <= target_run_nanos:
                     # print("Going to put to sleep")
+                    self._overrun = False
                     await self._loop._sleep_until_nanos(target_run_nanos)
                 else:
+                    self._overrun = True
                     target_run_nanos = now_nanos
                     # Allow other tasks a chance to run if this task is too slow.
                     await _yield_once()
@@ -198,7 +225,7 @@ class Loop:
         # Added a priority parameter
         self.add_task(_run_later(), priority)
 
-    def suspend(self):
+    def suspend(self, resume_nanos=None):
         """
         For making library functions that suspend and then resume later on some condition
         E.g., a scope manager for SPI
@@ -206,14 +233,25 @@ class Loop:
         To use this you will stash the resumer somewhere to call from another coroutine, AND
         you will `await suspender` to pause this stack at the spot you choose.
 
+        :param resume_nanos: Optional time.monotonic_ns at which the task resumes on its own if nobody
+                             has called the resumer yet. Calling the resumer after that is a no-op.
         :returns (async_suspender, resumer)
         """
         assert (
             self._current is not None
         ), "You can only suspend the current task if you are running the event loop."
         suspended = self._current
+        sleeper = None
+        if resume_nanos is not None:
+            sleeper = Sleeper(resume_nanos, suspended)
+            self._sleeping.append(sleeper)
 
         def resume():
+            if sleeper is not None:
+                # Already woke up (or is about to this step) on its own
+                if sleeper not in self._sleeping or sleeper in self._ready:
+                    return
+                self._sleeping.remove(sleeper)
             self._tasks.append(suspended)
 
         self._current = None
@@ -251,17 +289,11 @@ class Loop:
 
         See schedule api for parameters.
         """
-        ran_once = False
-
-        async def call_later():
-            nonlocal ran_once
-            if ran_once:
-                await coroutine_function(*args, **kwargs)
-            else:
-                await _yield_once()
-                ran_once = True
-
-        return self.schedule(hz, call_later, priority)
+        assert coroutine_function is not None, "coroutine function must not be none"
+        task = ScheduledTask(self, hz, coroutine_function, priority, args, kwargs)
+        task.resume_phase(0)
+        task.start()
+        return task
 
     def run(self):
         """
@@ -0,0 +1,88 @@
+from .managed_resource import ManagedResource
+import tasko
+
+class ManagedI2C:
+    def __init__(self, i2c_bus, loop=tasko.get_loop()):
+        """
+        Vends access to an I2C bus via per-device leases.
+        """
+        self._i2c = i2c_bus
+        self._resource = ManagedResource(i2c_bus, on_acquire=self._acquire_i2c, on_release=self._release_i2c, loop=loop)
+        self.devices = {}
+
+    def _acquire_i2c(self, address):
+        # Synchronous drivers (adafruit_bus_device.I2CDevice) lock the bus too, but never across an await,
+        # so this only spins if someone left the bus locked.
+        while not self._i2c.try_lock():
+            pass
+
+    def _release_i2c(self, address):
+        self._i2c.unlock()
+
+    def device(self, address):
+        """
+        pass in the 7 bit address of a device on the bus.
+
+        Store 1 handle for each device you want to manage with a shared I2C, e.g. the IMU, power monitor
+        and charger on the PyCubed i2c1 bus. A slow transaction with one device then only holds up the
+        tasks waiting on that bus, and they wait without blocking the rest of the loop.
+
+        You get:
+          * non-blocking, awaitable access to an I2C device
+          * transaction counters and time spent waiting on the bus for each device
+        """
+        if address not in self.devices:
+            self.devices[address] = ManagedI2CDevice(self._resource.handle(address=address), address)
+        return self.devices[address]
+
+
+class ManagedI2CDevice:
+    """
+    Awaitable version of the adafruit_bus_device.I2CDevice transactions.
+
+    Each transaction waits its turn for the bus, then runs without yielding, so buffers
+    filled here can be parsed as soon as the await returns.
+    """
+    def __init__(self, handle, address):
+        self.handle = handle
+        self.address = address
+        self.transactions = 0
+        self._register = bytearray(1)
+
+    @property
+    def stats(self):
+        """tasko.managed_resource.HandleStats: wait time, hold time and queue depth for this device"""
+        return self.handle.stats
+
+    async def readinto(self, buf, *, start=0, end=None):
+        if end is None:
+            end = len(buf)
+        async with self.handle as i2c:
+            i2c.readfrom_into(self.address, buf, start=start, end=end)
+        self.transactions += 1
+
+    async def write(self, buf, *, start=0, end=None):
+        if end is None:
+            end = len(buf)
+        async with self.handle as i2c:
+            i2c.writeto(self.address, buf, start=start, end=end)
+        self.transactions += 1
+
+    async def write_then_readinto(self, out_buffer, in_buffer, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        if out_end is None:
+            out_end = len(out_buffer)
+        if in_end is None:
+            in_end = len(in_buffer)
+        async with self.handle as i2c:
+            i2c.writeto_then_readfrom(self.address, out_buffer, in_buffer,
+                out_start=out_start, out_end=out_end, in_start=in_start, in_end=in_end)
+        self.transactions += 1
+
+    async def read_register_into(self, register, buf, *, start=0, end=None):
+        """Write a register address, then read from it. Safe to share buf with synchronous driver calls."""
+        if end is None:
+            end = len(buf)
+        async with self.handle as i2c:
+            self._register[0] = register & 0xFF
+            i2c.writeto_then_readfrom(self.address, self._register, buf, in_start=start, in_end=end)
+        self.transactions += 1
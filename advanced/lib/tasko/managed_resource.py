@@ -1,12 +1,82 @@
 import tasko
 
 
+class ResourceTimeoutException(Exception):
+    pass
+
+
+class _Waiter:
+    # One queued request for the resource. Timed out waiters are left in their queue and skipped on release.
+    def __init__(self, priority, resume_fn):
+        self.priority = priority
+        self.resume_fn = resume_fn
+        self.granted = False
+        self.cancelled = False
+
+
+class _Ring:
+    """
+    FIFO ring buffer with O(1) append and popleft. Doubles its storage when full.
+    """
+    def __init__(self, capacity=4):
+        self._items = [None] * capacity
+        self._head = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, item):
+        capacity = len(self._items)
+        if self._len == capacity:
+            self._items = [self._items[(self._head + i) % capacity] for i in range(capacity)] + [None] * capacity
+            self._head = 0
+            capacity *= 2
+        self._items[(self._head + self._len) % capacity] = item
+        self._len += 1
+
+    def __getitem__(self, i):
+        return self._items[(self._head + i) % len(self._items)]
+
+    def popleft(self):
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % len(self._items)
+        self._len -= 1
+        return item
+
+
+class HandleStats:
+    """
+    Bus sharing measurements for one handle. Times are in nanoseconds.
+    """
+    def __init__(self):
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.wait_nanos = 0
+        self.max_wait_nanos = 0
+        self.hold_nanos = 0
+        self.max_hold_nanos = 0
+        self.max_queue_depth = 0
+
+    def __repr__(self):
+        return "{{HandleStats acquisitions: {}, timeouts: {}, wait: {}/{}ns, hold: {}/{}ns, max depth: {}}}".format(
+            self.acquisitions, self.timeouts, self.wait_nanos, self.max_wait_nanos,
+            self.hold_nanos, self.max_hold_nanos, self.max_queue_depth
+        )
+
+    __str__ = __repr__
+
+
 class ManagedResource:
     """
     Manages a singleton resource with your functions that initialize a resource and clean it up between uses.
 
-    This class vends access to `resource` via a fair queue.  Intended use is with something like a busio.SPI
-    with on_acquire setting a chip select pin and on_release resetting that pin.
+    This class vends access to `resource` via a priority queue (FIFO within a priority).  Intended use is with
+    something like a busio.SPI with on_acquire setting a chip select pin and on_release resetting that pin.
+
+    While a higher priority task is waiting, the task holding the resource inherits the waiter's priority until it
+    exits, so a low priority holder can't be starved by medium priority tasks while an urgent task waits on it.
 
     A ManagedResource instance should be shared among all users of `resource`.
     """
@@ -20,8 +90,16 @@ class ManagedResource:
         self._on_acquire = on_acquire
         self._on_release = on_release
         self._loop = loop
-        self._ownership_queue = []
+        # one FIFO per priority, and the priorities we've seen in ascending order
+        self._ownership_queues = {}
+        self._priorities = []
+        self._queue_depth = 0
         self._owned = False
+        self._holder = None
+        self._holder_priority = None
+        self.max_queue_depth = 0
+        # {priority: [acquisitions, total wait nanos, max wait nanos]}
+        self.wait_stats = {}
 
     def handle(self, *args, **kwargs):
         """
@@ -30,29 +108,129 @@ class ManagedResource:
         """
         return Handle(self, args, kwargs)
 
-    async def _aenter(self, args, kwargs):
+    def _enqueue(self, waiter):
+        queue = self._ownership_queues.get(waiter.priority)
+        if queue is None:
+            queue = self._ownership_queues[waiter.priority] = _Ring()
+            self._priorities.append(waiter.priority)
+            self._priorities.sort()
+        queue.append(waiter)
+        self._queue_depth += 1
+        if self._queue_depth > self.max_queue_depth:
+            self.max_queue_depth = self._queue_depth
+
+    def _dequeue(self):
+        # O(1) in the number of waiters; only walks the (few) distinct priorities
+        for priority in self._priorities:
+            queue = self._ownership_queues[priority]
+            while len(queue) > 0:
+                waiter = queue.popleft()
+                if not waiter.cancelled:
+                    self._queue_depth -= 1
+                    return waiter
+        return None
+
+    async def _aenter(self, handle, timeout=None):
+        task = self._loop._current
+        priority = 0 if task is None else task.priority
+        stats = handle.stats
+        start_nanos = tasko.loop._monotonic_ns()
         if self._owned:
-            # queue up for access to the resource later
-            await_handle, resume_fn = self._loop.suspend()
-            self._ownership_queue.append(resume_fn)
+            if self._queue_depth + 1 > stats.max_queue_depth:
+                stats.max_queue_depth = self._queue_depth + 1
+            # queue up for access to the resource later, behind waiters of the same or higher priority
+            if timeout is None:
+                await_handle, resume_fn = self._loop.suspend()
+            else:
+                await_handle, resume_fn = self._loop.suspend(start_nanos + int(timeout * 1000000000))
+            waiter = _Waiter(priority, resume_fn)
+            self._enqueue(waiter)
+            # priority inheritance: the holder runs at the most urgent waiter's priority until it exits
+            if self._holder is not None and priority < self._holder.priority:
+                self._holder.priority = priority
             # This leverages the suspend() feature in tasko; this current coroutine is not considered again until
-            # the owning job is complete and __aexit__s below.  This keeps waiting handles as cheap as possible.
+            # the owning job is complete and __aexit__s below (or the timeout passes).  This keeps waiting handles
+            # as cheap as possible.
             await await_handle
+            if not waiter.granted:
+                waiter.cancelled = True
+                self._queue_depth -= 1
+                stats.timeouts += 1
+                if self._holder is not None:
+                    # the holder may owe its boost to this waiter
+                    self._holder.priority = self._inherited_priority()
+                raise ResourceTimeoutException('resource not granted within {}s'.format(timeout))
         self._owned = True
-        self._on_acquire(*args, **kwargs)
+        self._holder = task
+        self._holder_priority = priority
+        now_nanos = tasko.loop._monotonic_ns()
+        wait_nanos = now_nanos - start_nanos
+        self._count_wait(priority, wait_nanos)
+        stats.acquisitions += 1
+        stats.wait_nanos += wait_nanos
+        if wait_nanos > stats.max_wait_nanos:
+            stats.max_wait_nanos = wait_nanos
+        handle._acquired_nanos = now_nanos
+        self._on_acquire(*handle._args, **handle._kwargs)
         return self._resource
 
-    async def _aexit(self, args, kwargs):
+    def _inherited_priority(self):
+        # the holder's own priority, or the most urgent waiter's still queued if that is more urgent
+        for priority in self._priorities:
+            if priority >= self._holder_priority:
+                break
+            queue = self._ownership_queues[priority]
+            for i in range(len(queue)):
+                if not queue[i].cancelled:
+                    return priority
+        return self._holder_priority
+
+    def _count_wait(self, priority, wait_nanos):
+        stats = self.wait_stats.get(priority)
+        if stats is None:
+            stats = self.wait_stats[priority] = [0, 0, 0]
+        stats[0] += 1
+        stats[1] += wait_nanos
+        if wait_nanos > stats[2]:
+            stats[2] = wait_nanos
+
+    async def _aexit(self, handle):
         assert self._owned, 'Exited from a context where a managed resource was not owned'
-        self._on_release(*args, **kwargs)
-        if len(self._ownership_queue) > 0:
-            resume_fn = self._ownership_queue.pop(0)
+        self._on_release(*handle._args, **handle._kwargs)
+        stats = handle.stats
+        hold_nanos = tasko.loop._monotonic_ns() - handle._acquired_nanos
+        stats.hold_nanos += hold_nanos
+        if hold_nanos > stats.max_hold_nanos:
+            stats.max_hold_nanos = hold_nanos
+        if self._holder is not None:
+            # drop back to the priority we had before anyone waited on us
+            self._holder.priority = self._holder_priority
+        self._holder = None
+        waiter = self._dequeue()
+        if waiter is not None:
+            waiter.granted = True
             # Note that the awaiter has already passed the ownership check.
             # By not resetting to unowned here we avoid unfair resource starvation in certain code constructs.
-            resume_fn()
+            waiter.resume_fn()
         else:
             self._owned = False
 
+
+class _Acquire:
+    # async context manager for Handle.acquire(timeout)
+    def __init__(self, handle, timeout):
+        self._handle = handle
+        self._timeout = timeout
+
+    async def __aenter__(self):
+        resource = await self._handle._managed_resource._aenter(self._handle, self._timeout)
+        self._handle.active = True
+        return resource
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return await self._handle.__aexit__(exc_type, exc_val, exc_tb)
+
+
 class Handle:
     """
     For binding resource initialization/teardown args to a resource.
@@ -61,14 +239,28 @@ class Handle:
         self._managed_resource = managed_resource
         self._args = args
         self._kwargs = kwargs
+        self._acquired_nanos = 0
         self.active = False
+        self.stats = HandleStats()
+
+    def acquire(self, timeout=None):
+        """
+        Like using the handle directly, but gives up waiting for the resource after timeout seconds:
+
+            try:
+                async with handle.acquire(timeout=0.5) as spi:
+                    ...
+            except ResourceTimeoutException:
+                ...
+        """
+        return _Acquire(self, timeout)
 
     async def __aenter__(self):
-        resource = await self._managed_resource._aenter(self._args, self._kwargs)
+        resource = await self._managed_resource._aenter(self)
         self.active = True
         return resource
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        resource = await self._managed_resource._aexit(self._args, self._kwargs)
+        resource = await self._managed_resource._aexit(self)
         self.active = False
         return resource
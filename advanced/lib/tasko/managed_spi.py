@@ -10,10 +10,12 @@ class ManagedSpi:
         self._handles = {}
     
     def _acquire_spi(self, chip_select):
-        chip_select.value = False
+        if chip_select is not None:
+            chip_select.value = False
 
     def _release_spi(self, chip_select):
-        chip_select.value = True
+        if chip_select is not None:
+            chip_select.value = True
     
     def cs_handle(self, chip_select):
         """
@@ -35,4 +37,118 @@ class ManagedSpi:
         """
         chip_select.value = True
         spi_handle = self._resource.handle(chip_select=chip_select)
+        self._handles[spi_handle] = chip_select
         return spi_handle
+
+    def device_handle(self):
+        """
+        A lease on the bus for a driver that drives its own chip select and locks the bus itself,
+        e.g. sdcardio.SDCard or anything using adafruit_bus_device.SPIDevice.
+
+        Synchronous driver calls can't interleave with each other anyway; the lease orders access between
+        tasks that hold the bus across awaits (e.g. a chunked SD write) and records each device's bus-wait time.
+        """
+        return self._resource.handle(chip_select=None)
+
+    async def run_batch(self, spi_handle, batch):
+        """
+        Run a RegisterBatch under a single lease of the bus for spi_handle, instead of
+        waiting for (and locking) the bus once per register access.
+
+        :returns batch.results
+        """
+        async with spi_handle as spi:
+            return batch.run(spi, self._handles[spi_handle])
+
+
+class RegisterBatch:
+    """
+    A preallocated list of single byte register reads/writes to run back to back under one bus lease.
+
+    Uses the usual 7 bit address + R/W bit register convention (top bit set for writes, e.g. SX127x, BMX160 SPI).
+    Devices like the SX127x end an access when chip select goes high, so CS is pulsed between register accesses;
+    writes or reads to consecutive addresses are merged into a single burst without a pulse.
+
+    Read results (and the value read by an update) land in `results` at the index returned when the op was queued.
+    """
+    READ = 0
+    WRITE = 1
+    UPDATE = 2
+
+    def __init__(self, max_ops=16):
+        self._ops = bytearray(max_ops)
+        self._addresses = bytearray(max_ops)
+        self._values = bytearray(max_ops)
+        self._masks = bytearray(max_ops)
+        self._buffer = bytearray(1)
+        self.results = bytearray(max_ops)
+        self.count = 0
+
+    def clear(self):
+        self.count = 0
+
+    def _add(self, op, address, value=0, mask=0):
+        i = self.count
+        assert i < len(self._ops), 'register batch is full'
+        self._ops[i] = op
+        self._addresses[i] = address & 0x7F
+        self._values[i] = value & 0xFF
+        self._masks[i] = mask & 0xFF
+        self.count += 1
+        return i
+
+    def read(self, address):
+        """queue a register read. returns the index of the result"""
+        return self._add(self.READ, address)
+
+    def write(self, address, value):
+        """queue a register write"""
+        return self._add(self.WRITE, address, value)
+
+    def update(self, address, mask, value):
+        """queue a read-modify-write: register = (register & ~mask) | value"""
+        return self._add(self.UPDATE, address, value, mask)
+
+    def _select(self, spi, chip_select, address, write):
+        # end the previous access and start a new one at address
+        chip_select.value = True
+        chip_select.value = False
+        self._buffer[0] = (address | 0x80) if write else address
+        spi.write(self._buffer)
+
+    def run(self, spi, chip_select):
+        """
+        Run the queued ops on a bus that's already locked and configured, with chip_select asserted (low).
+        chip_select is left asserted for the owner of the lease to release.
+
+        :returns results
+        """
+        buf = self._buffer
+        previous_op = None
+        previous_address = 0
+        first = True
+        for i in range(self.count):
+            op = self._ops[i]
+            address = self._addresses[i]
+            burst = op != self.UPDATE and op == previous_op and address == previous_address + 1
+            if not burst:
+                if first:
+                    # chip select is already asserted by the lease
+                    buf[0] = (address | 0x80) if op == self.WRITE else address
+                    spi.write(buf)
+                else:
+                    self._select(spi, chip_select, address, op == self.WRITE)
+            first = False
+            if op == self.WRITE:
+                buf[0] = self._values[i]
+                spi.write(buf)
+            else:
+                spi.readinto(buf)
+                self.results[i] = buf[0]
+                if op == self.UPDATE:
+                    self._select(spi, chip_select, address, True)
+                    buf[0] = (self.results[i] & ~self._masks[i] & 0xFF) | self._values[i]
+                    spi.write(buf)
+            previous_op = op
+            previous_address = address
+        return self.results
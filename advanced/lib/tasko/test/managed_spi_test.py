@@ -102,3 +102,32 @@ class TestManagedSpi(TestCase):
         self.assertTrue(did_sensor)
         self.assertTrue(did_screen)
         self.assertTrue(did_read)
+
+    def test_device_leases_interleave(self):
+        loop = Loop()
+        managed_spi = ManagedSpi('board.SPI', loop=loop)
+        sd_lease = managed_spi.device_handle()
+        radio_lease = managed_spi.device_handle()
+        log = []
+
+        async def write_file():
+            # 4 chunks of a multi-KB write, one lease per chunk
+            for chunk in range(4):
+                async with sd_lease:
+                    log.append('sd')
+                await YieldOne()
+
+        async def poll_radio():
+            for _ in range(4):
+                async with radio_lease:
+                    log.append('radio')
+                await YieldOne()
+
+        loop.add_task(write_file(), 5)
+        loop.add_task(poll_radio(), 1)
+        for _ in range(4):
+            loop._step()
+
+        self.assertEqual(log, ['radio', 'sd'] * 4, 'radio polls between every sd chunk')
+        self.assertEqual(sd_lease.stats.acquisitions, 4)
+        self.assertEqual(radio_lease.stats.acquisitions, 4)
@@ -0,0 +1,81 @@
+import time
+from unittest import TestCase
+
+from tasko import Loop
+from tasko import checkpoint
+from tasko.loop import set_time_provider
+
+SECOND = 1000000000
+
+
+class TestCheckpoint(TestCase):
+    def setUp(self):
+        self.now = 0
+        set_time_provider(lambda: self.now)
+
+    def tearDown(self):
+        set_time_provider(time.monotonic_ns)
+
+    def _boot(self):
+        loop = Loop()
+        runs = []
+
+        async def beacon():
+            runs.append(self.now)
+
+        async def blink():
+            pass
+
+        tasks = {
+            'beacon': loop.schedule_later(1 / 30, beacon, 1),
+            'blink': loop.schedule(2, blink, 255),
+        }
+        return loop, tasks, runs
+
+    def test_resume_phase(self):
+        loop, tasks, runs = self._boot()
+        loop._step()
+        self.now = 20 * SECOND
+        loop._step()
+        self.assertEqual(runs, [], 'schedule_later waits a full period')
+        record = checkpoint.save(tasks)
+        self.assertEqual(len(record), checkpoint.RECORD_SIZE)
+
+        # reset: monotonic time starts over and every task is scheduled from scratch
+        self.now = 0
+        loop, tasks, runs = self._boot()
+        self.assertEqual(checkpoint.restore(tasks, record), 2)
+        loop._step()
+        self.now = 9 * SECOND
+        loop._step()
+        self.assertEqual(runs, [], 'still 1s left in the restored period')
+        self.now = 10 * SECOND
+        loop._step()
+        self.assertEqual(runs, [10 * SECOND], 'ran 30s after the first boot, not 30s after the reset')
+
+    def test_overrun_runs_at_boot(self):
+        loop, tasks, runs = self._boot()
+        tasks['beacon']._overrun = True
+        record = checkpoint.save(tasks)
+
+        loop, tasks, runs = self._boot()
+        checkpoint.restore(tasks, record)
+        loop._step()
+        self.assertEqual(runs, [0])
+
+    def test_ignores_bad_records(self):
+        loop, tasks, runs = self._boot()
+        record = checkpoint.save(tasks)
+        record[3] ^= 0xFF
+        self.assertEqual(checkpoint.restore(tasks, record), 0)
+        self.assertEqual(checkpoint.restore(tasks, bytearray(checkpoint.RECORD_SIZE)), 0)
+        self.assertEqual(checkpoint.restore(tasks, b''), 0)
+        self.assertEqual(checkpoint.restore({}, checkpoint.save(tasks)), 0)
+
+    def test_restore_is_fast(self):
+        loop, tasks, runs = self._boot()
+        record = bytes(checkpoint.save(tasks))
+        set_time_provider(time.monotonic_ns)
+        start = time.monotonic_ns()
+        checkpoint.restore(tasks, record)
+        self.assertLess(time.monotonic_ns() - start, 1000000)
@@ -0,0 +1,84 @@
+from unittest import TestCase
+
+from tasko.managed_i2c import ManagedI2C
+from tasko import Loop
+
+
+class FakeI2C:
+    def __init__(self):
+        self.locked = False
+        self.log = []
+        self.registers = {0x4A: bytes(range(10, 13)), 0x68: bytes(range(40))}
+
+    def try_lock(self):
+        if self.locked:
+            return False
+        self.locked = True
+        return True
+
+    def unlock(self):
+        assert self.locked
+        self.locked = False
+
+    def readfrom_into(self, address, buf, *, start=0, end=None):
+        assert self.locked
+        self.log.append(('read', address))
+        buf[start:end] = self.registers[address][:end - start]
+
+    def writeto(self, address, buf, *, start=0, end=None):
+        assert self.locked
+        self.log.append(('write', address, bytes(buf[start:end])))
+
+    def writeto_then_readfrom(self, address, out_buffer, in_buffer, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        assert self.locked
+        register = out_buffer[out_start]
+        self.log.append(('write_read', address, register))
+        in_buffer[in_start:in_end] = self.registers[address][register:register + in_end - in_start]
+
+
+class YieldOne:
+    def __await__(self):
+        yield
+
+
+class TestManagedI2C(TestCase):
+    def test_devices_share_the_bus(self):
+        loop = Loop()
+        i2c = FakeI2C()
+        managed_i2c = ManagedI2C(i2c, loop=loop)
+        imu = managed_i2c.device(0x68)
+        pwr = managed_i2c.device(0x4A)
+        self.assertIs(managed_i2c.device(0x68), imu)
+        imu_buf = bytearray(20)
+        pwr_buf = bytearray(3)
+
+        async def hog_bus():
+            # a multi-step exchange holding the bus across yields
+            async with imu.handle:
+                await YieldOne()
+                await YieldOne()
+
+        async def read_imu():
+            await YieldOne()
+            await imu.read_register_into(0x04, imu_buf)
+
+        async def read_pwr():
+            await YieldOne()
+            await pwr.readinto(pwr_buf)
+            await pwr.write(b'\x05')
+
+        loop.add_task(hog_bus(), 10)
+        loop.add_task(read_pwr(), 1)
+        loop.add_task(read_imu(), 5)
+        for _ in range(6):
+            loop._step()
+
+        self.assertEqual(bytes(imu_buf), bytes(range(4, 24)))
+        self.assertEqual(bytes(pwr_buf), bytes(range(10, 13)))
+        self.assertEqual(i2c.log, [('read', 0x4A), ('write_read', 0x68, 0x04), ('write', 0x4A, b'\x05')],
+                         'power monitor went ahead of the lower priority imu read, then queued behind it')
+        self.assertFalse(i2c.locked)
+        self.assertEqual(pwr.transactions, 2)
+        self.assertEqual(imu.transactions, 1)
+        self.assertEqual(pwr.stats.acquisitions, 2)
+        self.assertEqual(imu.stats.acquisitions, 2)
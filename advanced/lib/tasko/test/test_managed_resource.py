@@ -1,6 +1,8 @@
 from unittest import TestCase
 
-from tasko.managed_resource import ManagedResource
+from tasko.managed_resource import ManagedResource, ResourceTimeoutException, _Ring
+from tasko.loop import set_time_provider
+import time
 from tasko import Loop
 
 
@@ -62,3 +64,104 @@ class TestManagedResource(TestCase):
 
         loop._step()  # 2 end
         self.assertEqual(loop._tasks, [])  # 2 is finished
+
+    def test_priority_queue_and_inheritance(self):
+        loop = Loop()
+        spi = Resource()
+        managed_spi = ManagedResource(spi, spi.acquire, spi.release, loop=loop)
+        order = []
+
+        async def holder():
+            async with managed_spi.handle(chip_select='sd'):
+                order.append('sd')
+                await YieldOne()
+                await YieldOne()
+
+        async def waiter(name):
+            await YieldOne()
+            async with managed_spi.handle(chip_select=name):
+                order.append(name)
+
+        loop.add_task(holder(), 10)
+        loop.add_task(waiter('logger'), 8)
+        loop.add_task(waiter('radio'), 1)
+        sd_task = loop._tasks[0]
+
+        loop._step()  # sd acquires, radio and logger enter
+        self.assertEqual(order, ['sd'])
+        self.assertEqual(sd_task.priority, 10)
+
+        loop._step()  # radio and logger queue up behind sd
+        self.assertEqual(sd_task.priority, 1, 'sd holder inherits the radio priority')
+        self.assertEqual(managed_spi._priorities, [1, 8])
+        self.assertEqual(managed_spi.max_queue_depth, 2)
+
+        loop._step()  # sd releases
+        self.assertEqual(sd_task.priority, 10, 'sd drops back to its own priority')
+        loop._step()
+        loop._step()
+        self.assertEqual(order, ['sd', 'radio', 'logger'], 'radio jumped ahead of logger')
+        self.assertEqual(sorted(managed_spi.wait_stats), [1, 8, 10])
+        for priority in managed_spi.wait_stats:
+            self.assertEqual(managed_spi.wait_stats[priority][0], 1)
+
+    def test_ring(self):
+        ring = _Ring(capacity=2)
+        for i in range(5):
+            ring.append(i)
+        self.assertEqual(ring.popleft(), 0)
+        ring.append(5)
+        self.assertEqual([ring.popleft() for _ in range(len(ring))], [1, 2, 3, 4, 5])
+
+    def test_acquire_timeout(self):
+        now = 0
+        set_time_provider(lambda: now)
+        try:
+            loop = Loop()
+            spi = Resource()
+            managed_spi = ManagedResource(spi, spi.acquire, spi.release, loop=loop)
+            sd = managed_spi.handle(chip_select='sd')
+            radio = managed_spi.handle(chip_select='radio')
+            sensor = managed_spi.handle(chip_select='sensor')
+            results = []
+
+            async def hold():
+                async with sd:
+                    for _ in range(3):
+                        await YieldOne()
+
+            async def wait(handle, timeout):
+                await YieldOne()
+                try:
+                    async with handle.acquire(timeout=timeout):
+                        results.append(handle._kwargs['chip_select'])
+                except ResourceTimeoutException:
+                    results.append('timeout')
+
+            loop.add_task(hold(), 5)
+            sd_task = loop._tasks[0]
+            loop.add_task(wait(radio, 0.5), 1)
+            loop.add_task(wait(sensor, 10), 3)
+            loop._step()  # sd acquires
+            loop._step()  # radio and sensor queue
+            self.assertEqual(radio.stats.max_queue_depth, 1)
+            self.assertEqual(sensor.stats.max_queue_depth, 2)
+            self.assertEqual(sd_task.priority, 1)
+
+            now = 1000000000
+            loop._step()  # radio gives up
+            self.assertEqual(results, ['timeout'])
+            self.assertEqual(radio.stats.timeouts, 1)
+            self.assertEqual(sd_task.priority, 3, 'sd keeps only the sensor boost')
+
+            loop._step()  # sd releases, sensor gets the bus
+            loop._step()
+            self.assertEqual(results, ['timeout', 'sensor'])
+            self.assertIsNone(spi.active_cs)
+            self.assertEqual(loop._sleeping, [], 'sensor no longer waits on its timeout')
+            self.assertEqual(sd.stats.acquisitions, 1)
+            self.assertEqual(sd.stats.hold_nanos, 1000000000)
+            self.assertEqual(sensor.stats.wait_nanos, 1000000000)
+            self.assertEqual(radio.stats.acquisitions, 0)
+        finally:
+            set_time_provider(time.monotonic_ns)
@@ -0,0 +1,201 @@
+from unittest import TestCase
+
+from tasko.managed_spi import ManagedSpi, RegisterBatch
+from tasko import Loop
+
+
+class FakeRegisterSpi:
+    """
+    SPI bus with one SX127x style register device on it. Counts bus locks and chip select assertions.
+    """
+    def __init__(self):
+        self.registers = bytearray(128)
+        self.locked = False
+        self.locks = 0
+        self.selects = 0
+        self._address = None
+        self._writing = False
+
+    def select(self):
+        self.selects += 1
+        self._address = None
+
+    def try_lock(self):
+        if self.locked:
+            return False
+        self.locked = self.locks = self.locks + 1
+        return True
+
+    def unlock(self):
+        self.locked = False
+
+    def configure(self, **kwargs):
+        pass
+
+    def write(self, buf, *, start=0, end=None):
+        assert self.locked
+        for b in buf[start:end]:
+            if self._address is None:
+                self._address = b & 0x7F
+                self._writing = bool(b & 0x80)
+            else:
+                assert self._writing
+                self.registers[self._address] = b
+                self._address += 1
+
+    def readinto(self, buf, *, start=0, end=None):
+        assert self.locked and not self._writing
+        for i in range(start, len(buf) if end is None else end):
+            buf[i] = self.registers[self._address]
+            self._address += 1
+
+
+class FakeChipSelect:
+    def __init__(self, spi):
+        self._spi = spi
+        self._value = True
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if self._value and not value:
+            self._spi.select()
+        self._value = value
+
+    def switch_to_output(self, value=True):
+        self.value = value
+
+
+class SPIDevice:
+    # same bus handling as adafruit_bus_device.spi_device.SPIDevice
+    def __init__(self, spi, chip_select):
+        self.spi = spi
+        self.chip_select = chip_select
+
+    def __enter__(self):
+        while not self.spi.try_lock():
+            pass
+        self.spi.configure(baudrate=5000000)
+        self.chip_select.value = False
+        return self.spi
+
+    def __exit__(self, *args):
+        self.chip_select.value = True
+        self.spi.unlock()
+
+
+class Radio:
+    # a plain SX127x driver, one bus transaction per register access.
+    # The real RFM9x is counted against the simulator in test/test_register_batch.py
+    _BUFFER = bytearray(4)
+
+    def __init__(self, device):
+        self._device = device
+
+    def _read_u8(self, address):
+        with self._device as device:
+            self._BUFFER[0] = address & 0x7F
+            device.write(self._BUFFER, end=1)
+            device.readinto(self._BUFFER, end=1)
+        return self._BUFFER[0]
+
+    def _write_u8(self, address, val):
+        with self._device as device:
+            self._BUFFER[0] = (address | 0x80) & 0xFF
+            self._BUFFER[1] = val & 0xFF
+            device.write(self._BUFFER, end=2)
+
+    def configure(self, bw_id, cr_id, sf):
+        # signal_bandwidth, coding_rate, spreading_factor and enable_crc setters
+        self._write_u8(0x1D, (self._read_u8(0x1D) & 0x0F) | (bw_id << 4))
+        self._write_u8(0x2F, 0x40)
+        self._write_u8(0x30, 0)
+        self._write_u8(0x1D, (self._read_u8(0x1D) & 0xF1) | (cr_id << 1))
+        self._write_u8(0x31, 0xC3)
+        self._read_u8(0x1D)
+        self._write_u8(0x31, 0x43)
+        self._write_u8(0x37, 0x0A)
+        self._write_u8(0x1E, (self._read_u8(0x1E) & 0x0F) | (sf << 4))
+        self._write_u8(0x1E, self._read_u8(0x1E) | 0x04)
+
+    def configure_batch(self, batch, bw_id, cr_id, sf):
+        batch.clear()
+        batch.update(0x1D, 0xF0, bw_id << 4)
+        batch.write(0x2F, 0x40)
+        batch.write(0x30, 0)
+        batch.update(0x1D, 0x0E, cr_id << 1)
+        batch.write(0x31, 0x43)
+        batch.write(0x37, 0x0A)
+        batch.update(0x1E, 0xF0, sf << 4)
+        batch.update(0x1E, 0x04, 0x04)
+        with self._device as device:
+            batch.run(device, self._device.chip_select)
+
+
+class TestRegisterBatch(TestCase):
+    def _radio(self):
+        spi = FakeRegisterSpi()
+        spi.registers[0x1D] = 0x72
+        spi.registers[0x1E] = 0x70
+        return spi, Radio(SPIDevice(spi, FakeChipSelect(spi)))
+
+    def test_batch_matches_individual_transactions(self):
+        spi, radio = self._radio()
+        radio.configure(bw_id=8, cr_id=4, sf=9)
+        expected = bytes(spi.registers)
+        individual = (spi.locks, spi.selects)
+
+        spi, radio = self._radio()
+        batch = RegisterBatch()
+        radio.configure_batch(batch, bw_id=8, cr_id=4, sf=9)
+        self.assertEqual(bytes(spi.registers), expected)
+        self.assertEqual(batch.results[0], 0x72, 'read results are kept')
+        self.assertEqual(batch.results[6], 0x70)
+        batched = (spi.locks, spi.selects)
+
+        # 2F/30 go out as one burst; every other access still needs its own chip select pulse
+        self.assertEqual(individual, (14, 14))
+        self.assertEqual(batched, (1, 11))
+
+    def test_burst_read(self):
+        spi, radio = self._radio()
+        spi.registers[0x06:0x09] = b'\x6c\x40\x00'
+        batch = RegisterBatch(max_ops=3)
+        for address in range(0x06, 0x09):
+            batch.read(address)
+        with radio._device as device:
+            batch.run(device, radio._device.chip_select)
+        self.assertEqual(bytes(batch.results), b'\x6c\x40\x00')
+        self.assertEqual(spi.selects, 1)
+        batch.clear()
+        batch.read(0)
+        batch.read(0)
+        batch.read(0)
+        with self.assertRaises(AssertionError):
+            batch.read(0)
+
+    def test_managed_spi_run_batch(self):
+        loop = Loop()
+        spi = FakeRegisterSpi()
+        spi.registers[0x1E] = 0x70
+        managed_spi = ManagedSpi(spi, loop=loop)
+        cs = FakeChipSelect(spi)
+        radio = managed_spi.cs_handle(cs)
+        batch = RegisterBatch()
+        batch.update(0x1E, 0x04, 0x04)
+        batch.read(0x1E)
+        results = []
+
+        async def configure():
+            spi.try_lock()  # ManagedResource leases don't lock the bus themselves
+            results.append(await managed_spi.run_batch(radio, batch))
+            spi.unlock()
+
+        loop.add_task(configure(), 1)
+        loop._step()
+        self.assertEqual(results[0][1], 0x74)
+        self.assertTrue(cs.value)
+        self.assertEqual(radio.stats.acquisitions, 1)
@@ -0,0 +1,599 @@
+"""
+Register-level SX1276 (LoRa mode) simulator for running pycubed_rfm9x on a PC.
+
+Importing this module installs stand-ins for the CircuitPython modules the driver needs
+(micropython, digitalio, busio, adafruit_bus_device.spi_device) unless real ones are
+already loaded. SimChip models the parts of the register map the driver uses: op modes,
+the FIFO and its pointers, IRQ flags (write 1 to clear), RX_NB_BYTES, PKT_RSSI/PKT_SNR and
+the DIO0 mapping. Chips on the same Channel hear each other's packets after the real time
+on air, subject to a loss rate, a bit error rate and collisions.
+
+Time is virtual. Every SPI transaction and DIO0 read costs a few microseconds of Clock time,
+so the driver's busy-wait loops make progress, and inside `with clock.patch():` time.sleep,
+time.monotonic and the tasko loop follow the Clock too:
+
+    clock = Clock()
+    channel = Channel(clock, loss=0.1)
+    sat = make_radio(channel)
+    ground = make_radio(channel)
+    with clock.patch():
+        ground.listen()
+        sat.send(b'hello')
+        packet = ground.receive()
+"""
+import random
+import sys
+import types
+from unittest import mock
+
+
+# ---- CircuitPython stand-ins ----
+
+class Direction:
+    INPUT = 0
+    OUTPUT = 1
+
+
+class Pull:
+    UP = 1
+    DOWN = 2
+
+
+class DriveMode:
+    PUSH_PULL = 0
+    OPEN_DRAIN = 1
+
+
+class DigitalInOut:
+    """digitalio.DigitalInOut without hardware"""
+    def __init__(self, pin=None):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.pull = None
+        self.drive_mode = DriveMode.PUSH_PULL
+        self.value = False
+
+    def switch_to_output(self, value=False, drive_mode=DriveMode.PUSH_PULL):
+        self.direction = Direction.OUTPUT
+        self.drive_mode = drive_mode
+        self.value = value
+
+    def switch_to_input(self, pull=None):
+        self.direction = Direction.INPUT
+        self.pull = pull
+
+    def deinit(self):
+        pass
+
+
+class SPI:
+    """busio.SPI: routes each transfer to the attached device whose chip select is low"""
+    def __init__(self, clock=None, MOSI=None, MISO=None):
+        self.devices = []
+        self._locked = False
+
+    def try_lock(self):
+        if self._locked:
+            return False
+        self._locked = True
+        return True
+
+    def unlock(self):
+        self._locked = False
+
+    def configure(self, **kwargs):
+        pass
+
+    def _selected(self):
+        for device in self.devices:
+            if not device.cs.value:
+                return device
+        raise RuntimeError('SPI transfer with no chip selected')
+
+    def write(self, buf, *, start=0, end=None):
+        self._selected().spi_write(buf, start, len(buf) if end is None else end)
+
+    def readinto(self, buf, *, start=0, end=None, write_value=0):
+        self._selected().spi_read(buf, start, len(buf) if end is None else end)
+
+    def write_readinto(self, out_buf, in_buf, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        self.write(out_buf, start=out_start, end=out_end)
+        self.readinto(in_buf, start=in_start, end=in_end)
+
+    def deinit(self):
+        pass
+
+
+class SPIDevice:
+    """adafruit_bus_device.spi_device.SPIDevice"""
+    def __init__(self, spi, chip_select=None, *, baudrate=100000, polarity=0, phase=0, extra_clocks=0):
+        self.spi = spi
+        self.chip_select = chip_select
+        self.baudrate = baudrate
+
+    def __enter__(self):
+        while not self.spi.try_lock():
+            pass
+        self.spi.configure(baudrate=self.baudrate)
+        if self.chip_select is not None:
+            self.chip_select.value = False
+        return self.spi
+
+    def __exit__(self, *args):
+        if self.chip_select is not None:
+            self.chip_select.value = True
+        self.spi.unlock()
+        return False
+
+
+def install():
+    """Register the stand-in modules (only those not already importable as real ones)"""
+    if 'micropython' not in sys.modules:
+        sys.modules['micropython'] = types.SimpleNamespace(const=lambda x: x)
+    if 'digitalio' not in sys.modules:
+        sys.modules['digitalio'] = types.SimpleNamespace(
+            DigitalInOut=DigitalInOut, Direction=Direction, Pull=Pull, DriveMode=DriveMode)
+    if 'busio' not in sys.modules:
+        sys.modules['busio'] = types.SimpleNamespace(SPI=SPI)
+    if 'adafruit_bus_device.spi_device' not in sys.modules:
+        sys.modules['adafruit_bus_device'] = types.ModuleType('adafruit_bus_device')
+        sys.modules['adafruit_bus_device.spi_device'] = types.SimpleNamespace(SPIDevice=SPIDevice)
+
+
+install()
+
+import tasko  # noqa: E402
+from tasko import loop as tasko_loop  # noqa: E402
+import pycubed_rfm9x  # noqa: E402
+
+
+# ---- time ----
+
+class Clock:
+    """
+    Virtual time in seconds. advance() runs the channel events that fall due on the way.
+    SPI transactions cost spi_time each and DIO0 reads pin_time.
+    """
+    def __init__(self, spi_time=20e-6, pin_time=2e-6):
+        self.now = 1000.0
+        self.spi_time = spi_time
+        self.pin_time = pin_time
+        self._events = []
+
+    def monotonic(self):
+        return self.now
+
+    def monotonic_ns(self):
+        return int(self.now * 1000000000)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def schedule(self, at, callback):
+        self._events.append((at, callback))
+        self._events.sort(key=lambda event: event[0])
+
+    def cancel(self, callback):
+        self._events = [e for e in self._events if e[1] is not callback]
+
+    def advance(self, seconds):
+        end = self.now + max(seconds, 0)
+        while self._events and self._events[0][0] <= end:
+            at, callback = self._events.pop(0)
+            self.now = max(self.now, at)
+            callback()
+        self.now = end
+
+    def patch(self):
+        """Context manager: time.monotonic/monotonic_ns/sleep and the tasko loop run on this clock"""
+        clock = self
+
+        class _Patch:
+            def __enter__(self):
+                self._patches = [
+                    mock.patch('time.monotonic', clock.monotonic),
+                    mock.patch('time.monotonic_ns', clock.monotonic_ns),
+                    mock.patch('time.sleep', clock.sleep),
+                ]
+                for p in self._patches:
+                    p.start()
+                self._provider = tasko_loop._monotonic_ns
+                tasko_loop.set_time_provider(clock.monotonic_ns)
+                return clock
+
+            def __exit__(self, *args):
+                tasko_loop.set_time_provider(self._provider)
+                for p in reversed(self._patches):
+                    p.stop()
+                return False
+
+        return _Patch()
+
+
+# ---- the chip ----
+
+SLEEP = 0
+STANDBY = 1
+TX = 3
+RX = 5
+CAD = 7
+
+RX_DONE = 0x40
+CRC_ERROR = 0x20
+VALID_HEADER = 0x10
+TX_DONE = 0x08
+CAD_DONE = 0x04
+
+
+class ChipSelect(DigitalInOut):
+    """CS line: a falling edge starts a new SPI transaction on the chip"""
+    def __init__(self, chip):
+        self._chip = chip
+        super().__init__()
+        self.value = True
+
+    def __setattr__(self, name, value):
+        if name == 'value' and not value and getattr(self, 'value', True):
+            self._chip.select()
+        object.__setattr__(self, name, value)
+
+
+class ResetPin(DigitalInOut):
+    """RST line: driving it low resets the chip"""
+    def __init__(self, chip):
+        self._chip = chip
+        super().__init__()
+
+    def switch_to_output(self, value=False, drive_mode=DriveMode.PUSH_PULL):
+        super().switch_to_output(value, drive_mode)
+        if not value:
+            self._chip.reset()
+
+
+class Dio0Pin(DigitalInOut):
+    """DIO0 as mapped by RegDioMapping1: RxDone, TxDone or CadDone"""
+    def __init__(self, chip):
+        self._chip = chip
+        super().__init__()
+
+    @property
+    def value(self):
+        chip = self._chip
+        chip.clock.advance(chip.clock.pin_time)
+        mapping = chip.registers[0x40] >> 6
+        flag = (RX_DONE, TX_DONE, CAD_DONE, 0)[mapping]
+        return bool(chip.registers[0x12] & flag)
+
+    @value.setter
+    def value(self, value):
+        pass
+
+
+class SimChip:
+    """
+    One SX1276 behind an SPI bus. Use make_radio() for a driver instance wired to one.
+
+    deliver() drops a packet straight into the FIFO as if it had just been received,
+    for driver tests that don't need a second radio.
+    """
+    def __init__(self, clock, bus=None):
+        self.clock = clock
+        self.channel = None
+        self.registers = bytearray(128)
+        self.fifo = bytearray(256)
+        self.cs = ChipSelect(self)
+        self.reset_pin = ResetPin(self)
+        self.dio0 = Dio0Pin(self)
+        self.bus = SPI() if bus is None else bus
+        self.bus.devices.append(self)
+        self.rssi = -90
+        """dBm reported for deliver()ed packets"""
+        self.snr = 9.5
+        self._address = None
+        self._write = False
+        self._rx_write = 0
+        self.reset()
+
+    def reset(self):
+        registers = self.registers
+        for i in range(len(registers)):
+            registers[i] = 0
+        registers[0x01] = 0x09
+        registers[0x06:0x09] = b'\x6c\x80\x00'
+        registers[0x0E] = 0x80
+        registers[0x1D] = 0x72
+        registers[0x1E] = 0x70
+        registers[0x1F] = 0x64
+        registers[0x21] = 0x08
+        registers[0x22] = 0x01
+        registers[0x23] = 0xFF
+        registers[0x42] = 0x12
+        self._rx_write = 0
+        if self.channel is not None:
+            self.channel._abort(self)
+
+    # SPI side
+
+    def select(self):
+        self.clock.advance(self.clock.spi_time)
+        self._address = None
+
+    def spi_write(self, buf, start, end):
+        for i in range(start, end):
+            b = buf[i]
+            if self._address is None:
+                self._address = b & 0x7F
+                self._write = bool(b & 0x80)
+            elif self._write:
+                self._write_register(self._address, b)
+                if self._address:
+                    self._address = (self._address + 1) & 0x7F
+
+    def spi_read(self, buf, start, end):
+        for i in range(start, end):
+            buf[i] = self._read_register(self._address)
+            if self._address:
+                self._address = (self._address + 1) & 0x7F
+
+    def _read_register(self, address):
+        if address == 0:
+            ptr = self.registers[0x0D]
+            self.registers[0x0D] = (ptr + 1) & 0xFF
+            return self.fifo[ptr]
+        if address == 0x18 and self.channel is not None:
+            # modem status: signal detected while a packet we are receiving is on the air
+            return 0x01 if self.mode == RX and self.channel._hearing(self) else 0x00
+        return self.registers[address]
+
+    def _write_register(self, address, value):
+        registers = self.registers
+        if address == 0:
+            ptr = registers[0x0D]
+            self.fifo[ptr] = value
+            registers[0x0D] = (ptr + 1) & 0xFF
+        elif address == 0x01:
+            self._set_mode(value)
+        elif address == 0x12:
+            registers[0x12] &= ~value & 0xFF
+        else:
+            registers[address] = value
+
+    # modem side
+
+    @property
+    def mode(self):
+        return self.registers[0x01] & 0x07
+
+    @property
+    def lora(self):
+        return bool(self.registers[0x01] & 0x80)
+
+    def _set_mode(self, value):
+        old = self.mode
+        self.registers[0x01] = value
+        new = value & 0x07
+        if old == new:
+            return
+        if old == TX and self.channel is not None:
+            self.channel._abort(self)
+        if new == RX:
+            self._rx_write = self.registers[0x0F]
+            if self.channel is not None:
+                self.channel._join(self)
+        if new == TX and self.lora and self.channel is not None:
+            self.channel._transmit(self)
+        elif new == CAD and self.lora and self.channel is not None:
+            self.channel._cad(self)
+
+    def config(self):
+        """(frequency registers, SF, BW id): radios only hear each other when these match"""
+        r = self.registers
+        return (bytes(r[0x06:0x09]), r[0x1E] >> 4, r[0x1D] >> 4)
+
+    def symbol_time(self):
+        r = self.registers
+        bw_id = r[0x1D] >> 4
+        bandwidth = 500000 if bw_id >= len(pycubed_rfm9x.bw_bins) else pycubed_rfm9x.bw_bins[bw_id]
+        return (1 << (r[0x1E] >> 4)) / bandwidth
+
+    def preamble_time(self):
+        """seconds of preamble (and sync word) before the header"""
+        r = self.registers
+        return (((r[0x20] << 8) | r[0x21]) + 4.25) * self.symbol_time()
+
+    def time_on_air(self, length):
+        r = self.registers
+        bw_id = r[0x1D] >> 4
+        bandwidth = 500000 if bw_id >= len(pycubed_rfm9x.bw_bins) else pycubed_rfm9x.bw_bins[bw_id]
+        return pycubed_rfm9x.time_on_air(
+            length, r[0x1E] >> 4, bandwidth, ((r[0x1D] >> 1) & 0x07) + 4,
+            (r[0x20] << 8) | r[0x21], bool(r[0x1E] & 0x04), bool(r[0x26] & 0x08), bool(r[0x1D] & 0x01))
+
+    def _tx_payload(self):
+        start = self.registers[0x0E]
+        length = self.registers[0x22]
+        return bytes(self.fifo[(start + i) & 0xFF] for i in range(length))
+
+    def _tx_done(self):
+        self.registers[0x01] = (self.registers[0x01] & 0xF8) | STANDBY
+        self.registers[0x12] |= TX_DONE
+
+    def deliver(self, packet, rssi=None, snr=None, crc_error=False):
+        """Write a received packet to the FIFO as RX continuous mode would and raise RxDone"""
+        registers = self.registers
+        start = self._rx_write
+        for i, b in enumerate(packet):
+            self.fifo[(start + i) & 0xFF] = b
+        self._rx_write = (start + len(packet)) & 0xFF
+        registers[0x10] = start
+        registers[0x13] = len(packet)
+        registers[0x25] = self._rx_write
+        rssi = self.rssi if rssi is None else rssi
+        snr = self.snr if snr is None else snr
+        registers[0x1A] = max(0, min(255, int(rssi) + 137))
+        registers[0x19] = int(snr * 4) & 0xFF
+        registers[0x12] |= RX_DONE | VALID_HEADER | (CRC_ERROR if crc_error else 0)
+
+
+class Channel:
+    """
+    The air between SimChips. A packet reaches every other chip that is in RX with the same
+    frequency/SF/BW from the end of its preamble to the end of the transmission, unless it is
+    lost (loss) or overlaps another transmission. Bit errors (ber, per bit) are flagged as a CRC
+    error by the receiver when the packet carries a CRC, and delivered as they are otherwise.
+    A CAD detects a transmission if its preamble overlaps the CAD.
+    """
+    def __init__(self, clock, *, loss=0.0, ber=0.0, rssi=-100, snr=5.0, seed=1):
+        self.clock = clock
+        self.loss = loss
+        self.ber = ber
+        self.rssi = rssi
+        self.snr = snr
+        self.random = random.Random(seed)
+        self.chips = []
+        self._active = {}
+        self.sent = 0
+        self.delivered = 0
+        self.lost = 0
+        self.corrupted = 0
+        self.collisions = 0
+        self.cads = 0
+
+    def attach(self, chip):
+        chip.channel = self
+        self.chips.append(chip)
+        return chip
+
+    def busy(self, chip=None):
+        """True while another chip is transmitting on chip's settings"""
+        for sender in self._active:
+            if sender is not chip and (chip is None or sender.config() == chip.config()):
+                return True
+        return False
+
+    def _transmit(self, sender):
+        payload = sender._tx_payload()
+        self.sent += 1
+        receivers = [c for c in self.chips if c is not sender and c.mode == RX and c.lora
+                     and c.config() == sender.config()]
+        transmission = {'payload': payload, 'receivers': receivers, 'collided': False,
+                        'crc': bool(sender.registers[0x1E] & 0x04),
+                        'config': sender.config(), 'start': self.clock.now,
+                        'preamble_end': self.clock.now + sender.preamble_time()}
+        for other in self._active.values():
+            if other is not transmission:
+                other['collided'] = True
+                transmission['collided'] = True
+        self._active[sender] = transmission
+
+        def done():
+            self._active.pop(sender, None)
+            sender._tx_done()
+            self._receive(sender, transmission)
+
+        transmission['done'] = done
+        self.clock.schedule(self.clock.now + sender.time_on_air(len(payload)), done)
+
+    def _join(self, chip):
+        # a receiver that starts listening during a preamble still gets the packet
+        for sender, transmission in self._active.items():
+            if sender is not chip and transmission['config'] == chip.config() \
+                    and self.clock.now <= transmission['preamble_end'] \
+                    and chip not in transmission['receivers']:
+                transmission['receivers'].append(chip)
+
+    def _hearing(self, chip):
+        for transmission in self._active.values():
+            if chip in transmission['receivers']:
+                return True
+        return False
+
+    def _preamble(self, chip, since):
+        # True if another chip's preamble was on the air at some point since `since`
+        for sender, transmission in self._active.items():
+            if sender is not chip and transmission['config'] == chip.config() \
+                    and transmission['preamble_end'] >= since:
+                return True
+        return False
+
+    def _abort(self, sender):
+        transmission = self._active.pop(sender, None)
+        if transmission is not None:
+            self.clock.cancel(transmission['done'])
+
+    def _receive(self, sender, transmission):
+        if transmission['collided']:
+            self.collisions += 1
+            return
+        for chip in transmission['receivers']:
+            if chip.mode != RX or chip.config() != sender.config():
+                continue
+            if self.random.random() < self.loss:
+                self.lost += 1
+                continue
+            packet = bytearray(transmission['payload'])
+            flips = 0
+            if self.ber:
+                for i in range(len(packet) * 8):
+                    if self.random.random() < self.ber:
+                        packet[i >> 3] ^= 1 << (i & 7)
+                        flips += 1
+            if flips:
+                self.corrupted += 1
+            self.delivered += 1
+            chip.deliver(packet, self.rssi, self.snr, crc_error=bool(flips) and transmission['crc'])
+
+    def _cad(self, chip):
+        # channel activity detection takes about two symbols, and only sees preambles
+        r = chip.registers
+        duration = 2 * chip.symbol_time()
+        start = self.clock.now
+        self.cads += 1
+
+        def done():
+            if chip.mode != CAD:
+                return
+            detected = self._preamble(chip, start)
+            r[0x01] = (r[0x01] & 0xF8) | STANDBY
+            r[0x12] |= CAD_DONE | (0x01 if detected else 0)
+
+        self.clock.schedule(self.clock.now + duration, done)
+
+
+def make_radio(channel=None, clock=None, frequency=433.0, **kwargs):
+    """An RFM9x driving a new SimChip (on channel, if given), DIO0 wired up"""
+    if clock is None:
+        clock = channel.clock
+    chip = SimChip(clock)
+    if channel is not None:
+        channel.attach(chip)
+    with mock.patch('time.sleep', clock.sleep):
+        radio = pycubed_rfm9x.RFM9x(chip.bus, chip.cs, chip.reset_pin, frequency, **kwargs)
+    radio.dio0 = chip.dio0
+    radio.chip = chip
+    return radio
+
+
+def run_tasks(clock, *coroutines, limit=60.0):
+    """Run coroutines on the global tasko loop under clock until they finish or limit virtual seconds pass"""
+    loop = tasko.get_loop()
+    results = [None] * len(coroutines)
+    done = [False] * len(coroutines)
+
+    def wrap(i, coroutine):
+        async def runner():
+            results[i] = await coroutine
+            done[i] = True
+        return runner()
+
+    with clock.patch():
+        end = clock.now + limit
+        for i, coroutine in enumerate(coroutines):
+            loop.add_task(wrap(i, coroutine), 1)
+        while not all(done) and clock.now < end:
+            loop._step()
+    if not all(done):
+        # don't leave stuck tasks behind for the next test
+        loop._tasks.clear()
+        loop._sleeping.clear()
+    return results
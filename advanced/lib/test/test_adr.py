@@ -0,0 +1,160 @@
+import time
+from unittest import TestCase
+
+from sx127x_sim import install
+install()  # CircuitPython stand-ins for pycubed_rfm9x
+from pycubed_rfm9x import ModemProfile  # noqa: E402
+from radio_service import PacketQueue  # noqa: E402
+import adr  # noqa: E402
+from adr import RateController, RateResponder  # noqa: E402
+
+LADDER = ('robust', 'slow', 'beacon', 'fast', 'downlink')
+
+
+def run(coro):
+    """run a coroutine that never really waits"""
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise AssertionError('coroutine waited')
+
+
+class FakeRadio:
+    """Just the parts of RFM9x the controller uses: profiles and send_async()"""
+    def __init__(self):
+        self.profiles = {
+            'robust': ModemProfile().encode(433.0, spreading_factor=11, coding_rate=8),
+            'slow': ModemProfile().encode(433.0, spreading_factor=9, coding_rate=8),
+            'beacon': ModemProfile().encode(433.0, coding_rate=8),
+            'fast': ModemProfile().encode(433.0, signal_bandwidth=250000),
+            'downlink': ModemProfile().encode(433.0, signal_bandwidth=500000),
+        }
+        self.applied = []
+        self.sent = []
+
+    def use_profile(self, name):
+        self.applied.append(name)
+
+    async def send_async(self, data, **kwargs):
+        self.sent.append((bytes(data), kwargs['flags']))
+        return True
+
+
+class FakeService:
+    def __init__(self, radio):
+        self.radio = radio
+        self.lease = None
+        self.queue = PacketQueue(4)
+
+    def channel(self, flag, count=4):
+        return self.queue
+
+
+class Link:
+    """the satellite's controller and a ground responder on either end of a perfect link"""
+    def __init__(self, **kwargs):
+        self.radio = FakeRadio()
+        self.service = FakeService(self.radio)
+        self.rate = RateController(self.service, LADDER, default=2, holdoff=10, **kwargs)
+        self.ground = RateResponder(LADDER, default=2)
+        self.now = time.monotonic()
+
+    def hear(self, snr, count=4):
+        for _ in range(count):
+            self.now += 1
+            self.rate.observe_status(-100, snr, self.now)
+
+    def update(self, deliver=True):
+        sent = len(self.radio.sent)
+        run(self.rate.update(self.now))
+        if deliver and len(self.radio.sent) > sent:
+            frame, flags = self.radio.sent[-1]
+            reply = self.ground.handle(frame, flags=flags, now=self.now)
+            if reply is not None:
+                packet = self.service.queue.acquire()
+                packet.buffer[4:4 + len(reply)] = reply
+                packet.length = 4 + len(reply)
+                self.service.queue.put(packet)
+            run(self.rate.update(self.now))
+
+
+class TestModemProfile(TestCase):
+    def test_decodes_settings(self):
+        profile = ModemProfile().encode(433.0, spreading_factor=11, signal_bandwidth=250000, coding_rate=6,
+                                        preamble_length=300, enable_crc=True)
+        self.assertEqual(profile.spreading_factor, 11)
+        self.assertEqual(profile.signal_bandwidth, 250000)
+        self.assertEqual(profile.coding_rate, 6)
+        self.assertEqual(profile.preamble_length, 300)
+        self.assertTrue(profile.enable_crc)
+        self.assertFalse(profile.low_datarate_optimize)
+        self.assertTrue(ModemProfile().encode(433.0, spreading_factor=12).low_datarate_optimize)
+
+
+class TestRateController(TestCase):
+    def test_steps_up_with_margin(self):
+        link = Link()
+        link.now += 10
+        link.hear(10.0)
+        link.update()
+        self.assertEqual(link.radio.sent[0], (bytes((adr.PROPOSE, 1, 3)), adr.RATE_CHANNEL))
+        self.assertEqual(link.rate.profile, 'fast')
+        self.assertEqual(link.ground.profile, 'fast')
+        self.assertEqual(link.radio.applied, ['fast'])
+        # one step at a time, after the holdoff and a fresh average on the new profile
+        link.update()
+        self.assertEqual(link.rate.profile, 'fast')
+        link.hear(10.0, count=10)
+        link.update()
+        self.assertEqual(link.rate.profile, 'downlink')
+        self.assertEqual(link.rate.stats.ups, 2)
+
+    def test_drops_straight_to_a_safe_profile(self):
+        link = Link()
+        link.now += 10
+        # 1.5dB above the SF7 floor: SF9 would only have 6.5dB, SF11 has 11.5dB
+        link.hear(-6.0)
+        self.assertEqual(link.rate.target(), 0)
+        link.update()
+        self.assertEqual(link.rate.profile, 'robust')
+        self.assertEqual(link.rate.stats.downs, 1)
+
+    def test_hysteresis(self):
+        link = Link()
+        link.now += 10
+        # 7.5dB margin: not poor enough to step down, not enough to try BW250
+        link.hear(0.0, count=20)
+        link.update()
+        self.assertEqual(link.radio.sent, [])
+        self.assertEqual(link.rate.profile, 'beacon')
+
+    def test_unanswered_proposal(self):
+        link = Link()
+        link.now += 10
+        link.hear(10.0)
+        link.update(deliver=False)
+        self.assertEqual(link.rate.state, adr.PROPOSED)
+        link.now += 6
+        link.update(deliver=False)
+        self.assertEqual(link.rate.state, adr.IDLE)
+        self.assertEqual(link.rate.stats.unanswered, 1)
+        self.assertEqual(link.radio.applied, [])
+        # no new proposal until the holdoff is over
+        link.update(deliver=False)
+        self.assertEqual(len(link.radio.sent), 1)
+
+    def test_falls_back_to_default(self):
+        link = Link()
+        link.now += 10
+        link.hear(10.0)
+        link.update()
+        self.assertEqual(link.rate.profile, 'fast')
+        # the ground can't be heard on the new profile
+        link.now += 61
+        link.update()
+        self.assertTrue(link.ground.check(link.now))
+        self.assertEqual(link.rate.profile, 'beacon')
+        self.assertEqual(link.ground.profile, 'beacon')
+        self.assertEqual(link.rate.stats.fallbacks, 1)
+        self.assertEqual(link.radio.applied, ['fast', 'beacon'])
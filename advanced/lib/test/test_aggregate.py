@@ -0,0 +1,129 @@
+import os
+import struct
+from unittest import TestCase
+
+import tasko
+from tasko import Loop
+from sx127x_sim import Clock, run_tasks
+import aggregate
+from aggregate import Aggregator, Unpacker
+from pycubed_rfm9x import time_on_air
+
+# BENCH=1 python -m pytest -s prints the benchmark numbers
+BENCH = os.environ.get('BENCH')
+
+
+class RecordingLink:
+    """Keeps every frame sent; airtime is the SF7/BW125/CR4/8 time on air of the RadioHead packet"""
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, frame, length):
+        self.frames.append(bytes(frame[:length]))
+        return time_on_air(length + 4, 7, 125000, 8)
+
+
+class SlowLink(RecordingLink):
+    """Takes the bytes a second after send(), like a DownlinkScheduler waiting for room"""
+    async def send(self, frame, length):
+        await tasko.sleep(1)
+        return await super().send(frame, length)
+
+
+def run(coroutine):
+    result = []
+
+    async def runner():
+        result.append(await coroutine)
+
+    loop = Loop()
+    loop.add_task(runner(), 1)
+    loop._step()
+    return result[0]
+
+
+class TestAggregator(TestCase):
+    def test_pack_and_unpack(self):
+        link = RecordingLink()
+        agg = Aggregator(link, size=40, deadline=5)
+        self.assertTrue(run(agg.put(aggregate.TELEMETRY, b'x' * 20, now=0)))
+        self.assertTrue(run(agg.put(aggregate.LOG, b'hello', now=1)))
+        self.assertEqual(len(agg), 29)
+        self.assertEqual(link.frames, [])
+        # doesn't fit: the first frame goes out
+        self.assertTrue(run(agg.put(aggregate.RESPONSE, b'y' * 20, now=2)))
+        self.assertEqual(link.frames, [b'\x00\x01\x14' + b'x' * 20 + b'\x02\x05hello'])
+        # deadline counts from the first message of the frame
+        self.assertFalse(run(agg.poll(now=6.9)))
+        self.assertTrue(run(agg.poll(now=7)))
+        self.assertFalse(run(agg.flush()))
+        self.assertFalse(run(agg.put(aggregate.LOG, b'z' * 38)))
+        s = agg.stats
+        self.assertEqual((s.messages, s.bytes, s.frames, s.full, s.expired, s.dropped), (3, 45, 2, 1, 1, 1))
+
+        ground = Unpacker()
+        self.assertEqual(ground.unpack(link.frames[0]), [(aggregate.TELEMETRY, b'x' * 20), (aggregate.LOG, b'hello')])
+        self.assertEqual(ground.unpack(link.frames[1]), [(aggregate.RESPONSE, b'y' * 20)])
+        self.assertEqual((ground.frames, ground.messages, ground.lost, ground.errors), (2, 3, 0, 0))
+
+    def test_flush_while_sending(self):
+        link = SlowLink()
+        agg = Aggregator(link, size=40)
+
+        async def first():
+            await agg.put(aggregate.TELEMETRY, b'a' * 20)
+            await agg.flush()
+
+        async def second():
+            await tasko.sleep(0.1)
+            await agg.put(aggregate.LOG, b'b' * 20)
+            await agg.flush()
+
+        async def third():
+            # the 'a' frame is still with the link: 'c' may not go into its buffer
+            await tasko.sleep(0.2)
+            await agg.put(aggregate.LOG, b'c' * 20)
+            await agg.flush()
+
+        self.assertEqual(run_tasks(Clock(), first(), second(), third()), [None, None, None])
+        self.assertEqual(link.frames, [b'\x00\x01\x14' + b'a' * 20, b'\x01\x02\x14' + b'b' * 20,
+                                       b'\x02\x02\x14' + b'c' * 20])
+        self.assertEqual(agg.stats.frames, 3)
+
+    def test_ground_counts_losses_and_truncation(self):
+        ground = Unpacker()
+        ground.unpack(b'\xfe\x01\x01a')
+        self.assertEqual(ground.unpack(b'\x01\x01\x01b\x02\x09short'), [(1, b'b')])
+        self.assertEqual((ground.lost, ground.errors), (2, 1))
+
+    def test_airtime_per_byte(self):
+        # IMU readings (9 floats) and short log lines, one packet each vs aggregated
+        messages = []
+        for i in range(60):
+            messages.append((aggregate.TELEMETRY, struct.pack('<9f', *range(i, i + 9))))
+            if i % 3 == 0:
+                messages.append((aggregate.LOG, b'log line %d' % i))
+        payload = sum(len(m) for _, m in messages)
+        single = sum(time_on_air(4 + len(m), 7, 125000, 8) for _, m in messages)
+
+        link = RecordingLink()
+        agg = Aggregator(link)
+        for kind, data in messages:
+            run(agg.put(kind, data))
+        run(agg.flush())
+        ground = Unpacker()
+        received = []
+        for frame in link.frames:
+            received += ground.unpack(frame)
+        self.assertEqual(received, messages)
+
+        s = agg.stats
+        if BENCH:
+            print('\n{} messages, {}B: one per packet {} packets {:.2f}s ({:.2f}ms/B), '
+                  'aggregated {} packets {:.2f}s ({:.2f}ms/B)'.format(
+                      len(messages), payload, len(messages), single, 1000 * single / payload,
+                      s.frames, s.airtime, 1000 * s.airtime_per_byte))
+        # every frame but the last is nearly full
+        self.assertLessEqual(s.frames, (len(messages) * 2 + payload) // 200 + 1)
+        # the preamble and header are a smaller share at SF7 than at the slow rates
+        self.assertLess(s.airtime, single * 0.8)
@@ -0,0 +1,83 @@
+from unittest import TestCase
+
+import tasko
+from sx127x_sim import Channel, Clock, make_radio
+from pycubed_rfm9x import time_on_air
+from airtime import AirtimeBudget
+
+
+class TestTimeOnAir(TestCase):
+    def test_datasheet_formula(self):
+        # Semtech LoRa calculator, explicit header, CRC on
+        self.assertAlmostEqual(time_on_air(10, 7, 125000, 5), 0.041216, places=6)
+        self.assertAlmostEqual(time_on_air(10, 12, 125000, 5, low_datarate_optimize=True), 0.991232, places=6)
+        # a full RadioHead packet at the 'downlink' and 'beacon' settings
+        self.assertAlmostEqual(time_on_air(256, 7, 500000, 5), 0.099904, places=6)
+        self.assertAlmostEqual(time_on_air(256, 7, 125000, 8), 0.626944, places=6)
+        # a payload shorter than the header symbols still takes the 8 symbol minimum
+        self.assertAlmostEqual(time_on_air(1, 12, 125000, 5, enable_crc=False, implicit_header=True),
+                               (8 + 4.25 + 8) * 4096 / 125000)
+
+    def test_radio_reads_the_shadow(self):
+        radio = make_radio(clock=Clock())
+        chip = radio.chip
+        radio.enable_crc = True
+        self.assertAlmostEqual(radio.time_on_air(14), time_on_air(14, 7, 125000, 5))
+        profile = radio.define_profile('slow', 433.0, spreading_factor=10, coding_rate=8, enable_crc=True)
+        radio.use_profile('slow')
+        chip.registers[0x1D] = chip.registers[0x1E] = 0  # SPI reads would show this
+        self.assertAlmostEqual(radio.time_on_air(100), profile.time_on_air(100))
+        self.assertAlmostEqual(profile.time_on_air(100), time_on_air(100, 10, 125000, 8))
+
+    def test_send_draws_from_the_budget(self):
+        clock = Clock()
+        radio = make_radio(Channel(clock))
+        airtime = radio.time_on_air(4 + 5)
+        radio.airtime_budget = budget = AirtimeBudget(airtime * 1.5, 3600)
+        with clock.patch():
+            start = clock.now
+            self.assertTrue(radio.send(b'hello', owner='beacon'))
+            self.assertAlmostEqual(clock.now - start, airtime, places=3)
+            self.assertFalse(radio.send(b'hello', owner='beacon'))
+        self.assertEqual(budget.rejected, 1)
+        self.assertAlmostEqual(budget.used['beacon'], airtime)
+
+
+class TestAirtimeBudget(TestCase):
+    def test_token_bucket(self):
+        budget = AirtimeBudget(10, 100)
+        now = budget._stamp
+        self.assertTrue(budget.try_spend(6, 'beacon', now))
+        self.assertFalse(budget.try_spend(6, 'downlink', now))
+        self.assertAlmostEqual(budget.wait_time(6, now), 20)
+        # refills at 0.1s per second, never above the bucket size
+        self.assertTrue(budget.try_spend(6, 'downlink', now + 20))
+        self.assertAlmostEqual(budget.available(now + 1000), 10)
+        self.assertIsNone(budget.wait_time(11))
+        self.assertEqual(budget.used, {'beacon': 6, 'downlink': 6})
+        self.assertEqual((budget.packets, budget.rejected), (2, 1))
+        # ACKs go into debt rather than being refused
+        budget.spend(15, 'ack', now + 1000)
+        self.assertAlmostEqual(budget.available(now + 1000), -5)
+
+    def test_reserve_waits_for_refill(self):
+        budget = AirtimeBudget(1.0, 1, max_wait=0.1)  # refills 1s per second
+        budget.spend(0.99)
+        results = []
+
+        async def sender():
+            results.append(await budget.reserve(0.05, 'beacon'))
+
+        async def impatient():
+            results.append(await budget.reserve(0.5, 'downlink'))
+
+        loop = tasko.get_loop()
+        loop.add_task(sender(), 1)
+        loop.add_task(impatient(), 1)
+        for _ in range(200):
+            loop._step()
+            if len(results) == 2:
+                break
+        self.assertEqual(sorted(results), [False, True])
+        self.assertEqual((budget.delayed, budget.rejected), (1, 1))
+        self.assertIn('beacon', budget.used)
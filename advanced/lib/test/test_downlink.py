@@ -0,0 +1,173 @@
+import os
+from unittest import TestCase
+
+import tasko
+from tasko.managed_resource import ManagedResource
+import downlink
+from downlink import DownlinkScheduler
+from file_downlink import RadioLink
+from radio_service import RadioService
+from sx127x_sim import Channel, Clock, make_radio, run_tasks
+
+# BENCH=1 python -m pytest -s prints the benchmark numbers
+BENCH = os.environ.get('BENCH')
+
+
+class TestDownlinkScheduler(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.channel = Channel(self.clock)
+        self.sat = make_radio(self.channel)
+        self.ground = make_radio(self.channel)
+        self.sat.node, self.ground.node = 0xFA, 0xAB
+        self.tx = DownlinkScheduler(self.sat)
+        self.rx = RadioService(self.ground)
+
+    def received(self, packets):
+        packet = self.rx.queue.get()
+        while packet is not None:
+            packets.append(bytes(packet.data))
+            self.rx.queue.release(packet)
+            packet = self.rx.queue.get()
+        return packets
+
+    def test_replies_preempt_bulk(self):
+        link = RadioLink(self.tx.sender(downlink.BULK), None, destination=0xAB)
+        fragment = self.sat.time_on_air(204)
+        asked = []
+        packets = []
+
+        async def ground():
+            while len(packets) < 11:
+                await self.rx.poll()
+                self.received(packets)
+                await tasko.sleep(0.01)
+
+        async def file_transfer():
+            frame = bytearray(200)
+            for i in range(8):
+                frame[0] = i
+                await link.send(frame, 200)
+
+        async def commands():
+            await tasko.sleep(fragment * 2.5)
+            asked.append(self.tx.stats(downlink.BULK).sent)
+            self.tx.put(downlink.RESPONSE, b'reply', destination=0xAB)
+            await self.tx.send(downlink.BEACON, b'beacon', destination=0xFF)
+            self.tx.put(downlink.RESPONSE, b'second reply', destination=0xAB)
+            # radio task
+            while len(self.tx):
+                await self.tx.poll()
+                await tasko.sleep(0.1)
+
+        with self.clock.patch():
+            self.ground.listen()
+        run_tasks(self.clock, ground(), file_transfer(), commands())
+        self.assertEqual(len(packets), 11)
+        # the fragment on the air when the reply came finishes, then the reply and the beacon; the
+        # next fragment had started before the second reply was queued
+        self.assertEqual(packets[asked[0] + 1:asked[0] + 3], [b'reply', b'beacon'])
+        self.assertEqual(packets[asked[0] + 4], b'second reply')
+        self.assertEqual([p[0] for p in packets if len(p) == 200], list(range(8)))
+        stats = self.tx.stats(downlink.RESPONSE)
+        if BENCH:
+            print('\nreply wait with an 8 fragment transfer running: {:.3f}s max, fragment airtime {:.3f}s'.format(
+                stats.wait_max, fragment))
+        self.assertLess(stats.wait_max, fragment)
+        self.assertEqual((stats.queued, stats.sent), (2, 2))
+        self.assertEqual(self.tx.stats(downlink.BULK).sent, 8)
+        self.assertEqual(len(self.tx), 0)
+
+    def test_byte_budgets(self):
+        self.assertTrue(self.tx.put(downlink.BEACON, b'x' * 200))
+        self.assertTrue(self.tx.put(downlink.BEACON, b'x' * 200))
+        self.assertFalse(self.tx.put(downlink.BEACON, b'x' * 200))
+        # the budget is per class
+        self.assertTrue(self.tx.put(downlink.BULK, b'x' * 200))
+        # and so is the number of frames
+        tx = DownlinkScheduler(self.sat, budgets=(1000, 1000, 1000), slots=(2, 1, 1))
+        self.assertTrue(tx.put(downlink.RESPONSE, b'a'))
+        self.assertTrue(tx.put(downlink.RESPONSE, b'b'))
+        self.assertFalse(tx.put(downlink.RESPONSE, b'c'))
+        self.assertEqual(self.tx.stats(downlink.BEACON).dropped, 1)
+        self.assertEqual(tx.stats(downlink.RESPONSE).dropped, 1)
+        self.assertEqual(len(self.tx), 3)
+
+    def test_send_waits_for_room(self):
+        tx = DownlinkScheduler(self.sat, slots=(1, 1, 1))
+        results = []
+
+        async def sender(data):
+            results.append(await tx.send(downlink.BULK, data, destination=0xAB))
+
+        run_tasks(self.clock, sender(b'one'), sender(b'two'), sender(b'three'))
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(tx.stats(downlink.BULK).sent, 3)
+
+    def test_flush_before_reset(self):
+        with self.clock.patch():
+            self.ground.listen()
+            self.tx.put(downlink.BULK, b'bulk', destination=0xAB)
+            self.tx.put(downlink.RESPONSE, b'resetting', destination=0xAB)
+            self.tx.flush()
+            packet = self.ground.receive(timeout=0.1)
+        self.assertEqual(bytes(packet), b'resetting')
+        self.assertEqual(len(self.tx), 1)
+        stats = self.tx.stats(downlink.RESPONSE)
+        self.assertEqual((stats.sent, stats.bytes), (1, 9))
+        self.assertEqual(self.tx.stats(downlink.BULK).queued, 1)
+
+    def test_flush_during_a_send(self):
+        done = []
+
+        async def radio_task():
+            self.tx.put(downlink.BULK, b'x' * 200, destination=0xAB)
+            await self.tx.poll()
+            done.append(True)
+
+        async def ground():
+            while not done:
+                await self.rx.poll()
+                await tasko.sleep(0.01)
+
+        async def reset():
+            # while the bulk frame is on the air
+            await tasko.sleep(self.sat.time_on_air(204) / 2)
+            self.tx.put(downlink.RESPONSE, b'resetting', destination=0xAB)
+            self.tx.flush()
+
+        run_tasks(self.clock, radio_task(), ground(), reset())
+        self.assertEqual((self.channel.sent, self.channel.delivered, self.channel.collisions), (2, 2, 0))
+        self.assertEqual((self.tx.stats(downlink.BULK).sent, self.tx.stats(downlink.BULK).failed), (1, 0))
+        self.assertEqual(self.tx.stats(downlink.RESPONSE).sent, 1)
+        self.assertEqual(self.sat.link_stats.tx_timeouts, 0)
+
+    def test_flush_during_a_send_needs_the_lease(self):
+        lease = ManagedResource(self.sat).handle()
+        tx = DownlinkScheduler(self.sat, lease=lease)
+        refused = []
+
+        async def radio_task():
+            tx.put(downlink.BULK, b'x' * 200, destination=0xAB)
+            await tx.poll()
+
+        async def reset():
+            await tasko.sleep(self.sat.time_on_air(204) / 2)
+            tx.put(downlink.RESPONSE, b'resetting', destination=0xAB)
+            try:
+                tx.flush()
+            except AssertionError:
+                refused.append(len(tx))
+            async with lease:
+                tx.flush()
+
+        run_tasks(self.clock, radio_task(), reset())
+        self.assertEqual(refused, [1])
+        self.assertEqual(len(tx), 0)
+        self.assertEqual((tx.stats(downlink.BULK).sent, tx.stats(downlink.RESPONSE).sent), (1, 1))
+        self.assertEqual(self.channel.collisions, 0)
+
+    def test_sender_without_waiting(self):
+        link = RadioLink(self.tx.sender(downlink.BULK, wait=False), None, destination=0xAB)
+        self.assertEqual(run_tasks(self.clock, link.send(b'x' * 200, 200)), [self.sat.time_on_air(204)])
+        self.assertEqual((len(self.tx), self.tx.stats(downlink.BULK).sent), (1, 0))
@@ -0,0 +1,116 @@
+from unittest import TestCase
+
+import tasko
+from sx127x_sim import Channel, Clock, make_radio, run_tasks
+from pycubed_rfm9x import DuplicateFilter
+from radio_service import RadioService
+
+RETRY = 0x40
+
+
+class TestDuplicateFilter(TestCase):
+    def test_window(self):
+        f = DuplicateFilter()
+        self.assertTrue(f.check(7, 10, 0))
+        self.assertFalse(f.check(7, 10, RETRY))
+        # another source has its own window
+        self.assertTrue(f.check(8, 10, RETRY))
+        for i in range(11, 40):
+            self.assertTrue(f.check(7, i, 0))
+        # everything in the last 32 is remembered
+        for i in range(10, 40):
+            self.assertFalse(f.check(7, i, RETRY))
+        self.assertEqual(f.dropped, 31)
+        # a late packet in the window that was never seen gets through, once
+        f.check(7, 45, 0)
+        self.assertTrue(f.check(7, 42, RETRY))
+        self.assertFalse(f.check(7, 42, RETRY))
+
+    def test_wraparound(self):
+        f = DuplicateFilter()
+        for i in range(250, 256):
+            f.check(1, i, 0)
+        self.assertTrue(f.check(1, 2, 0))
+        self.assertFalse(f.check(1, 254, RETRY))
+        self.assertFalse(f.check(1, 2, RETRY))
+        # a jump beyond the window forgets the old ones
+        self.assertTrue(f.check(1, 60, 0))
+        self.assertTrue(f.check(1, 2, RETRY))
+
+    def test_first_transmissions_restart(self):
+        f = DuplicateFilter()
+        f.check(3, 5, 0)
+        f.check(3, 6, 0)
+        # the sender rebooted and counts from 1 again
+        self.assertTrue(f.check(3, 1, 0))
+        self.assertTrue(f.check(3, 5, 0))
+        self.assertFalse(f.check(3, 5, RETRY))
+        # plain send() keeps the same identifier without the retry flag
+        self.assertTrue(f.check(3, 5, 0))
+
+
+class TestDuplicateReceive(TestCase):
+    def test_retry_is_acked_but_dropped(self):
+        clock = Clock()
+        channel = Channel(clock)
+        sat = make_radio(channel)
+        ground = make_radio(channel)
+        sat.node, ground.node = 0xFA, 0xAB
+        with clock.patch():
+            for flags in (0, RETRY, RETRY):
+                ground.listen()
+                sat.send(b'reboot', destination=0xAB, identifier=9, flags=flags)
+                packet = ground.receive(timeout=1, with_ack=True)
+                self.assertEqual(packet, b'reboot' if flags == 0 else None)
+            ground.listen()
+            sat.send(b'next', destination=0xAB, identifier=10)
+            self.assertEqual(ground.receive(timeout=1, with_ack=True), b'next')
+        # every packet was ACKed
+        self.assertEqual(channel.sent, 8)
+        self.assertEqual(ground.duplicates.dropped, 2)
+        self.assertEqual(ground.link_stats.rx_packets, 2)
+        ground.duplicates = None
+        with clock.patch():
+            ground.listen()
+            sat.send(b'reboot', destination=0xAB, identifier=9, flags=RETRY)
+            self.assertEqual(ground.receive(timeout=1), b'reboot')
+
+    def lost_first_ack(self, receiver):
+        """send_with_ack_async to a ground station that ACKs nothing itself; (result, sat, ground)"""
+        clock = Clock()
+        channel = Channel(clock)
+        sat, ground = make_radio(channel), make_radio(channel)
+        sat.node, sat.destination, ground.node = 0xFA, 0xAB, 0xAB
+        sat.ack_wait = 0.5
+        ground.ack_delay = 0.02
+        got = run_tasks(clock, sat.send_with_ack_async(b'hello'), receiver(ground), limit=10)[0]
+        return got, sat, ground
+
+    def test_receive_async_acks_the_retry(self):
+        heard = []
+
+        async def station(ground):
+            # the caller ACKs by hand, and this ACK is lost
+            heard.append(await ground.receive_async(timeout=5))
+            heard.append(await ground.receive_async(timeout=2))
+
+        got, sat, ground = self.lost_first_ack(station)
+        self.assertTrue(got)
+        self.assertEqual(heard, [b'hello', None])
+        self.assertEqual((sat.ack_stats.retries, ground.duplicates.dropped), (1, 1))
+        self.assertIsNone(ground.unacked_duplicate)
+
+    def test_radio_service_acks_the_retry(self):
+        services = []
+
+        async def station(ground):
+            service = RadioService(ground)
+            services.append(service)
+            for _ in range(200):
+                await service.poll()
+                await tasko.sleep(0.01)
+
+        got, sat, ground = self.lost_first_ack(station)
+        self.assertTrue(got)
+        self.assertEqual(services[0].received, 1)
+        self.assertEqual((sat.ack_stats.retries, ground.duplicates.dropped), (1, 1))
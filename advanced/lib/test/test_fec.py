@@ -0,0 +1,147 @@
+import os
+import random
+from unittest import TestCase
+
+import fec
+from fec import FecCodec, ReedSolomon
+
+# BENCH=1 python -m pytest -s prints the benchmark numbers
+BENCH = os.environ.get('BENCH')
+
+
+def corrupt(frame, length, rand, ber):
+    """flip each bit of frame[:length] with probability ber, returns the number of flips"""
+    flips = 0
+    for i in range(length * 8):
+        if rand.random() < ber:
+            frame[i >> 3] ^= 1 << (i & 7)
+            flips += 1
+    return flips
+
+
+def goodput(codec, packets, loss, ber, seed=1):
+    """
+    Send `packets` full frames over a channel that drops whole packets with probability loss and
+    flips bits with probability ber, repeating each frame until it gets through (ideal selective
+    repeat ARQ). Without a codec a frame is 252 data bytes and any bit error fails the CRC.
+    Airtime is 1 second per 100 bytes plus 20ms of preamble/header per packet, as in test_file_downlink.
+    Returns (data bytes per second of airtime, transmissions, frames delivered with wrong data).
+    """
+    rand = random.Random(seed)
+    size = 252 if codec is None else codec.max_data
+    frame = bytearray(252)
+    out = bytearray(252)
+    airtime = 0.0
+    transmissions = 0
+    wrong = 0
+    for _ in range(packets):
+        data = bytes(rand.getrandbits(8) for _ in range(size))
+        while True:
+            transmissions += 1
+            airtime += 0.02 + 2.52
+            if codec is None:
+                frame[:size] = data
+                length = size
+            else:
+                length = codec.encode_into(data, frame)
+            if rand.random() < loss:
+                continue
+            flips = corrupt(frame, length, rand, ber)
+            if codec is None:
+                if flips:
+                    continue
+                n = size
+                out[:n] = frame[:n]
+            else:
+                n = codec.decode_into(frame, length, out)
+                if n is None:
+                    continue
+            if out[:n] != data:
+                wrong += 1
+            break
+    return packets * size / airtime, transmissions, wrong
+
+
+class TestReedSolomon(TestCase):
+    def test_tables(self):
+        # alpha generates the whole field and the tables agree
+        self.assertEqual(sorted(fec._EXP[:255]), list(range(1, 256)))
+        for x in range(1, 256):
+            self.assertEqual(fec._EXP[fec._LOG[x]], x)
+
+    def test_corrects_up_to_half_parity(self):
+        rs = ReedSolomon(8)
+        rand = random.Random(2)
+        codeword = bytearray(rand.getrandbits(8) for _ in range(40))
+        rs.encode(codeword, 40)
+        for errors in range(5):
+            damaged = bytearray(codeword)
+            for p in rand.sample(range(40), errors):
+                damaged[p] ^= rand.randrange(1, 256)
+            self.assertEqual(rs.decode(damaged, 40), errors)
+            self.assertEqual(damaged, codeword)
+        damaged = bytearray(codeword)
+        for p in rand.sample(range(40), 5):
+            damaged[p] ^= rand.randrange(1, 256)
+        self.assertIsNone(rs.decode(damaged, 40))
+
+
+class TestFecCodec(TestCase):
+    def test_round_trip_short_frames(self):
+        codec = FecCodec()
+        frame = bytearray(252)
+        out = bytearray(252)
+        for size in (1, 17, 220):
+            data = bytes(range(size))
+            n = codec.encode_into(data, frame)
+            self.assertEqual(n, size + 32)
+            self.assertEqual(frame[:size], data)
+            self.assertEqual(codec.decode_into(frame, n, out), size)
+            self.assertEqual(out[:size], data)
+        self.assertEqual(codec.corrected, 0)
+
+    def test_interleaving_spreads_a_burst(self):
+        data = bytes(random.Random(3).getrandbits(8) for _ in range(220))
+        frame = bytearray(252)
+        out = bytearray(252)
+        for depth in (1, 2, 4):
+            codec = FecCodec(depth=depth)
+            n = codec.encode_into(data, frame)
+            # 16 consecutive bytes: 16 errors in one codeword, or 16/depth in each of depth codewords
+            for i in range(100, 116):
+                frame[i] ^= 0xFF
+            self.assertEqual(codec.decode_into(frame, n, out), 220)
+            self.assertEqual(out[:220], data)
+            self.assertEqual(codec.corrected, 16)
+
+    def test_too_many_errors(self):
+        codec = FecCodec(depth=2)
+        frame = bytearray(252)
+        n = codec.encode_into(bytes(220), frame)
+        # 9 errors in the even codeword, which corrects 8
+        for i in range(0, 18, 2):
+            frame[i] ^= 0x5A
+        self.assertIsNone(codec.decode_into(frame, n, bytearray(252)))
+        self.assertEqual(codec.failed, 1)
+
+    def test_goodput_benchmark(self):
+        """FEC costs 13% of every packet but stops bit errors from turning into retransmissions"""
+        if BENCH:
+            print('\nloss  ber      CRC+ARQ B/s (tx)   RS(252,220) B/s (tx)   RS x4 B/s (tx)')
+        results = {}
+        for loss, ber in ((0.0, 0.0), (0.1, 0.0), (0.1, 1e-4), (0.1, 5e-4), (0.1, 1e-3), (0.1, 2e-3)):
+            row = []
+            for codec in (None, FecCodec(depth=1), FecCodec(depth=4)):
+                rate, transmissions, wrong = goodput(codec, 60, loss, ber)
+                self.assertEqual(wrong, 0)
+                row.append((rate, transmissions))
+            results[ber, loss] = row
+            if BENCH:
+                print('{:.1f}  {:<7}  {:6.1f} ({:3})        {:6.1f} ({:3})            {:6.1f} ({:3})'.format(
+                    loss, ber, *[x for r in row for x in r]))
+        # clean link: the parity is pure overhead
+        plain, rs, _ = results[0.0, 0.0]
+        self.assertGreater(plain[0], rs[0])
+        # around 1e-3 nearly every 2016 bit packet has an error, but rarely more than 16 bytes
+        plain, rs, _ = results[1e-3, 0.1]
+        self.assertGreater(rs[0], 2 * plain[0])
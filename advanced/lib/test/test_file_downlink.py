@@ -0,0 +1,108 @@
+import io
+import os
+import random
+import struct
+from unittest import TestCase
+
+from tasko import Loop
+import file_downlink
+from file_downlink import FileSender, FileReceiver
+
+# BENCH=1 python -m pytest -s prints the benchmark numbers
+BENCH = os.environ.get('BENCH')
+
+
+class GroundLink:
+    """
+    Stand-in for the radio and the ground station: frames from the sender go straight to a
+    FileReceiver, and its replies come back on the next recv(). Either direction can drop frames.
+    Airtime is a flat 1 second per 100 bytes plus 20ms of preamble/header per frame.
+    """
+    def __init__(self, receiver, loss=0.0, reply_loss=0.0, seed=1):
+        self.receiver = receiver
+        self.loss = loss
+        self.reply_loss = reply_loss
+        self.random = random.Random(seed)
+        self.reply = None
+        self.frames = 0
+
+    async def send(self, frame, length):
+        self.frames += 1
+        if self.random.random() >= self.loss:
+            status = self.receiver.handle(bytes(frame[:length]))
+            if status is not None and self.random.random() >= self.reply_loss:
+                self.reply = bytes(status)
+        return 0.02 + length / 100
+
+    async def recv(self, buf, timeout):
+        reply, self.reply = self.reply, None
+        if reply is None:
+            return None
+        buf[:len(reply)] = reply
+        return len(reply)
+
+
+def transfer(data, **link_args):
+    receiver = FileReceiver()
+    link = GroundLink(receiver, **link_args)
+    sender = FileSender(link, io.BytesIO(data), len(data), file_id=3, max_timeouts=20)
+    result = []
+
+    async def run():
+        result.append(await sender.send())
+
+    loop = Loop()
+    loop.add_task(run(), 1)
+    loop._step()
+    return result[0], sender.stats, receiver
+
+
+class TestFileDownlink(TestCase):
+    data = bytes(random.Random(0).getrandbits(8) for _ in range(20000))
+
+    def test_clean_link(self):
+        ok, stats, receiver = transfer(self.data)
+        self.assertTrue(ok)
+        self.assertTrue(receiver.complete)
+        self.assertEqual(bytes(receiver.data), self.data)
+        self.assertEqual(stats.fragments, 81)
+        # START + one transmission per fragment, 3 windows
+        self.assertEqual(stats.transmissions, 82)
+        self.assertEqual(stats.retransmissions, 0)
+
+    def test_selective_repeat(self):
+        ok, stats, receiver = transfer(self.data, loss=0.2, reply_loss=0.2)
+        self.assertTrue(ok)
+        self.assertEqual(bytes(receiver.data), self.data)
+        self.assertGreater(stats.retransmissions, 0)
+        # only lost fragments are repeated: roughly 20% extra, not whole windows
+        self.assertLess(stats.retransmissions, stats.fragments * 0.4)
+        self.assertLess(stats.goodput, stats.raw_rate)
+        if BENCH:
+            print('\n20% loss:', stats, 'efficiency {:.0%}'.format(stats.efficiency))
+
+    def test_frames_fill_packets(self):
+        ok, stats, receiver = transfer(self.data[:file_downlink.FRAGMENT * 2 + 1])
+        self.assertEqual(stats.bytes_on_air, 11 + 2 * file_downlink.FRAME + file_downlink.HEADER + 1)
+        self.assertEqual(file_downlink.FRAME, 252)
+
+    def test_gives_up(self):
+        ok, stats, receiver = transfer(self.data, loss=1.0)
+        self.assertFalse(ok)
+        self.assertEqual(stats.timeouts, 20)
+
+    def test_reused_file_id(self):
+        # after a reset the file ids start over: a file of the same id and size is still new
+        receiver = FileReceiver()
+        first, second = self.data[:1000], self.data[1000:2000]
+        for nonce, data in enumerate((first, second)):
+            sender = FileSender(GroundLink(receiver), io.BytesIO(data), len(data), file_id=0, nonce=nonce)
+            loop = Loop()
+            loop.add_task(sender.send(), 1)
+            loop._step()
+            self.assertEqual(bytes(receiver.data), data)
+        # a repeated START keeps what arrived
+        start = bytearray(16)
+        struct.pack_into('<BBHIBH', start, 0, file_downlink.START, 0, 5, 1000, file_downlink.RAW, sender.nonce)
+        receiver.handle(start, 11)
+        self.assertTrue(receiver.complete)
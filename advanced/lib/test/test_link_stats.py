@@ -0,0 +1,59 @@
+from unittest import TestCase
+
+from sx127x_sim import Channel, Clock, make_radio
+from pycubed_rfm9x import LinkStats
+
+
+class TestLinkStats(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.radio = make_radio(Channel(self.clock))
+        self.chip = self.radio.chip
+        self.radio.node = 0xFA
+        self.stats = self.radio.link_stats
+
+    def deliver(self, packet):
+        self.chip.deliver(packet, rssi=-97, snr=-6)
+        return self.radio.receive_into(bytearray(256), timeout=0)
+
+    def test_receive_paths(self):
+        self.assertEqual(self.deliver(bytes([0xFA, 0xAB, 1, 0]) + b'hello'), 9)
+        self.assertIsNone(self.deliver(bytes([0x11, 0xAB, 2, 0]) + b'not ours'))
+        self.assertIsNone(self.deliver(b'abc'))
+        self.radio.enable_crc = True
+        self.chip.deliver(bytes([0xFA, 0xAB, 3, 0]) + b'bad', rssi=-97, snr=-6, crc_error=True)
+        self.assertIsNone(self.radio.receive_into(bytearray(256), timeout=0))
+        self.assertIsNone(self.radio.receive_into(bytearray(256), timeout=0))
+        s = self.stats
+        self.assertEqual((s.rx_packets, s.rx_bytes), (1, 9))
+        self.assertEqual((s.header_rejects, s.short_packets, s.crc_errors, s.rx_timeouts), (1, 1, 1, 1))
+        self.assertEqual(self.radio.crc_error_count, 1)
+        self.assertEqual(s.rssi_hist, [0, 0, 0, 1, 0, 0, 0, 0])
+        self.assertEqual(s.snr_hist, [0, 0, 0, 1, 0, 0, 0, 0])
+        self.assertEqual(self.radio.last_snr, -6)
+
+    def test_send(self):
+        with self.clock.patch():
+            self.assertTrue(self.radio.send(b'hello'))
+        self.assertEqual((self.stats.tx_packets, self.stats.tx_bytes), (1, 9))
+        self.assertAlmostEqual(self.stats.tx_time, self.radio.time_on_air(9))
+
+    def test_encoding(self):
+        s = self.stats
+        s.tx_packets = 70000
+        s.tx_bytes = 123456
+        s.tx_time = 12.3456
+        s.crc_errors = 3
+        for _ in range(300):
+            s._rx(10, -200, 200)
+        buf = bytearray(LinkStats.SIZE + 2)
+        self.assertEqual(s.encode_into(buf, 2), LinkStats.SIZE)
+        self.assertEqual(LinkStats.SIZE, 46)
+        ground = LinkStats.decode(buf, 2)
+        self.assertEqual(ground.tx_packets, 70000 & 0xFFFF)
+        self.assertEqual((ground.tx_bytes, ground.rx_packets, ground.rx_bytes, ground.crc_errors), (123456, 300, 3000, 3))
+        self.assertAlmostEqual(ground.tx_time, 12.345)
+        self.assertEqual(ground.rssi_hist, [255, 0, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(ground.snr_hist, [0, 0, 0, 0, 0, 0, 0, 255])
+        s.reset()
+        self.assertEqual((s.tx_packets, s.rx_packets, s.rssi_hist[0]), (0, 0, 0))
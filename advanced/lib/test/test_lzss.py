@@ -0,0 +1,114 @@
+import io
+import os
+import random
+import struct
+import tempfile
+import time
+from unittest import TestCase
+
+import tasko
+import lzss
+import file_downlink
+
+# BENCH=1 python -m pytest -s prints the benchmark numbers
+BENCH = os.environ.get('BENCH')
+
+
+def imu_records(count, seed=0):
+    """what msgpack.pack writes for the IMU task's readings dict, record after record"""
+    r = random.Random(seed)
+    out = bytearray()
+    for _ in range(count):
+        out.append(0x83)  # fixmap, 3 entries
+        for key in (b'accel', b'mag', b'gyro'):
+            out.append(0xA0 | len(key))
+            out += key
+            out.append(0x93)  # fixarray, 3 entries
+            for _ in range(3):
+                out.append(0xCA)
+                out += struct.pack('>f', r.gauss(0, 2))
+    return bytes(out)
+
+
+def compress(data, *args):
+    out = io.BytesIO()
+    encoder = lzss.Encoder(out, *args)
+    encoder.write(data)
+    encoder.flush()
+    return out.getvalue()
+
+
+class TestLzss(TestCase):
+    def test_round_trip(self):
+        r = random.Random(1)
+        for args in ((8, 4), (4, 3), (10, 4), (12, 6)):
+            for n in (0, 1, 2, 17, 600, 3000):
+                data = bytes(r.choice(b'abcab\x00\xff') for _ in range(n))
+                self.assertEqual(lzss.decompress(compress(data, *args)), data)
+                data = bytes(r.getrandbits(8) for _ in range(n))
+                self.assertEqual(lzss.decompress(compress(data, *args)), data)
+
+    def test_streaming_matches_one_shot(self):
+        data = imu_records(20)
+        out = io.BytesIO()
+        encoder = lzss.Encoder(out)
+        for i in range(0, len(data), 7):
+            encoder.write(data[i:i + 7])
+        encoder.flush()
+        self.assertEqual(out.getvalue(), compress(data))
+
+    def test_imu_file(self):
+        data = imu_records(64)
+        fragments = (len(data) + file_downlink.FRAGMENT - 1) // file_downlink.FRAGMENT
+        for window_bits in (6, 8, 10):
+            start = time.monotonic()
+            packed = compress(data, window_bits, 4)
+            ms_per_kb = (time.monotonic() - start) * 1000 * 1024 / len(data)
+            self.assertEqual(lzss.decompress(packed), data)
+            ratio = len(packed) / len(data)
+            self.assertLess(ratio, 0.9)
+            if BENCH:
+                print('\nwindow {}B: {} -> {}B, ratio {:.2f}, {} -> {} packets, {:.1f}ms/KB (host)'.format(
+                    1 << window_bits, len(data), len(packed), ratio, fragments,
+                    (len(packed) + file_downlink.FRAGMENT - 1) // file_downlink.FRAGMENT, ms_per_kb))
+
+    def test_compress_file_and_downlink(self):
+        data = imu_records(16)
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, 'imu00001.txt')
+            dst = os.path.join(tmp, 'imu00001.lz')
+            with open(src, 'wb') as f:
+                f.write(data)
+            # compress_file sleeps on the global loop between chunks
+            loop = tasko.get_loop()
+            stats = []
+
+            async def run():
+                stats.append(await lzss.compress_file(src, dst))
+
+            loop.add_task(run(), 1)
+            while not stats:
+                loop._step()
+            with open(dst, 'rb') as f:
+                packed = f.read()
+        self.assertEqual(stats[0].bytes_out, len(packed))
+        self.assertEqual(stats[0].bytes_in, len(data))
+
+        receiver = file_downlink.FileReceiver()
+
+        class Link:
+            reply = None
+
+            async def send(self, frame, length):
+                self.reply = receiver.handle(bytes(frame[:length]))
+                return 0.1
+
+            async def recv(self, buf, timeout):
+                n = len(self.reply)
+                buf[:n] = self.reply
+                return n
+
+        sender = file_downlink.FileSender(Link(), io.BytesIO(packed), len(packed), encoding=file_downlink.LZSS)
+        loop.add_task(sender.send(), 1)
+        loop._step()
+        self.assertEqual(receiver.contents(), data)
@@ -0,0 +1,141 @@
+import os
+import shutil
+import struct
+import tempfile
+from unittest import TestCase
+
+import tasko
+import mailbox
+from mailbox import Mailbox, Postmaster
+from downlink import DownlinkScheduler
+from radio_service import RadioService
+from sx127x_sim import Channel, Clock, make_radio, run_tasks
+
+DAY = 86400
+
+
+class TestMailbox(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'mailbox.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def messages(self, box, destination, now=0):
+        buffer = bytearray(mailbox.MAX_MESSAGE)
+        found = []
+        for slot in box.pending(destination, now):
+            identifier, source, stored, length = box.read(slot, buffer)
+            found.append((identifier, source, stored, bytes(buffer[:length])))
+        return found
+
+    def test_survives_a_reset(self):
+        box = Mailbox(self.path, slots=8)
+        self.assertEqual(os.path.getsize(self.path), 8 * mailbox.SLOT)
+        a = box.store(0xAB, 0xAC, b'first', DAY, now=100)
+        box.store(0xAB, 0xAD, b'other', DAY, now=101)
+        b = box.store(0xAD, 0xAC, b'x' * mailbox.MAX_MESSAGE, DAY, now=102)
+        self.assertIsNone(box.store(0xAB, 0xAC, b'x' * (mailbox.MAX_MESSAGE + 1), now=103))
+        self.assertTrue(box.remove(0xAD, 2))
+        self.assertFalse(box.remove(0xAD, 2))
+
+        box = Mailbox(self.path, slots=8)
+        self.assertEqual((len(box), box.count(0xAC), box.count(0xAD)), (2, 2, 0))
+        self.assertEqual(self.messages(box, 0xAC), [(a, 0xAB, 100, b'first'),
+                                                   (b, 0xAD, 102, b'x' * mailbox.MAX_MESSAGE)])
+        # ids carry on from the highest stored
+        self.assertEqual(box.store(0xAB, 0xAC, b'next', now=104), 4)
+        # a bigger mailbox keeps the old slots
+        self.assertEqual(len(Mailbox(self.path, slots=16)), 3)
+
+    def test_expiry_and_eviction(self):
+        box = Mailbox(self.path, slots=4, per_destination=3, max_ttl=DAY)
+        box.store(1, 0xAC, b'soon', 60, now=0)
+        box.store(1, 0xAC, b'a', 0, now=1)  # 0 and anything over max_ttl: max_ttl
+        box.store(1, 0xAD, b'b', 10 * DAY, now=2)
+        box.store(1, 0xAE, b'c', DAY, now=3)
+        self.assertEqual([m[3] for m in self.messages(box, 0xAC, now=59)], [b'soon', b'a'])
+        # full: the expired one makes room
+        box.store(1, 0xAE, b'd', DAY, now=100)
+        self.assertEqual((box.stats.expired, box.stats.evicted), (1, 0))
+        # full and nothing expired: the oldest goes
+        box.store(1, 0xAE, b'e', DAY, now=101)
+        self.assertEqual(box.count(0xAC), 0)
+        # a destination over its share loses its own oldest
+        box.store(1, 0xAE, b'f', DAY, now=102)
+        self.assertEqual([m[3] for m in self.messages(box, 0xAE, now=103)], [b'd', b'e', b'f'])
+        self.assertEqual(box.count(0xAD), 1)
+        self.assertEqual(box.stats.evicted, 2)
+        self.assertEqual(self.messages(box, 0xAD, now=DAY + 2), [])
+
+
+class TestPostmaster(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.clock = Clock()
+        channel = Channel(self.clock)
+        self.sat = make_radio(channel)
+        self.sat.node = 0xFA
+        self.rx = RadioService(self.sat)
+        self.box = Mailbox(os.path.join(self.dir, 'mailbox.bin'), slots=8)
+        self.tx = DownlinkScheduler(self.sat)
+        self.mail = Postmaster(self.box, self.rx.channel(mailbox.CHANNEL), self.tx, batch=2)
+        self.ground = make_radio(channel)
+        self.ground_rx = RadioService(self.ground)
+        self.replies = self.ground_rx.channel(mailbox.CHANNEL)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def exchange(self, node, frame, replies):
+        """frame from ground node node, then the satellite's replies"""
+        self.ground.node = node
+        received = []
+
+        async def satellite():
+            # as in the radio and downlink tasks
+            for _ in range(20):
+                await self.rx.poll()
+                await self.mail.poll()
+                await self.tx.poll()
+                await tasko.sleep(0.1)
+
+        async def ground():
+            await self.ground.send_async(frame, destination=0xFA, flags=mailbox.CHANNEL)
+            while len(received) < replies:
+                await self.ground_rx.poll()
+                packet = self.replies.get()
+                if packet is not None:
+                    received.append(bytes(packet.data))
+                    self.replies.release(packet)
+                await tasko.sleep(0.01)
+
+        run_tasks(self.clock, satellite(), ground())
+        self.assertEqual(len(received), replies)
+        return received
+
+    def test_store_and_forward(self):
+        # first pass: ground station 0xAB leaves three messages for 0xAC
+        for i in range(3):
+            reply = self.exchange(0xAB, struct.pack('<BBH', mailbox.STORE, 0xAC, 60) + b'hello %d' % i, 1)
+            self.assertEqual(reply, [struct.pack('<BBH', mailbox.STORED, mailbox.OK, i + 1)])
+        reply = self.exchange(0xAB, struct.pack('<BBH', mailbox.STORE, 0xAC, 60) + b'x' * 240, 1)
+        self.assertEqual(reply[0][:2], bytes([mailbox.STORED, mailbox.TOO_LONG]))
+        # nothing for 0xAB
+        self.exchange(0xAB, bytes([mailbox.FETCH, 0]), 0)
+
+        # later pass: 0xAC beacons and gets a batch, then confirms it and gets the rest
+        delivered = self.exchange(0xAC, bytes([mailbox.FETCH, 0]), 2)
+        ids = []
+        for i, frame in enumerate(delivered):
+            identifier, source, age = struct.unpack_from('<HBH', frame, 1)
+            self.assertEqual((frame[0], source, age, frame[6:]), (mailbox.DELIVER, 0xAB, 0, b'hello %d' % i))
+            ids.append(identifier)
+        delivered = self.exchange(0xAC, struct.pack('<BBHH', mailbox.FETCH, 2, *ids), 1)
+        self.assertEqual(delivered[0][6:], b'hello 2')
+        # a lost confirmation only means the message comes again
+        self.assertEqual(self.exchange(0xAC, bytes([mailbox.FETCH, 0]), 1), delivered)
+        self.exchange(0xAC, struct.pack('<BBH', mailbox.FETCH, 1, 3), 0)
+        s = self.box.stats
+        self.assertEqual((len(self.box), s.stored, s.rejected, s.delivered, s.confirmed), (0, 3, 1, 4, 3))
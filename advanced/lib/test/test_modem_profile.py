@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from sx127x_sim import Clock, make_radio
+from pycubed_rfm9x import ModemProfile
+
+
+def chip_image(chip):
+    return bytes(b for start, count in ModemProfile.RANGES for b in chip.registers[start:start + count])
+
+
+class TestModemProfile(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.radio = make_radio(clock=self.clock)
+        self.chip = self.radio.chip
+
+    def test_round_trip(self):
+        profile = self.radio.define_profile('slow', 433.0, spreading_factor=11, signal_bandwidth=62500,
+                                            coding_rate=8, preamble_length=16, enable_crc=True)
+        self.assertEqual((profile.spreading_factor, profile.signal_bandwidth, profile.coding_rate,
+                          profile.preamble_length, profile.enable_crc, profile.low_datarate_optimize),
+                         (11, 62500, 8, 16, True, True))
+        default = self.radio.snapshot()
+        self.radio.use_profile('slow')
+        self.assertEqual(chip_image(self.chip), bytes(profile.image))
+        self.assertEqual((self.radio.spreading_factor, self.radio.coding_rate, self.radio.preamble_length),
+                         (11, 8, 16))
+        # from the shadow and from the chip
+        self.assertEqual(self.radio.snapshot().image, profile.image)
+        self.radio.invalidate_shadow()
+        self.assertEqual(self.radio.snapshot().image, profile.image)
+        self.assertEqual(self.radio.verify_shadow(), 0)
+        # and back
+        self.radio.apply_profile(default)
+        self.assertEqual(chip_image(self.chip), bytes(default.image))
+        self.assertEqual(self.radio.spreading_factor, 7)
+
+    def test_encode_matches_the_setters(self):
+        with self.clock.patch():
+            radio = self.radio
+            radio.frequency_mhz = 433.0
+            radio.signal_bandwidth = 250000
+            radio.coding_rate = 5
+            radio.spreading_factor = 9
+            radio.enable_crc = True
+        profile = ModemProfile().encode(433.0, spreading_factor=9, signal_bandwidth=250000, coding_rate=5,
+                                        enable_crc=True, tx_power=radio.tx_power,
+                                        low_datarate_optimize=bool(radio.low_datarate_optimize),
+                                        auto_agc=bool(radio.auto_agc))
+        # the modem settings; the PA and the wideband errata registers keep their reset values
+        # in the simulator, and the setters leave them alone
+        modem = (0, 1, 2, 6, 7, 8, 9, 10, 11, 12, 14, 16)
+        image = radio.snapshot().image
+        self.assertEqual([image[i] for i in modem], [profile.image[i] for i in modem])
+
+    def test_compile(self):
+        profile = ModemProfile().encode(433.0)
+        profile.image[7] = 0xC4  # MODEM_CONFIG2 by hand: SF12, CRC on
+        profile.compile()
+        self.radio.apply_profile(profile)
+        self.assertEqual(self.chip.registers[0x1E], 0xC4)
+        self.assertEqual(self.radio.time_on_air(20), profile.time_on_air(20))
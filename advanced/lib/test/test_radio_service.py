@@ -0,0 +1,157 @@
+from unittest import TestCase
+
+import tasko
+from tasko import Loop
+from radio_service import PacketQueue, RadioService
+from sx127x_sim import Channel, Clock, make_radio, run_tasks
+
+
+class FakeRadio:
+    """Just enough of pycubed_rfm9x.RFM9x for RadioService"""
+    def __init__(self):
+        self.fifo = []
+        self.dio0_mapping = 0
+        self.requested_mode = 1
+        self.rx_claims = 0
+        self.unacked_duplicate = None
+        self.last_rssi = 0
+        self.last_snr = 0.0
+        self.listens = 0
+
+    def rx_done(self):
+        return bool(self.fifo)
+
+    @property
+    def operation_mode(self):
+        raise AssertionError('an SPI read')
+
+    def listen(self):
+        self.listens += 1
+        self.requested_mode = 5
+        self.dio0_mapping = 0
+
+    def receive_into(self, buf, **kwargs):
+        packet, self.last_rssi, self.last_snr = self.fifo.pop(0)
+        if packet is None:
+            return None
+        buf[:len(packet)] = packet
+        return len(packet)
+
+
+class TestPacketQueue(TestCase):
+    def test_bounded_pool(self):
+        queue = PacketQueue(count=2, size=8)
+        first, second = queue.acquire(), queue.acquire()
+        self.assertIsNone(queue.acquire())
+        self.assertEqual(queue.dropped, 1)
+        queue.put(first)
+        self.assertFalse(queue.full())
+        queue.put(second)
+        self.assertTrue(queue.full())
+        self.assertEqual(queue.capacity, 2)
+        self.assertIs(queue.get(), first)
+        queue.release(first)
+        self.assertIs(queue.acquire(), first, 'released packets are reused')
+        self.assertIs(queue.get(), second)
+        self.assertIsNone(queue.get())
+        self.assertEqual(queue.high_water, 2)
+        queue.release(second)
+        with self.assertRaises(ValueError):
+            queue.release(second)
+
+
+class TestRadioService(TestCase):
+    def test_drains_with_metadata(self):
+        radio = FakeRadio()
+        service = RadioService(radio, queue=PacketQueue(count=2))
+        radio.fifo.append((b'\xfa\xab\x01\x00hello', 100, 7.25))
+        radio.fifo.append((None, 0, 0))
+        loop = Loop()
+        loop.add_task(service.poll(), 1)
+        loop.add_task(service.poll(), 1)
+        loop._step()
+
+        packet = service.queue.get()
+        self.assertEqual(bytes(packet.data), b'hello')
+        self.assertEqual((packet.source, packet.destination, packet.identifier), (0xAB, 0xFA, 1))
+        self.assertEqual((packet.rssi, packet.snr), (100 - 137, 7.25))
+        self.assertEqual((service.received, service.rejected), (1, 1))
+
+    def test_listens_after_tx(self):
+        radio = FakeRadio()
+        service = RadioService(radio)
+        radio.dio0_mapping = 1
+        radio.requested_mode = 3
+        loop = Loop()
+        loop.add_task(service.poll(), 1)
+        loop._step()
+        self.assertEqual(radio.listens, 0, 'TxDone not yet handled by the sender')
+
+        # the sender ended without keep_listening
+        radio.requested_mode = 1
+        loop.add_task(service.poll(), 1)
+        loop._step()
+        self.assertEqual(radio.listens, 1)
+        self.assertEqual(radio.requested_mode, 5)
+
+    def test_leaves_claimed_receiver_alone(self):
+        radio = FakeRadio()
+        service = RadioService(radio)
+        radio.fifo.append((b'\xfa\xab\x01\x80!', 100, 0))
+        radio.rx_claims = 1
+        loop = Loop()
+        loop.add_task(service.poll(), 1)
+        loop._step()
+        self.assertEqual(len(radio.fifo), 1)
+        radio.rx_claims = 0
+        loop.add_task(service.poll(), 1)
+        loop._step()
+        self.assertEqual(service.received, 1)
+
+    def test_channels(self):
+        radio = FakeRadio()
+        service = RadioService(radio, queue=PacketQueue(count=3))
+        files = service.channel(1, count=1)
+        radio.fifo.append((b'\xfa\xab\x01\x01status', 100, 0))
+        radio.fifo.append((b'\xfa\xab\x02\x81status', 100, 0))
+        radio.fifo.append((b'\xfa\xab\x03\x00command', 100, 0))
+        loop = Loop()
+        for _ in range(3):
+            loop.add_task(service.poll(), 1)
+        loop._step()
+        self.assertEqual(files.get().identifier, 1, 'routed by the low nibble of the flags')
+        self.assertEqual(files.dropped, 1, 'channel backlog is bounded')
+        self.assertEqual(service.queue.get().identifier, 3)
+        self.assertEqual(service.queue.pool.available, 1, 'queues share one pool')
+
+
+class TestAckWindow(TestCase):
+    def test_ack_reaches_the_sender(self):
+        clock = Clock()
+        channel = Channel(clock)
+        sat, ground = make_radio(channel), make_radio(channel)
+        sat.node, sat.destination, ground.node = 0xFA, 0xAB, 0xAB
+        sat.ack_wait = 0.5
+        sat.tx_poll = 0.2  # the service polls more often than the ACK wait looks
+        service = RadioService(sat)
+        done = []
+
+        async def radio_task():
+            while not done:
+                await service.poll()
+                await tasko.sleep(0.01)
+
+        async def sender():
+            got = await sat.send_with_ack_async(b'hello')
+            done.append(True)
+            return got
+
+        async def station():
+            packet = await ground.receive_async(timeout=5, with_header=True)
+            header = bytes(packet[:4])
+            await tasko.sleep(0.3)
+            await ground.send_async(b'!', destination=header[1], identifier=header[2], flags=header[3] | 0x80)
+
+        _, got, _ = run_tasks(clock, radio_task(), sender(), station())
+        self.assertTrue(got)
+        self.assertEqual((sat.ack_stats.retries, service.received), (0, 0))
@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+from sx127x_sim import Channel, Clock, make_radio
+
+LENGTH = 0x20
+
+
+class TestReceiveAll(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.channel = Channel(self.clock)
+        self.sat = make_radio(self.channel)
+        self.ground = make_radio(self.channel)
+        self.sat.node, self.sat.destination = 0xFA, 0xAB
+        self.ground.node = 0xAB
+
+    def burst(self, payloads, **kwargs):
+        with self.clock.patch():
+            for payload in payloads:
+                self.ground.send_burst(payload, **kwargs)
+
+    def drain(self):
+        with self.clock.patch():
+            return [bytes(p) for p in self.sat.receive_all()]
+
+    def test_back_to_back(self):
+        self.sat.listen_burst()
+        # header-like bytes in the payload used to confuse the old valid_ids scan
+        payloads = [bytes([58, 59, 60, 255]) * 5, b'x' * 100, bytes([0xFA, 0xAB, 0, 0]) * 3, b'last']
+        self.burst(payloads, destination=0xFA, node=0xAB)
+        packets = self.drain()
+        self.assertEqual(len(packets), 4)
+        for packet, payload in zip(packets, payloads):
+            self.assertEqual(packet[:4], bytes([0xFA, 0xAB, 0, LENGTH]))
+            self.assertEqual(packet[4], len(packet))
+            self.assertEqual(packet[5:], payload)
+        self.assertEqual(self.drain(), [])
+        # the radio kept listening and the next drain picks up from there, across the FIFO wrap
+        more = [bytes([i]) * 60 for i in range(3)]
+        self.burst(more, destination=0xFA)
+        self.assertEqual([p[5:] for p in self.drain()], more)
+        stats = self.sat.link_stats
+        self.assertEqual((stats.rx_packets, self.sat.burst_errors), (7, 0))
+
+    def test_filters(self):
+        self.sat.listen_burst()
+        self.burst([b'for someone else'], destination=0x33)
+        self.burst([b'broadcast'], destination=0xFF)
+        self.burst([b'once', b'once'], destination=0xFA, identifier=5, flags=0x40)
+        packets = self.drain()
+        self.assertEqual([p[5:] for p in packets], [b'broadcast', b'once'])
+        self.assertEqual(self.sat.link_stats.header_rejects, 1)
+        self.assertEqual(self.sat.duplicates.dropped, 1)
+
+    def test_unframed_packets_are_dropped_not_guessed(self):
+        self.sat.listen_burst()
+        with self.clock.patch():
+            self.ground.send(b'no length byte', destination=0xFA)
+            self.ground.send(b'nor here', destination=0xFA)
+            self.ground.send_burst(b'framed', destination=0xFA)
+            self.ground.send(b'latest', destination=0xFA)
+        self.assertEqual(self.drain(), [bytes([0xFA, 0xAB, 0, 0]) + b'latest'])
+        self.assertEqual(self.sat.burst_errors, 1)
+
+    def test_without_listen_burst(self):
+        with self.clock.patch():
+            self.sat.listen()
+        self.burst([b'one', b'two'], destination=0xFA)
+        # only the latest packet's position is known
+        self.assertEqual([p[5:] for p in self.drain()], [b'two'])
+        self.burst([b'three', b'four'], destination=0xFA)
+        self.assertEqual([p[5:] for p in self.drain()], [b'three', b'four'])
+
+    def test_crc_error_on_the_latest(self):
+        self.sat.enable_crc = True
+        self.sat.listen_burst()
+        self.burst([b'good'], destination=0xFA)
+        self.sat.chip.deliver(bytes([0xFA, 0xAB, 0, LENGTH, 8]) + b'bad', crc_error=True)
+        self.assertEqual([p[5:] for p in self.drain()], [b'good'])
+        self.assertEqual(self.sat.link_stats.crc_errors, 1)
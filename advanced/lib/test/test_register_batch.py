@@ -0,0 +1,72 @@
+import os
+from unittest import TestCase
+
+from sx127x_sim import Clock, make_radio
+from pycubed_rfm9x import ModemProfile
+
+# BENCH=1 python -m pytest -s prints the benchmark numbers
+BENCH = os.environ.get('BENCH')
+
+MODEM = (0x1D, 0x1E, 0x26, 0x2F, 0x30, 0x31, 0x37)
+
+
+class TestRegisterBatch(TestCase):
+    """bus locks and chip selects the RFM9x spends on its modem settings"""
+    def setUp(self):
+        self.clock = Clock()
+        self.radio = make_radio(clock=self.clock)
+        self.chip = self.radio.chip
+        self.locks = self.selects = 0
+        select = self.chip.select
+        try_lock = self.chip.bus.try_lock
+
+        def counting_select():
+            self.selects += 1
+            select()
+
+        def counting_lock():
+            locked = try_lock()
+            self.locks += locked
+            return locked
+        self.chip.select = counting_select
+        self.chip.bus.try_lock = counting_lock
+
+    def count(self, change):
+        self.locks = self.selects = 0
+        with self.clock.patch():
+            change()
+        return self.locks, self.selects
+
+    def setters(self):
+        radio = self.radio
+        radio.signal_bandwidth = 62500
+        radio.coding_rate = 8
+        radio.spreading_factor = 9
+        radio.enable_crc = True
+
+    def test_setters(self):
+        radio = self.radio
+        # 1D from the shadow, then 2F/30 in one burst
+        self.assertEqual(self.count(lambda: setattr(radio, 'signal_bandwidth', 62500)), (1, 2))
+        # 31 and 37, then 1E from the shadow
+        self.assertEqual(self.count(lambda: setattr(radio, 'spreading_factor', 9)), (1, 3))
+        # one lock per setter; without the shadow the read-modify-writes read the chip first
+        shadowed = self.count(self.setters)
+        radio.invalidate_shadow()
+        cold = self.count(self.setters)
+        self.assertEqual(shadowed, (4, 7))
+        self.assertEqual(cold, (6, 9))
+        if BENCH:
+            print('\nmodem setters: {} bus locks, {} chip selects ({}, {} with a cold shadow)'.format(
+                shadowed[0], shadowed[1], *cold))
+
+    def test_profile(self):
+        self.setters()
+        expected = bytes(self.chip.registers[a] for a in MODEM)
+        profile = self.radio.snapshot()
+        with self.clock.patch():
+            self.radio.reset()
+        # the mode change (OP_MODE read and written), then every modem register under one lock,
+        # a burst per range
+        self.assertEqual(self.count(lambda: self.radio.apply_profile(profile)), (2, 2 + len(ModemProfile.RANGES)))
+        self.assertEqual(bytes(self.chip.registers[a] for a in MODEM), expected)
@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+from sx127x_sim import Clock, make_radio, TX
+
+CONFIG2 = 0x1E
+SYNC_WORD = 0x39  # not shadowed
+
+
+class TestRegisterShadow(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.radio = make_radio(clock=self.clock)
+        self.chip = self.radio.chip
+        self.transactions = 0
+        select = self.chip.select
+
+        def counting():
+            self.transactions += 1
+            select()
+        self.chip.select = counting
+
+    def test_write_through(self):
+        self.radio.spreading_factor = 9
+        self.assertEqual(self.chip.registers[CONFIG2] >> 4, 9)
+        before = self.transactions
+        self.assertEqual(self.radio.spreading_factor, 9)
+        self.radio.enable_crc = True
+        # the read and the read-modify-write came from the shadow: one write on the bus
+        self.assertEqual(self.transactions - before, 1)
+        self.assertEqual(self.chip.registers[CONFIG2], 0x94)
+        # registers the chip changes by itself are always read
+        before = self.transactions
+        self.radio._read_u8(SYNC_WORD)
+        self.radio._read_u8(SYNC_WORD)
+        self.assertEqual(self.transactions - before, 2)
+
+    def test_verify_shadow(self):
+        self.radio.spreading_factor = 9
+        self.assertEqual(self.radio.verify_shadow(), 0)
+        # something changed the chip behind the driver's back, e.g. a brown-out reset
+        self.chip.registers[CONFIG2] = 0x70
+        self.assertEqual(self.radio.spreading_factor, 9, 'stale until checked')
+        self.assertEqual(self.radio.verify_shadow(), 1)
+        self.assertEqual((self.radio.shadow_mismatches, self.radio.shadow_mismatch), (1, CONFIG2))
+        self.assertEqual(self.radio.spreading_factor, 7, 'the chip wins')
+        self.assertFalse(self.radio.shadow_debug)
+        # shadow_debug checks every read
+        self.chip.registers[CONFIG2] = 0x80
+        self.radio.shadow_debug = True
+        self.assertEqual(self.radio.spreading_factor, 8)
+        self.assertEqual(self.radio.shadow_mismatches, 2)
+
+    def test_reset_invalidates(self):
+        with self.clock.patch():
+            self.radio.spreading_factor = 9
+            self.radio.reset()
+        self.assertEqual(self.radio.spreading_factor, 7)
+        self.assertEqual(self.radio.verify_shadow(), 0)
+
+    def test_cw_invalidates(self):
+        # the sim has no FSK modem: finish the OOK transmission as soon as it starts
+        chip = self.chip
+        set_mode = chip._set_mode
+
+        def ook_tx(value):
+            set_mode(value)
+            if not chip.lora and chip.mode == TX:
+                chip.registers[0x3F] |= 0x40
+        chip._set_mode = ook_tx
+
+        self.radio.spreading_factor = 9
+        self.radio.enable_crc = True
+        with self.clock.patch():
+            self.assertTrue(self.radio.cw())
+        # FSK writes to the LoRa addresses (e.g. 0x26) didn't leave the shadow stale,
+        # and the LoRa settings are back
+        self.assertEqual(self.radio.verify_shadow(), 0)
+        self.assertTrue(chip.lora)
+        self.assertEqual(chip.registers[CONFIG2], 0x94)
+        self.assertEqual(self.radio.spreading_factor, 9)
@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+import tasko
+from tasko.managed_resource import ManagedResource
+from sx127x_sim import Channel, Clock, make_radio, run_tasks, STANDBY
+
+
+class TestSendAsync(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.channel = Channel(self.clock)
+        self.sat = make_radio(self.channel)
+        self.ground = make_radio(self.channel)
+        self.bus = ManagedResource(None)
+        self.lease = self.bus.handle()
+        self.transactions = 0
+        select = self.sat.chip.select
+
+        def counting():
+            self.transactions += 1
+            select()
+        self.sat.chip.select = counting
+
+    def send(self, data=b'x' * 100, **kwargs):
+        """send_async with another task using the bus meanwhile; (result, bus turns taken during the send)"""
+        turns = []
+        done = []
+
+        async def sender():
+            result = await self.sat.send_async(data, lease=self.lease, **kwargs)
+            done.append(True)
+            return result
+
+        async def other():
+            handle = self.bus.handle()
+            while not done:
+                async with handle:
+                    turns.append(self.clock.now)
+                await tasko.sleep(0.05)
+
+        with self.clock.patch():
+            self.ground.listen()
+        result, _ = run_tasks(self.clock, sender(), other())
+        return result, len(turns)
+
+    def received(self):
+        with self.clock.patch():
+            return self.ground.receive(timeout=0)
+
+    def test_dio0(self):
+        airtime = self.sat.time_on_air(104)
+        result, turns = self.send()
+        self.assertTrue(result)
+        self.assertEqual(self.received(), b'x' * 100)
+        # the bus was free during the airtime, and waiting cost no SPI traffic:
+        # the transactions are the FIFO fill, the mode changes and the IRQ clear
+        self.assertGreaterEqual(turns, int(airtime / 0.05) - 1)
+        self.assertLess(self.transactions, 20)
+
+    def test_irq_polling(self):
+        self.sat.dio0 = False
+        airtime = self.sat.time_on_air(104)
+        result, turns = self.send()
+        self.assertTrue(result)
+        self.assertEqual(self.received(), b'x' * 100)
+        self.assertGreaterEqual(turns, int(airtime / 0.05) - 1)
+        # one IRQ flags read per tx_poll
+        self.assertGreater(self.transactions, airtime / self.sat.tx_poll)
+
+    def test_timeout_releases_the_lease(self):
+        radio = make_radio(clock=self.clock)  # no channel: the packet never finishes
+        radio.xmit_timeout = 0.5
+        self.sat = radio
+        result, turns = self.send()
+        self.assertFalse(result)
+        self.assertEqual(radio.link_stats.tx_timeouts, 1)
+        self.assertFalse(self.bus._owned)
+        self.assertGreater(turns, 5)
+        self.assertEqual(radio.chip.mode, STANDBY)
+        self.assertFalse(radio.chip.registers[0x12], 'irq flags cleared')
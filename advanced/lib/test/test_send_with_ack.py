@@ -0,0 +1,122 @@
+from unittest import TestCase
+
+import tasko
+from airtime import AirtimeBudget
+from sx127x_sim import Channel, Clock, make_radio, run_tasks
+
+
+class TestSendWithAckAsync(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.channel = Channel(self.clock)
+        self.sat = make_radio(self.channel)
+        self.ground = make_radio(self.channel)
+        for radio in (self.sat, self.ground):
+            radio.ack_wait = 0.5
+            radio.ack_retries = 3
+        self.sat.node, self.sat.destination = 0xFA, 0xAB
+        self.ground.node = 0xAB
+        # the station counts retries too
+        self.ground.duplicates = None
+
+    def station(self, answer):
+        """ground task: ACKs the packets for which answer(n) is true, n counting from 0"""
+        heard = []
+
+        async def station():
+            while True:
+                packet = await self.ground.receive_async(timeout=10, with_header=True)
+                if packet is None:
+                    return heard
+                header = bytes(packet[:4])
+                heard.append(header)
+                if answer(len(heard) - 1):
+                    await tasko.sleep(0.02)
+                    await self.ground.send_async(b'!', destination=header[1], identifier=header[2],
+                                                 flags=header[3] | 0x80, keep_listening=True)
+        return station()
+
+    def test_acked(self):
+        got, heard = run_tasks(self.clock, self.sat.send_with_ack_async(b'hello'), self.station(lambda n: True),
+                               limit=15)
+        self.assertTrue(got)
+        s = self.sat.ack_stats
+        self.assertEqual((s.sends, s.acked, s.failed, s.transmissions, s.retries), (1, 1, 0, 1, 0))
+        self.assertEqual(s.last_rtt, s.rtt_min)
+        self.assertGreater(s.rtt_min, self.sat.time_on_air(9) + self.sat.time_on_air(5))
+
+    def test_retry_after_lost_ack(self):
+        got, heard = run_tasks(self.clock, self.sat.send_with_ack_async(b'hello'), self.station(lambda n: n > 0),
+                               limit=15)
+        self.assertTrue(got)
+        # same identifier, retry flag on the second one
+        self.assertEqual([h[2:] for h in heard], [bytes([1, 0]), bytes([1, 0x40])])
+        s = self.sat.ack_stats
+        self.assertEqual((s.acked, s.transmissions, s.retries), (1, 2, 1))
+        self.assertEqual(self.sat.flags, 0)
+
+    def test_gives_up(self):
+        got, heard = run_tasks(self.clock, self.sat.send_with_ack_async(b'hello'), self.station(lambda n: False),
+                               limit=15)
+        self.assertFalse(got)
+        self.assertEqual(len(heard), 3)
+        s = self.sat.ack_stats
+        self.assertEqual((s.sends, s.acked, s.failed, s.transmissions, s.retries), (1, 0, 1, 3, 3))
+        self.assertEqual(self.sat.link_stats.ack_failures, 1)
+
+    def test_budget_refusal_is_not_retried(self):
+        with self.clock.patch():
+            self.sat.airtime_budget = AirtimeBudget(0.01, 3600)  # less than one packet
+        start = self.clock.now
+        got, = run_tasks(self.clock, self.sat.send_with_ack_async(b'hello'))
+        self.assertFalse(got)
+        s = self.sat.ack_stats
+        self.assertEqual((s.failed, s.refused, s.transmissions, s.retries), (1, 1, 0, 0))
+        self.assertEqual(self.sat.link_stats.tx_packets, 0)
+        # no ACK window, no backoff
+        self.assertLess(self.clock.now - start, 0.1)
+
+    def test_tx_timeout_skips_the_ack_window(self):
+        radio = make_radio(clock=self.clock)  # no channel: transmissions never finish
+        radio.destination = 0xAB
+        radio.xmit_timeout = 0.2
+        radio.ack_retries = 2
+        got, = run_tasks(self.clock, radio.send_with_ack_async(b'hello'))
+        self.assertFalse(got)
+        s = radio.ack_stats
+        self.assertEqual((s.failed, s.refused, s.transmissions, s.retries), (1, 0, 0, 2))
+        self.assertEqual(radio.link_stats.rx_timeouts, 0, 'never listened for an ACK')
+
+
+class TestReceiveAsync(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.radio = make_radio(clock=self.clock)
+        self.chip = self.radio.chip
+
+    def test_timeout(self):
+        start = self.clock.now
+        packet, = run_tasks(self.clock, self.radio.receive_async(timeout=0.3))
+        self.assertIsNone(packet)
+        self.assertGreaterEqual(self.clock.now - start, 0.3)
+        self.assertEqual(self.radio.link_stats.rx_timeouts, 1)
+
+    def test_other_tasks_run_while_waiting(self):
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(self.clock.now)
+                await tasko.sleep(0.05)
+            self.chip.deliver(bytes([0xFF, 0xAB, 1, 0]) + b'hello')
+
+        packet, _ = run_tasks(self.clock, self.radio.receive_async(timeout=5, with_header=True), ticker())
+        self.assertEqual(packet, bytes([0xFF, 0xAB, 1, 0]) + b'hello')
+        self.assertEqual(len(ticks), 5)
+        self.assertEqual(self.radio.link_stats.rx_packets, 1)
+
+    def test_irq_polling(self):
+        self.radio.dio0 = False
+        self.chip.deliver(bytes([0xFF, 0xAB, 1, 0]) + b'polled')
+        packet, = run_tasks(self.clock, self.radio.receive_async(timeout=1))
+        self.assertEqual(packet, b'polled')
@@ -0,0 +1,137 @@
+import os
+from unittest import TestCase
+
+import tasko
+from sx127x_sim import Channel, Clock, make_radio, run_tasks
+from radio_service import RadioService
+
+# BENCH=1 python -m pytest -s prints the benchmark numbers
+BENCH = os.environ.get('BENCH')
+
+POLL = 0.1  # the radio task runs at 10Hz
+
+
+class TestSniff(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.channel = Channel(self.clock)
+        self.sat = make_radio(self.channel)
+        self.ground = make_radio(self.channel)
+        self.sat.node, self.ground.node = 0xFA, 0xAB
+        self.service = RadioService(self.sat)
+
+    def run_link(self, preamble, duration=60.0, every=7.0):
+        self.ground.preamble_length = preamble
+        with self.clock.patch():
+            self.service.sniff(1.0, window=0.5)
+
+        async def radio_task():
+            while self.clock.now < end:
+                await self.service.poll()
+                await tasko.sleep(POLL)
+
+        async def ground():
+            i = 0
+            while self.clock.now + every < end:
+                await tasko.sleep(every)
+                await self.ground.send_async(b'uplink %d' % i, destination=0xFA)
+                i += 1
+            return i
+
+        end = self.clock.now + duration
+        _, sent = run_tasks(self.clock, radio_task(), ground(), limit=duration + 1)
+        received = []
+        packet = self.service.queue.get()
+        while packet is not None:
+            received.append(bytes(packet.data))
+            self.service.queue.release(packet)
+            packet = self.service.queue.get()
+        return sent, received
+
+    def test_wakes_for_long_preambles(self):
+        preamble = self.sat.wake_preamble(1.0 + 2 * POLL)
+        self.assertEqual(preamble, 1179)  # 1.2s of 1.024ms symbols, plus 8
+        sent, received = self.run_link(preamble)
+        stats = self.service.sniff_stats
+        fraction = stats.rx_fraction(self.clock.now)
+        if BENCH:
+            print('\nsniff 1s: {} of {} packets, {} CADs, {:.1%} of the time in RX'.format(
+                len(received), sent, stats.cads, fraction))
+        self.assertEqual(received, [b'uplink %d' % i for i in range(sent)])
+        self.assertEqual(stats.detections, sent)
+        self.assertEqual(stats.false_wakes, 0)
+        self.assertGreater(stats.cads, 40)
+        # each packet costs its preamble and a window in RX, versus 100% in continuous RX
+        self.assertLess(fraction, 0.25)
+
+    def test_short_preambles_are_missed(self):
+        sent, received = self.run_link(8)
+        self.assertLess(len(received), sent // 2)
+
+    def test_back_to_continuous(self):
+        with self.clock.patch():
+            self.service.sniff(1.0)
+            self.service.sniff(None)
+        self.ground.preamble_length = 8
+
+        async def radio_task():
+            for _ in range(20):
+                await self.service.poll()
+                await tasko.sleep(POLL)
+
+        async def ground():
+            await tasko.sleep(0.5)
+            await self.ground.send_async(b'hello', destination=0xFA)
+
+        run_tasks(self.clock, radio_task(), ground())
+        self.assertEqual(len(self.service.queue), 1)
+
+    def test_own_transmission(self):
+        with self.clock.patch():
+            self.service.sniff(1.0)
+            self.ground.listen()
+        done = []
+
+        async def radio_task():
+            while not done:
+                await self.service.poll()
+                await tasko.sleep(POLL)
+
+        async def send():
+            # 200 bytes at SF7 is on the air for several polls
+            await tasko.sleep(0.25)
+            result = await self.sat.send_async(b'x' * 200, destination=0xAB)
+            done.append(True)
+            return result
+
+        _, sent = run_tasks(self.clock, radio_task(), send())
+        self.assertTrue(sent)
+        self.assertEqual((self.channel.sent, self.channel.delivered), (1, 1))
+        with self.clock.patch():
+            self.assertEqual(self.ground.receive(timeout=0), b'x' * 200)
+
+
+class TestListenBeforeTalk(TestCase):
+    def test_defers_to_a_preamble_on_the_air(self):
+        clock = Clock()
+        channel = Channel(clock)
+        sat, ground, other = make_radio(channel), make_radio(channel), make_radio(channel)
+        other.preamble_length = 200  # 0.2s of preamble
+        sat.listen_before_talk = True
+        results = []
+
+        async def busy():
+            await other.send_async(b'x' * 50)
+
+        async def talk():
+            await tasko.sleep(0.05)
+            with clock.patch():
+                ground.listen()
+            results.append(await sat.send_async(b'hello'))
+            results.append(clock.now)
+
+        run_tasks(clock, busy(), talk())
+        self.assertTrue(results[0])
+        self.assertGreater(sat.lbt_deferrals, 0)
+        self.assertEqual(channel.collisions, 0)
+        self.assertEqual(sat.link_stats.tx_packets, 1)
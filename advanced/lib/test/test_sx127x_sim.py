@@ -0,0 +1,123 @@
+import os
+from unittest import TestCase
+
+import tasko
+from sx127x_sim import Channel, Clock, make_radio, run_tasks
+
+# BENCH=1 python -m pytest -s prints the benchmark numbers
+BENCH = os.environ.get('BENCH')
+
+
+def pair(**kwargs):
+    clock = Clock()
+    channel = Channel(clock, **kwargs)
+    sat = make_radio(channel)
+    ground = make_radio(channel)
+    for radio in (sat, ground):
+        radio.enable_crc = True
+        radio.ack_wait = 0.5
+        radio.ack_retries = 5
+    sat.node, sat.destination = 0xFA, 0xAB
+    ground.node, ground.destination = 0xAB, 0xFA
+    return clock, channel, sat, ground
+
+
+class TestSimulator(TestCase):
+    def test_send_receive(self):
+        clock, channel, sat, ground = pair()
+        with clock.patch():
+            ground.listen()
+            start = clock.now
+            self.assertTrue(sat.send(b'hello ground'))
+            sent = clock.now
+            packet = ground.receive(timeout=1, with_header=True)
+        self.assertEqual(bytes(packet), bytes([0xAB, 0xFA, 0, 0]) + b'hello ground')
+        # the send returns after the time on air, plus a few register accesses
+        self.assertAlmostEqual(sent - start, sat.time_on_air(16), places=3)
+        self.assertEqual((channel.sent, channel.delivered), (1, 1))
+        self.assertEqual((sat.link_stats.tx_packets, ground.link_stats.rx_packets), (1, 1))
+        self.assertEqual(ground.last_rssi - 137, -100)  # raw register value
+        self.assertEqual(ground.last_snr, 5.0)
+
+    def test_settings_must_match(self):
+        clock, channel, sat, ground = pair()
+        ground.spreading_factor = 9
+        with clock.patch():
+            ground.listen()
+            sat.send(b'hello')
+            self.assertIsNone(ground.receive(timeout=0.5))
+        self.assertEqual(channel.delivered, 0)
+
+    def test_bit_errors_fail_the_crc(self):
+        clock, channel, sat, ground = pair(ber=0.01)
+        with clock.patch():
+            for _ in range(20):
+                ground.listen()
+                sat.send(b'x' * 100)
+                ground.receive(timeout=1)
+        self.assertGreater(channel.corrupted, 15)
+        self.assertEqual(ground.link_stats.crc_errors, channel.corrupted)
+        self.assertEqual(ground.link_stats.rx_packets, 20 - channel.corrupted)
+
+    def test_collision(self):
+        clock, channel, sat, ground = pair()
+        other = make_radio(channel)
+        with clock.patch():
+            ground.listen()
+            other.send(b'x' * 50, keep_listening=False)  # blocks until done
+            self.assertFalse(channel.busy())
+            sat.listen()
+            # start both, then let the clock run
+            other.chip._write_register(0x01, 0x83)
+            sat.chip._write_register(0x01, 0x83)
+            self.assertTrue(channel.busy(ground.chip))
+            clock.advance(1)
+        self.assertEqual(channel.collisions, 2)  # both packets are lost
+        self.assertEqual(channel.delivered, 1)
+
+    def arq(self, count, size, **kwargs):
+        clock, channel, sat, ground = pair(**kwargs)
+        # receive_async ACKs the retries it drops itself, after the same delay
+        ground.ack_delay = 0.02
+        received = []
+
+        async def downlink():
+            acked = 0
+            for i in range(count):
+                acked += await sat.send_with_ack_async(bytes([i]) * size)
+            return acked
+
+        async def station():
+            # ACKs by hand: receive(with_ack=True) would block the shared loop for ack_delay,
+            # and without a delay the ACK goes out before the sender is back in RX
+            while len(received) < count:
+                packet = await ground.receive_async(timeout=10, with_header=True)
+                if packet is None:
+                    continue
+                header = bytes(packet[:4])
+                await tasko.sleep(ground.ack_delay)
+                await ground.send_async(b'!', destination=header[1], identifier=header[2],
+                                        flags=header[3] | 0x80, keep_listening=True)
+                received.append(bytes(packet[4:]))
+
+        start = clock.now
+        acked, _ = run_tasks(clock, downlink(), station(), limit=count * 30)
+        return acked, received, clock.now - start, sat
+
+    def test_arq_throughput(self):
+        if BENCH:
+            print('\nloss  ber     acked  goodput B/s  rtt min/mean/max (s)')
+        results = {}
+        for loss, ber in ((0.0, 0.0), (0.2, 0.0), (0.0, 2e-4)):
+            acked, received, elapsed, sat = self.arq(20, 200, loss=loss, ber=ber)
+            goodput = len(received) * 200 / elapsed
+            stats = sat.ack_stats
+            if BENCH:
+                print('{:.1f}   {:<6}  {:5}  {:11.1f}  {:.3f}/{:.3f}/{:.3f}'.format(
+                    loss, ber, acked, goodput, stats.rtt_min, stats.rtt_mean, stats.rtt_max))
+            results[loss, ber] = goodput
+            self.assertEqual(acked, 20)
+            self.assertEqual(received, [bytes([i]) * 200 for i in range(20)])
+            self.assertGreaterEqual(stats.rtt_min, sat.time_on_air(204) + sat.time_on_air(5))
+        self.assertLess(results[0.2, 0.0], results[0.0, 0.0])
+        self.assertLess(results[0.0, 2e-4], results[0.0, 0.0])
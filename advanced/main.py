@@ -13,6 +13,7 @@ print('\n{lines}\n{:^40}\n{lines}\n'.format('Beep-Sat Demo',lines='-'*40))
 
 print('Initializing PyCubed Hardware...')
 import os, tasko, traceback
+from tasko import checkpoint
 from pycubed import cubesat
 
 # create asyncio object
@@ -45,6 +46,14 @@ for file in os.listdir('Tasks'):
     cubesat.scheduled_tasks[task_obj.name]=schedule(task_obj.frequency,task_obj.main_task,task_obj.priority)
 print(len(cubesat.scheduled_tasks),'total')
 
+# resume each task's schedule from the last checkpoint so reset loops don't starve slow tasks
+if cubesat.schedfile is not None:
+    try:
+        with open(cubesat.schedfile,'rb') as f:
+            print('Resumed',checkpoint.restore(cubesat.scheduled_tasks,f.read()),'task schedules')
+    except OSError:
+        pass
+
 print('Running...')
 try:
     # should run forever
@@ -59,6 +68,11 @@ except Exception as e:
         cubesat.log(f'{formatted_exception},{cubesat.c_state_err},{cubesat.c_boot}')
     except:
         pass
+    try:
+        # save where each task was in its schedule before we reset
+        cubesat.save_schedule()
+    except OSError as e:
+        print('schedule not saved:',e)
 
 # we shouldn't be here!
 print('Engaging fail safe: hard reset')